@@ -1,17 +1,10 @@
 import logging
-import os
-from dotenv import load_dotenv
 from typing import List
 from pydantic import BaseModel
-from openai import OpenAI, OpenAIError
+from openai import OpenAIError
 
-# Load environment variables
-load_dotenv()
-api_key = os.getenv("OPENAI_API_KEY")
-print("Loaded key:", api_key)
-
-# Initialize the OpenAI client
-client = OpenAI(api_key=api_key)
+# Completions go through the shared provider (OpenAI, or the offline fake via LLM_PROVIDER)
+from app_refactor.llm import complete_text
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -24,7 +17,7 @@ class TherapistInsights(BaseModel):
 
 class AITherapist:
     @staticmethod
-    def generate_insights(journal: str, goals: dict) -> TherapistInsights:
+    async def generate_insights(journal: str, goals: dict) -> TherapistInsights:
         try:
             prompt = f"""
             You are a compassionate AI therapist analyzing a user's journal entry and goals.
@@ -46,8 +39,8 @@ class AITherapist:
             Respond with empathy, focusing on support and positive growth.
             """.strip()
 
-            response = client.chat.completions.create(
-                model="gpt-4-turbo-preview",
+            ai_response = await complete_text(
+                route="insight",
                 messages=[
                     {
                         "role": "system",
@@ -62,7 +55,6 @@ class AITherapist:
                 temperature=0.7
             )
 
-            ai_response = response.choices[0].message.content
             return AITherapist._parse_therapist_response(ai_response)
 
         except OpenAIError as e:
@@ -93,10 +85,10 @@ class AITherapist:
         )
 
     @staticmethod    
-    def continue_conversation(message: str) -> str:
+    async def continue_conversation(message: str) -> str:
         try:
-            response = client.chat.completions.create(
-                model="gpt-4-turbo-preview",
+            return await complete_text(
+                route="insight",
                 messages=[
                     {
                         "role": "system",
@@ -111,8 +103,6 @@ class AITherapist:
                 temperature=0.7
             )
 
-            return response.choices[0].message.content
-
         except OpenAIError as e:
             logger.error(f"OpenAI API error during conversation: {e}")
             raise
@@ -1,13 +1,10 @@
 import logging.config
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import FastAPI, HTTPException, Request, Header, Depends, status
+from fastapi import APIRouter, FastAPI, HTTPException, Request, Header, Depends, status
 from pydantic import BaseModel, Field
-from supabase import create_client, Client
 import os
 from dotenv import load_dotenv
 import logging
-import openai
-from openai import OpenAI
 from fastapi.responses import JSONResponse
 from datetime import date
 from uuid import UUID
@@ -16,34 +13,64 @@ from datetime import date
 from typing import List, Optional
 from datetime import datetime
 import json
+import asyncio
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone
-today = datetime.utcnow().date()
+from app_refactor.token_verifier import token_verifier, TokenVerificationError
+from app_refactor.db import get_supabase
+from app_refactor.idempotency import IdempotencyMiddleware, idempotency_store
+from app_refactor.repository import repository
+from app_refactor.pagination import PageParams, page_params
+from app_refactor.llm import complete_text, stream_text
+from app_refactor.llm_cache import llm_cache
+from app_refactor.llm_router import model_router
+from app_refactor.llm_scheduler import LLM_BUSY_RETRY_AFTER, LLMBusyError, llm_scheduler
+from app_refactor.logging_config import MessagesPayload, UserText, configure_logging, logging_stats
+from app_refactor.lifespan import lifespan as app_lifespan
+from app_refactor.message_writer import message_writer
+from app_refactor.shared_cache import shared_cache_stats
+from app_refactor.sse import sse_event, sse_response
+from app_refactor.telemetry import TelemetryMiddleware, TimedJSONResponse, metrics_response, span
+from app_refactor.prompt_builder import (
+    CHAT_SYSTEM_PROMPT, HISTORY_FETCH_LIMIT, SESSION_SYSTEM_PROMPT, build_chat_prompt,
+)
+from app_refactor.services import chat_service, journal_service, profile_service
+from app_refactor.services.profile_service import enforce_profile_schema
+from app_refactor.services.profile_refresh import ProfileRefreshScheduler
+from app_refactor.services.context_service import (
+    assemble_context,
+    context_cache_stats,
+    invalidate_user_context,
+)
 
 # Load environment variables from .env file
 load_dotenv()
 
 
-# Supabase Configuration
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
+# Supabase and OpenAI clients are shared async clients created lazily in
+# app_refactor.db / app_refactor.llm and warmed at startup by the lifespan in
+# app_refactor.lifespan; all table access goes through `repository`.
 
+logger = logging.getLogger(__name__)
 
+# Routes are collected on a router; create_app() at the bottom of this file
+# builds the application (middleware, lifespan) around it.
+router = APIRouter()
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+async def idempotency_owner(authorization: str) -> Optional[str]:
+    """User id behind an Authorization header, or None so the route can reject it."""
+    if not authorization:
+        return None
+    try:
+        return (await get_current_user(authorization)).id
+    except HTTPException:
+        return None
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler()
-    ]
-)
-logger = logging.getLogger(__name__)
+def model_busy(error: LLMBusyError) -> HTTPException:
+    """503 for a chat turn the LLM scheduler could not admit in time; the client may retry."""
+    logger.warning("Chat turn not admitted: %s", error)
+    return HTTPException(status_code=503, detail=str(error), headers={"Retry-After": str(LLM_BUSY_RETRY_AFTER)})
 
-# FastAPI App
-app = FastAPI()
 
 # CORS Middleware Configuration
 origins = [
@@ -52,19 +79,6 @@ origins = [
     "http://localhost:8000",
 ]
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[
-        "http://localhost:3000",
-        "https://aitherapist-production.up.railway.app",
-        "https://ai-therapist-seven.vercel.app"
-    ],
-    #llow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
 # Request Models
 
 
@@ -109,6 +123,8 @@ class JournalSummaryOut(BaseModel):
     end_date: date
     summary_text: str
     inserted_at: Optional[datetime] = None
+    # A journal in the range changed since; POST the range again to refresh it
+    stale: bool = False
 
     class Config:
          model_config = ConfigDict(from_attributes=True)
@@ -126,6 +142,10 @@ class ChatSummaryOut(BaseModel):
     class Config:
          model_config = ConfigDict(from_attributes=True)
 
+class ChatSummaryPage(BaseModel):
+    summaries: List[ChatSummaryOut]
+    next_cursor: Optional[str] = None
+
 class UserProfilePayload(BaseModel):
     profile_data: dict = Field(..., description="AI-generated user profile blob")
 
@@ -161,56 +181,51 @@ class UserProfileOut(BaseModel):
 
 #     return response.user  # ✅ Ensure this is an object, not a string
 
+async def get_remote_user(token: str):
+    return await (await get_supabase()).auth.get_user(token)
+
+
 async def get_current_user(authorization: Optional[str] = Header(None)):
     try:
-        logger.info(f"Authorization header: {authorization}")
-        
         if not authorization:
             logger.error("No authorization header provided")
             raise HTTPException(status_code=401, detail="Authorization header missing. Please log in.")
 
         token = authorization.replace("Bearer ", "").strip()
-        logger.info(f"Extracted token: {token[:20]}...")  # Only log first 20 chars for security
-
-        # Check if Supabase client is initialized
-        if not supabase:
-            logger.error("Supabase client not initialized")
-            raise HTTPException(status_code=500, detail="Authentication service unavailable")
-
-        # Validate the token with Supabase
-        response = supabase.auth.get_user(token)
-        logger.info(f"Supabase response type: {type(response)}")
-
-        if response.user is None:
-            logger.error("Invalid token - no user returned from Supabase")
-            raise HTTPException(status_code=401, detail="Invalid or expired token. Please log in again.")
-
-        logger.info(f"✅ User authenticated: {response.user.id}")
-        return response.user
 
+        # Verify the JWT locally (cached); only falls back to Supabase when no key is configured
+        with span("auth", "verify_token"):
+            user = await token_verifier.verify(
+                token,
+                remote_lookup=get_remote_user,
+            )
+        logger.debug("✅ User authenticated: %s", user.id)
+        return user
+
+    except TokenVerificationError as e:
+        logger.warning("Token rejected: %s", e)
+        raise HTTPException(status_code=401, detail="Invalid or expired token. Please log in again.")
     except HTTPException:
         raise  # Re-raise HTTP exceptions
     except Exception as e:
-        logger.exception(f"Unexpected error in get_current_user: {str(e)}")
+        logger.exception("Unexpected error in get_current_user: %s", e)
         raise HTTPException(status_code=500, detail="Authentication error")
 
 
-@app.post("/api/refresh", response_model=RefreshResponse)
+@router.post("/api/refresh", response_model=RefreshResponse)
 async def refresh_token(req: RefreshRequest):
     # Call supabase to rotate the session
-    result = supabase.auth.refresh_session(req.refresh_token)
-
-    # supabase-py returns a dict with 'data' and 'error'
-    err = result.get("error")
-    if err:
+    sb = await get_supabase()
+    try:
+        result = await sb.auth.refresh_session(req.refresh_token)
+    except Exception as err:
         # Something went wrong on the Supabase side
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=f"Refresh failed: {err}"
         )
 
-    data = result.get("data") or {}
-    session = data.get("session")
+    session = result.session
     if not session:
         # No session in the payload means refresh failed
         raise HTTPException(
@@ -220,12 +235,12 @@ async def refresh_token(req: RefreshRequest):
 
     # Optionally, set the new refresh token in an HttpOnly cookie:
     resp = JSONResponse(content={
-        "access_token": session["access_token"],
-        "refresh_token": session["refresh_token"],
+        "access_token": session.access_token,
+        "refresh_token": session.refresh_token,
     })
     resp.set_cookie(
         key="refresh_token",
-        value=session["refresh_token"],
+        value=session.refresh_token,
         httponly=True,
         secure=True,       # False on localhost/http
         samesite="strict"  # or "lax"
@@ -233,44 +248,36 @@ async def refresh_token(req: RefreshRequest):
     return resp
 
 # **User Signup Route**
-@app.post("/api/signup")
+@router.post("/api/signup")
 async def signup(user: UserSignup):
     try:
         # First, check if the user already exists
-        print(f"Attempting to sign up user with email: {user.email}")
+        logger.info("Signing up a new user")
         
         # Sign up the user with Supabase
-        response = supabase.auth.sign_up({"email": user.email, "password": user.password})
+        sb = await get_supabase()
+        response = await sb.auth.sign_up({"email": user.email, "password": user.password})
         
-        # Log the response
-        print("Supabase Signup Response:", response)
-
         if response.user is None:
-            print("Signup failed: User is None")
+            logger.warning("Signup failed: Supabase returned no user")
             raise HTTPException(status_code=400, detail="Signup failed. Check email/password validity.")
 
         try:
             # Try to save user email to database
-            print(f"Attempting to save user to database with ID: {response.user.id}")
-            supabase.table("Users").insert({
-                "user_id": response.user.id,  # Use the Supabase user ID as the primary key
-                "email": user.email,
-                "created_at": datetime.utcnow().isoformat()
-            }).execute()
-            print("Successfully saved user to database")
+            # Use the Supabase user ID as the primary key
+            await repository.create_user(response.user.id, user.email)
+            logger.info("Saved new user %s", response.user.id)
         except Exception as db_error:
             # If database save fails, continue with auth flow but log the error
-            print(f"Warning: Failed to save user to database: {str(db_error)}")
+            logger.warning("Failed to save user %s to database: %s", response.user.id, db_error)
             # This shouldn't stop the signup process
 
         try:
             # Try to sign in the user immediately after signup
-            print("Attempting to sign in the user after signup")
-            signin_response = supabase.auth.sign_in_with_password({"email": user.email, "password": user.password})
-            print("Signin response after signup:", signin_response)
+            signin_response = await sb.auth.sign_in_with_password({"email": user.email, "password": user.password})
             
             if signin_response.user is None:
-                print("Warning: Auto-login failed after signup")
+                logger.warning("Auto-login failed after signup for user %s", response.user.id)
                 # If sign-in fails after signup, still return success but without tokens
                 return {
                     "message": "User signed up successfully but auto-login failed. Please log in manually.",
@@ -279,7 +286,6 @@ async def signup(user: UserSignup):
                 }
 
             # Return both user info and tokens
-            print("Successfully signed up and logged in user")
             return {
                 "message": "User signed up successfully!",
                 "user_id": response.user.id,
@@ -289,23 +295,23 @@ async def signup(user: UserSignup):
             }
         except Exception as signin_error:
             # If auto-login fails, still consider signup successful
-            print(f"Auto-login failed after signup: {str(signin_error)}")
+            logger.warning("Auto-login failed after signup for user %s: %s", response.user.id, signin_error)
             return {
                 "message": "User signed up successfully but auto-login failed. Please log in manually.",
                 "user_id": response.user.id,
                 "email": response.user.email
             }
     except Exception as e:
-        print("Error during signup:", str(e))
-        print("Error details:", e)
+        logger.exception("Error during signup: %s", e)
         raise HTTPException(status_code=500, detail=f"Signup failed: {str(e)}")
 
 
 
 # **User Login Route**
-@app.post("/api/login")
+@router.post("/api/login")
 async def login(user: UserLogin):
-    response = supabase.auth.sign_in_with_password({"email": user.email, "password": user.password})
+    sb = await get_supabase()
+    response = await sb.auth.sign_in_with_password({"email": user.email, "password": user.password})
     
     if response.user is None:
         raise HTTPException(status_code=400, detail=response.error.message)
@@ -314,118 +320,82 @@ async def login(user: UserLogin):
 
 
 # 🚀 3️⃣ **Protected Route (Requires Authentication)**
-@app.get("/api/protected")
+@router.get("/api/protected")
 async def protected_route(user=Depends(get_current_user)):
     return {"message": "You have accessed a protected route!", "user": user}
 
 
 # Routes
-@app.get("/api/chat-history")
-async def get_chat_history(user =Depends(get_current_user)):
+@router.get("/api/chat-history")
+async def get_chat_history(page: PageParams = Depends(page_params), user =Depends(get_current_user)):
     user_id = user.id
     try:
-        logger.info(f"Fetching chat history for user {user_id}")
+        logger.info("Fetching chat history for user %s", user_id)
         
-        response = supabase.table("ChatHistory") \
-            .select("*") \
-            .eq("user_id", user_id) \
-            .order("created_at") \
-            .execute()
+        history, next_cursor = await repository.list_chat_history(user_id, page)
         
-        if not response.data:
-            logger.info(f"No chat history found for user {user_id}")
-            return {"messages": []}
+        if not history:
+            logger.info("No chat history found for user %s", user_id)
+            return {"messages": [], "next_cursor": None}
             
-        logger.info(f"Retrieved {len(response.data)} chat messages for user {user_id}")
-        return {"messages": response.data}
+        logger.info("Retrieved %s chat messages for user %s", len(history), user_id)
+        return {"messages": history, "next_cursor": next_cursor}
     except Exception as e:
-        logger.exception(f"Error retrieving chat history: {str(e)}")
+        logger.exception("Error retrieving chat history: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to retrieve chat history: {str(e)}")
 
-@app.post("/api/chat")
+@router.post("/api/chat")
 async def chat(message: ChatMessage, user =Depends(get_current_user)):
     user_id = user.id
     try:
-        logger.info(f"Received chat message from user {user_id}: {message.message[:30]}...")
+        logger.info("Received chat message from user %s: %s", user_id, UserText(message.message))
         
         # Get recent chat history
-        chat_history = supabase.table("ChatHistory") \
-            .select("*") \
-            .eq("user_id", user_id) \
-            .order("created_at", desc=True) \
-            .limit(10) \
-            .execute()
-        
-        # Format chat history for OpenAI
-        messages = [
-            {"role": "system", "content": """You are an empathetic therapist named Therapist. 
-            You help users process their thoughts and emotions through thoughtful conversation.
-            Use the provided context about the user's journal entries and previous chat
-            to give thoughtful, therapeutic responses. Focus on being supportive while
-            maintaining professional boundaries. Avoid giving medical advice.
-            Keep responses concise (2-3 paragraphs maximum) and focused on the user's immediate concerns.
-            Ask thoughtful follow-up questions to deepen the conversation.
-            """}
-        ]
-        
-        # Add context if provided
-        if message.context:
-            messages.append({"role": "system", "content": f"Context from user's journal entries and previous chats: {message.context}"})
-        
-        # Add chat history
-        if chat_history.data and len(chat_history.data) > 0:
-            # Reverse to get chronological order and limit to last 5 messages
-            relevant_history = list(reversed(chat_history.data))[:10]
-            for chat in relevant_history:
-                messages.append({"role": chat['role'], "content": chat['content']})
-        
-        # Add user's new message
-        messages.append({"role": "user", "content": message.message})
+        chat_history = await repository.recent_chat_history(user_id, limit=HISTORY_FETCH_LIMIT)
+
+        # Fit system prompt, client context and history into the token budget
+        prompt = build_chat_prompt(
+            system_prompt=CHAT_SYSTEM_PROMPT,
+            user_message=message.message,
+            context=message.context,
+            history=chat_history,
+        )
+        messages = prompt.messages
         
-        logger.info(f"Sending {len(messages)} messages to OpenAI")
-        logger.info("🔎 OpenAI payload messages:\n%s", json.dumps(messages, indent=2))
+        logger.info("Sending %d messages (%d tokens) to OpenAI", len(messages), prompt.token_count)
+        logger.debug("🔎 OpenAI payload messages:\n%s", MessagesPayload(messages))
 
         
         # Get response from OpenAI
-        response = client.chat.completions.create(
-            model="gpt-4o",
+        ai_response = await complete_text(
+            user=user_id,
+            route="chat",
             messages=messages,
             max_tokens=1000,
             temperature=0.7
         )
+        logger.info("Received response from OpenAI: %s", UserText(ai_response))
         
-        ai_response = response.choices[0].message.content
-        logger.info(f"Received response from OpenAI: {ai_response[:30]}...")
-        
-        # Save user message to database
-        user_msg_response = supabase.table("ChatHistory").insert({
-            "user_id": user_id,
-            "role": "user",
-            "content": message.message,
-            "created_at": datetime.utcnow().isoformat()
-        }).execute()
+        # Save user message and AI response to database
+        saved = await repository.insert_chat_history([
+            {"user_id": user_id, "role": "user", "content": message.message,
+             "created_at": datetime.utcnow().isoformat()},
+            {"user_id": user_id, "role": "assistant", "content": ai_response,
+             "created_at": datetime.utcnow().isoformat()},
+        ])
         
-        if not user_msg_response.data:
-            logger.warning(f"Failed to save user message to database: {user_msg_response}")
-        
-        # Save AI response to database
-        ai_msg_response = supabase.table("ChatHistory").insert({
-            "user_id": user_id,
-            "role": "assistant",
-            "content": ai_response,
-            "created_at": datetime.utcnow().isoformat()
-        }).execute()
-        
-        if not ai_msg_response.data:
-            logger.warning(f"Failed to save AI response to database: {ai_msg_response}")
+        if len(saved) < 2:
+            logger.warning("Failed to save chat messages to database: %s", saved)
         
         return {"response": ai_response}
         
+    except LLMBusyError as e:
+        raise model_busy(e)
     except Exception as e:
-        logger.exception(f"Error in chat endpoint: {str(e)}")
+        logger.exception("Error in chat endpoint: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/journals")
+@router.post("/api/journals")
 async def create_journal_entry(request: Request, user=Depends(get_current_user)):
     body = await request.json()
     journal_content = body.get("content")
@@ -436,98 +406,91 @@ async def create_journal_entry(request: Request, user=Depends(get_current_user))
 
     try:
         # 1. Upsert journal
-        supabase.table("Journals").upsert({
-        "user_id": user.id,
-        "journal_date": journal_date,
-        "content": journal_content
-    }, on_conflict="user_id, journal_date").execute()
+        await repository.upsert_journal(user.id, journal_date, journal_content)
 
 
         # 2. Summarize using OpenAI
-        prompt = f"Summarize the following journal entry with emotional insight:\n\n{journal_content}"
-        ai_summary = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are an empathetic AI therapist. Summarize the user's thoughts and feelings."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=300
-        ).choices[0].message.content
+        ai_summary = await journal_service.summarize_journal_entry(journal_content, user.id)
 
         # 3. Save journal summary
-        supabase.table("JournalSummaries").upsert({
-            "user_id": user.id,
-            "start_date": journal_date,
-            "end_date": journal_date,
-            "summary_text": ai_summary
-        }, on_conflict="user_id, start_date, end_date").execute()
+        await repository.upsert_journal_summary(user.id, journal_date, journal_date, ai_summary)
+        # Weekly/monthly summaries built from this day are now out of date
+        await repository.mark_journal_summaries_stale(user.id, journal_date)
+        invalidate_user_context(user.id)
 
+        profile_refresher.schedule(user.id)
         return {"message": "Journal and summary saved."}
 
     except Exception as e:
-        logger.exception(f"Failed to save journal: {e}")
+        logger.exception("Failed to save journal: %s", e)
         raise HTTPException(status_code=500, detail="Failed to save journal.")
 
 
-@app.get("/api/journal-dates")
+@router.get("/api/journal-dates")
 async def get_journal_dates(user =Depends(get_current_user)):
     user_id = user.id
     try:
-        response = supabase.table("Journals") \
-            .select("created_at") \
-            .eq("user_id", user_id) \
-            .execute()
-        
-        # Extract dates from the response
-        dates = [entry['created_at'] for entry in response.data]
+        dates = await repository.list_journal_dates(user_id)
         return {"dates": dates}
         
     except Exception as e:
         logger.exception("Error retrieving journal dates")
         raise HTTPException(status_code=500, detail=str(e))
         
-@app.get("/")
+@router.get("/")
 def health_check():
-    logger.info("Health check endpoint hit")
+    logger.debug("Health check endpoint hit")
     return {"message": "API is running!"}
 
-@app.get("/api/chat-sessions")
-async def get_user_chat_sessions(user = Depends(get_current_user)):
+@router.get("/metrics", include_in_schema=False)
+def metrics():
+    """Latency histograms and LLM token counters in Prometheus text format."""
+    return metrics_response()
+
+@router.get("/api/cache-stats")
+def cache_stats():
+    """Hit ratio and size of the in-process caches and the host-wide tier behind them."""
+    return {
+        **context_cache_stats(),
+        "token": token_verifier.stats(),
+        "llm": llm_cache.stats(),
+        "logging": logging_stats(),
+        "write_behind": message_writer.stats(),
+        "idempotency": idempotency_store.stats(),
+        "shared": shared_cache_stats(),
+        "llm_scheduler": llm_scheduler.stats(),
+        "llm_router": model_router.stats(),
+    }
+
+@router.get("/api/chat-sessions")
+async def get_user_chat_sessions(page: PageParams = Depends(page_params), user = Depends(get_current_user)):
     """
-    Retrieves all chat sessions for the currently authenticated user.
+    Retrieves one page of chat sessions (newest first) for the currently
+    authenticated user. Pass `next_cursor` back as `before` for older sessions.
     """
     user_id = user.id
     try:
-        logger.info(f"Fetching chat sessions for user {user_id}")
+        logger.info("Fetching chat sessions for user %s", user_id)
 
         # Query the ChatSessions table in Supabase
-        response = (
-    supabase.table("ChatSessions")
-    .select("session_id, created_at, notes")
-    .eq("user_id", user_id)
-    .order("created_at", desc=True)
-    .execute()
-)
-
-        # Log the raw response from Supabase for debugging if needed
-        # logger.debug(f"Supabase response for chat sessions: {response}")
+        sessions, next_cursor = await repository.list_chat_sessions(user_id, page)
 
-        if not response.data:
-            logger.info(f"No chat sessions found for user {user_id}")
-            return {"sessions": []}
+        if not sessions:
+            logger.info("No chat sessions found for user %s", user_id)
+            return {"sessions": [], "next_cursor": None}
 
-        logger.info(f"Retrieved {len(response.data)} chat sessions for user {user_id}")
+        logger.info("Retrieved %s chat sessions for user %s", len(sessions), user_id)
         # Return the sessions in the format expected by the frontend
-        return {"sessions": response.data}
+        return {"sessions": sessions, "next_cursor": next_cursor}
 
     except Exception as e:
-        logger.exception(f"Error retrieving chat sessions for user {user_id}: {str(e)}")
+        logger.exception("Error retrieving chat sessions for user %s: %s", user_id, e)
         raise HTTPException(status_code=500, detail=f"Failed to retrieve chat sessions: {str(e)}")
     
 
     # Add this somewhere with your other route definitions in app.py
 
-@app.post("/api/chat-sessions")
+@router.post("/api/chat-sessions")
 async def create_chat_session_endpoint(user = Depends(get_current_user)):
     """
     Creates a new chat session for the currently authenticated user for the current day,
@@ -539,7 +502,7 @@ async def create_chat_session_endpoint(user = Depends(get_current_user)):
     """
     user_id = user.id
     try:
-        logger.info(f"Attempting to create a new chat session for user {user_id}")
+        logger.info("Attempting to create a new chat session for user %s", user_id)
 
         # Insert a new session record.
         # The unique index unique_user_session_utc_date_idx will prevent duplicates
@@ -550,147 +513,75 @@ async def create_chat_session_endpoint(user = Depends(get_current_user)):
         #     # "notes": "New Session Started" # Optional: Add default notes if desired
         # }).select("session_id, created_at, notes").execute() # Select the columns needed
 
-        response = supabase.table("ChatSessions").insert({
-    "user_id": user_id,
-    # "notes": "New Session Started" # Optional
-}).execute() # Execute immediately after insert
-
-        # Log the raw response for debugging
-        # logger.debug(f"Supabase response for creating chat session: {response}")
+        # The context doesn't depend on the new row, so fetch both at once.
+        new_session, ctx = await asyncio.gather(
+            repository.create_chat_session(user_id),
+            assemble_context(user_id, chat_summary_since_days=7),
+        )
 
         # Check if data was returned (successful insert)
-        if response.data and len(response.data) > 0:
-            new_session = response.data[0]
-                # 2) Build "context" payload
-
-            # a) Journal summaries between 14 and 7 days ago
-            start = (today - timedelta(days=14)).isoformat()
-            end   = (today - timedelta(days=7)).isoformat()
-            journals_ctx = supabase.table("JournalSummaries") \
-                .select("start_date,end_date,summary_text") \
-                .eq("user_id", user_id) \
-                .gte("start_date", start) \
-                .lte("end_date",   end) \
-                .order("start_date", desc=True) \
-                .execute().data
-            
-            #Check if the profile exists
-            profile_res = supabase.table("UserProfiles") \
-                .select("profile_data") \
-                .eq("user_id", user_id) \
-                .execute()
-
-            if profile_res.data and len(profile_res.data) > 0:
-                profile_data = profile_res.data[0]["profile_data"]
-            else:
-                # Define the detailed initial profile structure
-                initial_default_profile = {
-                    "name": "New User",
-                    "ratings": [],
-                    "metadata": {
-                        "format": "JSONB",
-                        "source": "Initial Default Profile",
-                        "version": "1.0",
-                        "created_at": datetime.now(timezone.utc).isoformat()
-                    },
-                    "strengths": {},
-                    "weaknesses": {}
-                }
-                supabase.table("UserProfiles").insert({
-                    "user_id": user_id,
-                    "profile_data": initial_default_profile, # Use the new detailed structure
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                    
-                }).execute()
-                profile_data = initial_default_profile
-
-
-
-            # b) Most recent chat summary (previous session)
-            chats_ctx = supabase.table("ChatSummaries") \
-                .select("summary_text") \
-                .eq("user_id", user_id) \
-                .order("inserted_at", desc=True) \
-                .gte("inserted_at", (today - timedelta(days=7)).isoformat()) \
-                .limit(1) \
-                .execute().data
-
-            # Safely access chat summary
-            last_chat_summary = chats_ctx[0]["summary_text"] if chats_ctx and chats_ctx[0] else None
-
+        if new_session:
+            # Build "context" payload: journal summaries from 14 to 7 days ago,
+            # the most recent chat summary (previous week) and the profile
             context = {
-                "journal_summaries": journals_ctx,
-                "previous_chat_summary": last_chat_summary,
-                "user_profile": profile_data
+                "journal_summaries": ctx.journal_summaries,
+                "previous_chat_summary": ctx.last_chat_summary,
+                "user_profile": ctx.profile
             }
 
-            update_user_profile(user.id)
+            # Regenerate the profile in the background (debounced per user)
+            profile_refresher.schedule(user.id)
             return {"session": new_session, "context": context}
         
         else:
             # This case might happen if the insert failed silently or due to RLS/policy issues
             # not caught as exceptions, or if the unique constraint was violated but didn't error out cleanly (less likely)
-            logger.error(f"Failed to create or retrieve session data after insert attempt for user {user_id}. Response: {response}")
+            logger.error("Failed to create or retrieve session data after insert attempt for user %s.", user_id)
             raise HTTPException(status_code=500, detail="Failed to create chat session.")
 
     except Exception as e:
         # Catch potential errors, including unique constraint violations if they raise exceptions
         # You could specifically check for PostgreSQL error codes (e.g., '23505' for unique_violation)
         # from e.pgcode if using psycopg2 exceptions directly, or parse the error message.
-        logger.exception(f"Error creating chat session for user {user_id}: {str(e)}")
+        logger.exception("Error creating chat session for user %s: %s", user_id, e)
         # Improve error message if possible, e.g., detect unique violation
         if "unique constraint" in str(e).lower():
              raise HTTPException(status_code=409, detail="Chat session for today already exists.") # 409 Conflict
         raise HTTPException(status_code=500, detail=f"Failed to create chat session: {str(e)}")
     
-@app.get("/api/chat-sessions/{session_id}/messages")
-async def get_session_messages(session_id: str, user = Depends(get_current_user)):
+@router.get("/api/chat-sessions/{session_id}/messages")
+async def get_session_messages(
+    session_id: str,
+    page: PageParams = Depends(page_params),
+    user = Depends(get_current_user)
+):
     """
-    Retrieves all messages for a specific chat session belonging to the user.
+    Retrieves one page of messages (oldest first within the page) for a chat
+    session belonging to the user. By default this is the latest page; pass
+    `next_cursor` back as `before` for earlier messages.
     """
     user_id = user.id
-
-    
-    
-    # —— DEBUG BLOCK ——
-    all_resp = supabase.table("ChatMessages").select("*").execute()
-    logger.info(f"[DEBUG] total ChatMessages rows via supabase-py: {len(all_resp.data)}")
-    logger.debug(f"[DEBUG] sample rows: {all_resp.data[:3] if all_resp.data else []}")
-    
-    filtered = supabase.table("ChatMessages") \
-        .select("*") \
-        .eq("session_id", session_id) \
-        .execute()
-    logger.info(f"[DEBUG] filtered rows for session={session_id}: {len(filtered.data)}")
-    logger.debug(f"[DEBUG] filtered data: {filtered.data}")
-    # —— END DEBUG ——
-    
     try:
         # First, verify the session belongs to the user
-        session_check = supabase.table("ChatSessions") \
-            .select("session_id, user_id") \
-            .eq("session_id", session_id) \
-            .execute()
-        
-        logger.info(f"Session check returned {len(session_check.data)} rows: {session_check.data}")
+        session_row = await repository.get_chat_session(session_id)
         
         # Check if session exists and belongs to user
-        user_session = [s for s in session_check.data if s['user_id'] == user_id]
-        if not user_session:
-            if session_check.data:
-                logger.warning(f"Session {session_id} exists but doesn't belong to user {user_id}")
+        if not session_row or session_row['user_id'] != user_id:
+            if session_row:
+                logger.warning("Session %s exists but doesn't belong to user %s", session_id, user_id)
             else:
-                logger.warning(f"Session {session_id} not found")
-            return {"messages": []}
+                logger.warning("Session %s not found", session_id)
+            return {"messages": [], "next_cursor": None}
         
-        logger.info(f"Session verified. Found session {session_id} for user {user_id}")
+        logger.info("Session verified. Found session %s for user %s", session_id, user_id)
         
-        # Use the filtered result directly instead of running another query
-        response = filtered
+        # Include messages still waiting in the write-behind outbox
+        await message_writer.wait_for_session(session_id)
+        messages, next_cursor = await repository.list_session_messages(session_id, page)
 
         # Format the response data if needed
         formatted_messages = []
-        for msg in response.data:
+        for msg in messages:
             formatted_messages.append({
                 "content": msg.get("content"),
                 "role": msg.get("role"),
@@ -698,434 +589,270 @@ async def get_session_messages(session_id: str, user = Depends(get_current_user)
                 "session_id": msg.get("session_id")
             })
         
-        logger.info(f"Retrieved {len(formatted_messages)} messages for session {session_id}")
-        return {"messages": formatted_messages or []}
+        logger.info("Retrieved %s messages for session %s", len(formatted_messages), session_id)
+        return {"messages": formatted_messages, "next_cursor": next_cursor}
 
     except Exception as e:
-        logger.exception(f"Error retrieving messages for session {session_id}: {str(e)}")
+        logger.exception("Error retrieving messages for session %s: %s", session_id, e)
         # Return empty array instead of error for better UX
-        return {"messages": []}
+        return {"messages": [], "next_cursor": None}
     
-@app.post("/api/chat-sessions/{session_id}/messages")
-async def send_message_to_session(session_id: str, message_data: SessionMessageCreate, user = Depends(get_current_user)):
+async def prepare_session_turn(session_id: str, user_id: str, user_message_content: str):
     """
-    Adds a user message to a specific chat session and gets an AI response.
+    Fetches the user's context, verifies session ownership, saves the user
+    message and builds the OpenAI payload for one chat turn.
+    Returns (saved_user_message, openai_messages).
     """
-    user_id = user.id
+    # --- 1. Fetch context and verify session ownership (important!) concurrently ---
+    ctx = await assemble_context(user_id, session_id=session_id, history_limit=HISTORY_FETCH_LIMIT)
+    logger.info("Received message for session %s from user %s: %s", session_id, user_id, UserText(user_message_content))
+
+    if not ctx.session_owned:
+        logger.warning("Attempt to send message to session %s not owned by user %s", session_id, user_id)
+        raise HTTPException(status_code=403, detail="Access denied to this chat session.")
+
+    # --- 2. Save User Message (buffered durably; flushed to ChatMessages in batches) ---
+    saved_user_message = await message_writer.enqueue(session_id, user_id, "user", user_message_content)
+
+    # Check for inserted row
+    if not saved_user_message:
+        logger.error("Failed to save user message or get data back for session %s.", session_id)
+        raise HTTPException(status_code=500, detail="Could not save user message.")
+    logger.info("Saved user message %s to session %s", saved_user_message.get('chat_id', 'UNKNOWN'), session_id)
+
+
+    # --- 3. Prepare context for AI within the token budget ---
+    # History was read before the new message was saved, so the builder puts the new message last
+    prompt = build_chat_prompt(
+        system_prompt=SESSION_SYSTEM_PROMPT,
+
+        user_message=user_message_content,
+        profile=ctx.profile,
+        journal_summaries=ctx.journal_summaries,
+        chat_summary=ctx.last_chat_summary,
+        history=ctx.history,
+    )
+    openai_messages = prompt.messages
 
-        # ─── FETCH CONTEXT ──────────────────────────────────────────────────────────
-    # 1) User profile
-    profile_res = supabase.table("UserProfiles") \
-        .select("profile_data") \
-        .eq("user_id", user_id) \
-        .execute()
-
-    if profile_res.data and len(profile_res.data) > 0:
-        profile = profile_res.data[0]["profile_data"]
-    else:
-        logger.info(f"[Auto-Init] No profile found for user {user_id}, inserting default.")
-        default_profile = {
-            "name": "New User",
-            "ratings": [],
-            "metadata": {
-                "format": "JSONB",
-                "source": "Initial Default Profile",
-                "version": "1.0",
-                "created_at": datetime.now(timezone.utc).isoformat()
-            },
-            "strengths": {},
-            "weaknesses": {},
-        }
+    return saved_user_message, openai_messages
 
-        supabase.table("UserProfiles").insert({
-            "user_id": user_id,
-            "profile_data": default_profile, 
-            "updated_at": datetime.now(timezone.utc).isoformat()
-            
-            
-        }).execute()
-        profile = default_profile
-
-
-    # 2) Journal summaries (days 7–14)
-    today = datetime.utcnow().date()
-    journals_ctx = supabase.table("JournalSummaries") \
-        .select("start_date,end_date,summary_text") \
-        .eq("user_id", user_id) \
-        .gte("start_date", (today - timedelta(days=14)).isoformat()) \
-        .lte("end_date",   (today - timedelta(days=7)).isoformat()) \
-        .order("start_date", desc=True) \
-        .execute().data
-
-    # 3) Chat summary (last session)
-    chats_res = supabase.table("ChatSummaries") \
-        .select("summary_text") \
-        .eq("user_id", user_id) \
-        .order("inserted_at", desc=True) \
-        .limit(1) \
-        .execute()
-    last_chat_summary = chats_res.data[0]["summary_text"] if chats_res.data else None
-
-    # ─── END FETCH CONTEXT ──────────────────────────────────────────────────────────
-
-    user_message_content = message_data.message
-    try:
-        logger.info(f"Received message for session {session_id} from user {user_id}: {user_message_content[:30]}...")
-
-        # --- 1. Verify session ownership (important!) ---
-        # (Keep this check as is)
-        session_check = supabase.table("ChatSessions") \
-            .select("session_id") \
-            .eq("session_id", session_id) \
-            .eq("user_id", user_id) \
-            .limit(1) \
-            .execute()
-        if not session_check.data:
-            logger.warning(f"Attempt to send message to session {session_id} not owned by user {user_id}")
-            raise HTTPException(status_code=403, detail="Access denied to this chat session.")
-
-        # --- 2. Save User Message ---
-        # REMOVE .select("*") here
-        user_msg_response = supabase.table("ChatMessages").insert({
-            "session_id": session_id,
-            "user_id": user_id,
-            "role": "user",
-            "content": user_message_content,
-            "created_at": datetime.utcnow().isoformat()
-        }).execute() # Execute immediately after insert
-
-        # Check response.data for inserted row
-        if not user_msg_response.data or len(user_msg_response.data) == 0:
-             logger.error(f"Failed to save user message or get data back for session {session_id}. Response: {user_msg_response}")
-             raise HTTPException(status_code=500, detail="Could not save user message.")
-        saved_user_message = user_msg_response.data[0]
-        logger.info(f"Saved user message {saved_user_message.get('chat_id', 'UNKNOWN')} to session {session_id}")
-
-
-        # --- 3. Prepare context for AI ---
-        # (Keep this section as is)
-        history_response = supabase.table("ChatMessages") \
-            .select("role, content") \
-            .eq("session_id", session_id) \
-            .order("created_at", desc=True) \
-            .limit(10) \
-            .execute()
-        
 
-        openai_messages = [
-        {"role": "system", "content": """I want you to talk to me like a grounded, emotionally intelligent person. Don't sugarcoat things. Be honest but warm. If I'm being irrational or idealizing something, gently point it out. I don't want therapist-speak or shallow positivity. I want someone who can see through the noise, be real with me, and still understand that I'm trying my best to figure life out. You don't need to offer advice unless it feels necessary—sometimes I just want to be heard. Respond as if you genuinely care, but you're not here to flatter or coddle me."""},
-        {"role": "system", "content":
-            f"User profile: {profile}\n\n"
-            f"Journal summaries (7–14 days ago): {journals_ctx}\n"
-            f"Last chat summary: {last_chat_summary}"
-        }
-    ]
-        if history_response.data:
-             for msg in reversed(history_response.data):
-                 openai_messages.append({"role": msg['role'], "content": msg['content']})
+async def save_ai_message(session_id: str, user_id: str, ai_response_content: str) -> dict:
+    saved_ai_message = await message_writer.enqueue(session_id, user_id, "assistant", ai_response_content)
 
+    # Check for inserted row
+    if not saved_ai_message:
+        logger.error("Failed to save AI message or get data back for session %s.", session_id)
+        raise HTTPException(status_code=500, detail="Could not save AI response.")
+    logger.info("Saved AI message %s to session %s", saved_ai_message.get('chat_id', 'UNKNOWN'), session_id)
+    return saved_ai_message
+
+
+@router.post("/api/chat-sessions/{session_id}/messages")
+async def send_message_to_session(session_id: str, message_data: SessionMessageCreate, user = Depends(get_current_user)):
+    """
+    Adds a user message to a specific chat session and gets an AI response.
+    """
+    user_id = user.id
+    try:
+        saved_user_message, openai_messages = await prepare_session_turn(session_id, user_id, message_data.message)
 
         # --- 4. Call OpenAI ---
-        # (Keep this section as is)
-        logger.info(f"Sending {len(openai_messages)} messages to OpenAI for session {session_id}")
-        ai_completion = client.chat.completions.create(
-            model="gpt-4-turbo",
+        logger.info("Sending %s messages to OpenAI for session %s", len(openai_messages), session_id)
+        ai_response_content = await complete_text(
+            user=user_id,
+            route="chat",
             messages=openai_messages,
             max_tokens=300,
             temperature=0.7
         )
-        ai_response_content = ai_completion.choices[0].message.content
-        logger.info(f"Received AI response for session {session_id}: {ai_response_content[:30]}...")
+        logger.info("Received AI response for session %s: %s", session_id, UserText(ai_response_content))
 
         # --- 5. Save AI Message ---
-        # REMOVE .select("*") here
-        ai_msg_response = supabase.table("ChatMessages").insert({
-            "session_id": session_id,
-            "user_id": user_id,
-            "role": "assistant",
-            "content": ai_response_content,
-            "created_at": datetime.utcnow().isoformat()
-        }).execute() # Execute immediately after insert
-
-        # Check response.data for inserted row
-        if not ai_msg_response.data or len(ai_msg_response.data) == 0:
-             logger.error(f"Failed to save AI message or get data back for session {session_id}. Response: {ai_msg_response}")
-             raise HTTPException(status_code=500, detail="Could not save AI response.")
-        saved_ai_message = ai_msg_response.data[0]
-        logger.info(f"Saved AI message {saved_ai_message.get('chat_id', 'UNKNOWN')} to session {session_id}")
-
+        saved_ai_message = await save_ai_message(session_id, user_id, ai_response_content)
 
         # --- 6. Return saved messages ---
-        # (Keep this section as is)
         return {
             "userMessage": saved_user_message,
             "aiMessage": saved_ai_message
         }
 
-    # (Keep except blocks as is)
     except HTTPException as http_exc:
         raise http_exc
+    except LLMBusyError as e:
+        raise model_busy(e)
+    except Exception as e:
+        logger.exception("Error processing message for session %s: %s", session_id, e)
+        raise HTTPException(status_code=500, detail=f"Failed to process message: {str(e)}")
+
+
+@router.post("/api/chat-sessions/{session_id}/messages/stream")
+async def stream_message_to_session(session_id: str, message_data: SessionMessageCreate, user = Depends(get_current_user)):
+    """
+    Streaming variant of send_message_to_session. Sends Server-Sent Events:
+    `user_message` (the saved user row), one `token` per delta as the model
+    generates, then `done` with {userMessage, aiMessage} once the complete
+    reply has been saved to ChatMessages. Failures mid-stream send `error`.
+    """
+    user_id = user.id
+    # Ownership and the user-message insert happen before the stream opens so
+    # they can still fail with a normal HTTP status.
+    try:
+        saved_user_message, openai_messages = await prepare_session_turn(session_id, user_id, message_data.message)
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.exception(f"Error processing message for session {session_id}: {str(e)}")
+        logger.exception("Error preparing streamed message for session %s: %s", session_id, e)
         raise HTTPException(status_code=500, detail=f"Failed to process message: {str(e)}")
+
+    async def events():
+        yield sse_event("user_message", saved_user_message)
+        try:
+            parts = []
+            async for delta in stream_text(
+                user=user_id,
+                route="chat",
+                messages=openai_messages,
+                max_tokens=300,
+                temperature=0.7
+            ):
+                parts.append(delta)
+                yield sse_event("token", {"delta": delta})
+
+            saved_ai_message = await save_ai_message(session_id, user_id, "".join(parts))
+            yield sse_event("done", {"userMessage": saved_user_message, "aiMessage": saved_ai_message})
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            logger.exception("Error streaming message for session %s: %s", session_id, detail)
+            yield sse_event("error", {"detail": f"Failed to process message: {detail}"})
+
+    return sse_response(events())
     
 
-@app.post("/api/journal-summaries", response_model=JournalSummaryOut)
+@router.post("/api/journal-summaries", response_model=JournalSummaryOut)
 async def create_journal_summary(
     payload: JournalSummaryCreate,
     user=Depends(get_current_user)
 ):
-    # 1) fetch raw journals
-    journals = supabase.table("Journals") \
-        .select("content") \
-        .eq("user_id", user.id) \
-        .gte("journal_date", payload.start_date.isoformat()) \
-        .lte("journal_date", payload.end_date.isoformat()) \
-        .order("journal_date") \
-        .execute().data
-
-    # 2) build prompt
-    entries = "\n".join(f"- {j['content']}" for j in journals)
-    prompt = (
-        f"As an AI therapist, please summarize the user's journal entries. Focus on the users highs, lows, and emotinal changes "
-        f"from {payload.start_date} to {payload.end_date}:\n\n{entries}"
-    )
-
-    # 3) call OpenAI
-    ai_resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You are an empathetic summarizer. Focus on emotional changes and insights. Use second person pronouns like 'you' and 'your' when addressing the user."},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=500
-    ).choices[0].message.content
-
-    # 4) persist summary
+    # Composed from the stored daily summaries (and cached weekly/monthly ones)
     try:
-        result = supabase.table("JournalSummaries") \
-            .insert([{
-                "user_id":       user.id,
-                "start_date":    payload.start_date.isoformat(),
-                "end_date":      payload.end_date.isoformat(),
-                "summary_text":  ai_resp
-            }]) \
-            .execute()
-        
-        # The insert returns a list of created records; return the first record to match JournalSummaryOut
-        return result.data[0]
+        return await journal_service.create_journal_summary(user.id, payload)
     except Exception as e:
         # Catch any errors and return as HTTP 500
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/journal-summaries", response_model=JournalSummaryOut)
+@router.get("/api/journal-summaries", response_model=JournalSummaryOut)
 async def get_journal_summary(
     start_date: date,
     end_date: date,
     user=Depends(get_current_user)
 ):
     # Query up to one matching summary
-    res = supabase.table("JournalSummaries") \
-        .select("*") \
-        .eq("user_id", user.id) \
-        .eq("start_date", start_date.isoformat()) \
-        .eq("end_date", end_date.isoformat()) \
-        .limit(1) \
-        .execute()
-    records = res.data or []
-    if len(records) == 0:
+    record = await repository.get_journal_summary(user.id, start_date.isoformat(), end_date.isoformat())
+    if record is None:
         raise HTTPException(status_code=404, detail="Summary not found")
-    return records[0]
+    return record
 
-@app.post("/api/chat-summaries", response_model=ChatSummaryOut)
+@router.post("/api/chat-summaries", response_model=ChatSummaryOut)
 async def create_chat_summary(
     payload: ChatSummaryCreate,
     user=Depends(get_current_user)
 ):
-    # turn the UUID into a plain string
-    session_id_str = str(payload.session_id)
-
-    # fetch messages
-    msgs = supabase.table("ChatMessages") \
-        .select("role,content") \
-        .eq("session_id", session_id_str) \
-        .order("created_at") \
-        .execute().data
-
-    # build your conversation text…
-    convo = "\n".join(f"{m['role']}: {m['content']}" for m in msgs)
-    prompt = f"Please summarize this conversation:\n\n{convo}"
-
-    ai_resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You are a concise summarizer."},
-            {"role": "user",   "content": prompt}
-        ],
-        max_tokens=300
-    ).choices[0].message.content
-
-    # now insert using the string ID
+    # Folds only messages newer than the session's last summary; a no-op if there are none
     try:
-        res = supabase.table("ChatSummaries") \
-            .insert([{
-                "user_id":      str(user.id),       # also ensure it's a string
-                "session_id":   session_id_str,
-                "summary_text": ai_resp
-            }]) \
-            .execute()
-        return res.data
+        record = await chat_service.create_chat_summary(str(user.id), str(payload.session_id))
+    except chat_service.SessionAccessError as e:
+        raise HTTPException(status_code=403, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if record is None:
+        raise HTTPException(status_code=404, detail="No messages to summarize in this chat session.")
+    return record
 
 
-@app.get("/api/chat-summaries", response_model=List[ChatSummaryOut])
-async def list_chat_summaries(user=Depends(get_current_user)):
-    result = supabase.table("ChatSummaries") \
-        .select("*") \
-        .eq("user_id", user.id) \
-        .order("inserted_at", desc=True) \
-        .execute()
+@router.get("/api/chat-summaries", response_model=ChatSummaryPage)
+async def list_chat_summaries(page: PageParams = Depends(page_params), user=Depends(get_current_user)):
+    summaries, next_cursor = await repository.list_chat_summaries(user.id, page)
+    return {"summaries": summaries, "next_cursor": next_cursor}
 
-    return result.data or []
 
-
-@app.get("/api/user-profile", response_model=UserProfileOut)
+@router.get("/api/user-profile", response_model=UserProfileOut)
 async def get_user_profile(user=Depends(get_current_user)):
-    res = supabase.table("UserProfiles") \
-        .select("*") \
-        .eq("user_id", user.id) \
-        .single() \
-        .execute()
+    profile = await repository.get_user_profile(user.id)
     
-    if res.data is None:
+    if profile is None:
         raise HTTPException(status_code=404, detail="Profile not found")
     
-    res.data["profile_data"] = enforce_profile_schema(res.data["profile_data"])
+    profile["profile_data"] = enforce_profile_schema(profile["profile_data"])
     
-    if res.data.get("updated_at") is None:
-        res.data["updated_at"] = datetime.now(timezone.utc).isoformat()
+    if profile.get("updated_at") is None:
+        profile["updated_at"] = datetime.now(timezone.utc).isoformat()
+
 
+    return profile
 
-    return res.data
+@router.get("/api/user-profile/refresh-status")
+async def get_profile_refresh_status(user=Depends(get_current_user)):
+    """Status and last run of the background profile regeneration for this user."""
+    return profile_refresher.status(user.id)
 
-@app.put("/api/user-profile", response_model=UserProfileOut)
+@router.put("/api/user-profile", response_model=UserProfileOut)
 async def upsert_user_profile(
     payload: UserProfilePayload,
     user=Depends(get_current_user)
 ):
-    res = supabase.table("UserProfiles") \
-        .upsert([{
-            "user_id":      user.id,
-            "profile_data": payload.profile_data
-        }], on_conflict=["user_id"]) \
-        .select("*") \
-        .single() \
-        .execute()
-
-    if res.error:
-        raise HTTPException(status_code=500, detail=res.error.message)
-    return res.data
-
-
-def enforce_profile_schema(data: dict) -> dict:
-    if not isinstance(data, dict):
-        data = {}
-
-    def ensure_dict(d):
-        return d if isinstance(d, dict) else {}
-
-    def ensure_list_of_dicts(l):
-        return l if isinstance(l, list) and all(isinstance(i, dict) for i in l) else []
-
-    return {
-        "name": data.get("name", "Unnamed"),
-        "ratings": ensure_list_of_dicts(data.get("ratings", [])),
-        "metadata": ensure_dict(data.get("metadata", {})),
-        "strengths": ensure_dict(data.get("strengths", {})),
-        "weaknesses": ensure_dict(data.get("weaknesses", {})),
-        "goals": ensure_dict(data.get("goals", {})),
-        "personality": ensure_dict(data.get("personality", {})),
-        "preferences": ensure_dict(data.get("preferences", {})),
-        "notes": data.get("notes", "This is a default placeholder profile.")
-    }
-
-
+    try:
+        record = await repository.upsert_user_profile(user.id, payload.profile_data)
+        invalidate_user_context(user.id)
+        return record
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 #helper functions for backend:
-def update_user_profile(user_id: str):
-
-    # 1. Get existing profile (if any)
-    old_profile_res = supabase.table("UserProfiles") \
-        .select("profile_data") \
-        .eq("user_id", user_id) \
-        .execute()
-    old_profile = old_profile_res.data[0]["profile_data"] if old_profile_res.data else {}
-
-    # 2. Get past 7 days of journals
-    today = datetime.now(timezone.utc).date()
-    past_journals = supabase.table("Journals") \
-        .select("content, journal_date") \
-        .eq("user_id", user_id) \
-        .gte("journal_date", (today - timedelta(days=7)).isoformat()) \
-        .order("journal_date") \
-        .execute().data
-
-    # 3. Get summaries of last 2 chat sessions
-    chat_summaries = supabase.table("ChatSummaries") \
-        .select("summary_text") \
-        .eq("user_id", user_id) \
-        .order("inserted_at", desc=True) \
-        .limit(2) \
-        .execute().data
-    summary_texts = "\n".join([c["summary_text"] for c in chat_summaries])
-
-    # 4. Prepare prompt for OpenAI
-    journal_texts = "\n".join([f"- {j['content']}" for j in past_journals])
-    prompt = (
-        "You are an AI profile summarizer for a therapist assistant application.\n"
-        "Based on the user's prior profile, recent journal entries, and last two chat summaries, "
-        "update the user's self-assessment, strengths, weaknesses, and metadata. KEEP it the same format as the prior profile!!\n\n"
-        f"Prior profile:\n{json.dumps(old_profile)}\n\n"
-        f"Recent journals:\n{journal_texts}\n\n"
-        f"Chat summaries:\n{summary_texts}"
+async def update_user_profile(user_id: str):
+    # Prompt, schema enforcement and upsert live in the profile service
+    await profile_service.update_profile(user_id)
+
+
+# Coalesces profile regenerations triggered by session creation and journal saves
+profile_refresher = ProfileRefreshScheduler(update_user_profile)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with app_lifespan(app):
+        yield
+        # Let running profile refreshes finish while the shared clients are still open
+        await profile_refresher.shutdown()
+
+
+def create_app() -> FastAPI:
+    """Build the API. Cheap: clients are created and warmed by the lifespan, not here."""
+    # Queue-backed, sampled and redacted; verbosity follows APP_ENV / LOG_LEVEL
+    configure_logging()
+    app = FastAPI(default_response_class=TimedJSONResponse, lifespan=lifespan)
+
+    # Retries carrying the same Idempotency-Key get the first response instead of
+    # another LLM call. Innermost, so replayed responses still get CORS headers.
+    app.add_middleware(IdempotencyMiddleware, owner=idempotency_owner)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=[
+            "http://localhost:3000",
+            "https://aitherapist-production.up.railway.app",
+            "https://ai-therapist-seven.vercel.app"
+        ],
+        #llow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
     )
+    # Per-request spans and latency histograms (served on /metrics)
+    app.add_middleware(TelemetryMiddleware)
 
-    # 5. Ask OpenAI to update the profile
-    ai_resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {
-                "role": "system",
-                "content": (
-                    "You are an AI profile summarizer for a therapist assistant application.\n"
-                    "You are given a user's profile, recent journal entries, and last two chat summaries.\n"
-                    "You are to update the user's profile based on the new information.\n"
-                    "Output must be valid JSON with this exact top-level structure: {\n"
-                    "    'name': str,\n    'ratings': List[{'category': str, 'description': str}],\n"
-                    "    'metadata': {'format': str, 'source': str, 'version': str, 'created_at': str},\n    'strengths': Dict[str, str],\n    'weaknesses': Dict[str, str]\n}. Do NOT omit or rename any keys. Fill with empty lists/dicts if needed. This structure must not change.\n"
-                    "If a section hasn't changed, still include it.\n"
-                    "Focus on the user's goals, personality, preferences, and notes.\n"
-                    "Output only valid JSON."
-                )
-            },
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=1000
-    ).choices[0].message.content
+    app.include_router(router)
+    return app
 
 
-    # 6. Parse AI response as profile data (optional: validate JSON)
-    try:
-        new_profile = enforce_profile_schema(json.loads(ai_resp))
-    except json.JSONDecodeError:
-        logger.warning("AI response was not valid JSON. Skipping profile update.")
-        return
-
-    # 7. Upsert into UserProfiles
-    supabase.table("UserProfiles").upsert([{
-        "user_id": user_id,
-        "profile_data": new_profile,
-        "updated_at": datetime.now(timezone.utc).isoformat()
-    }], on_conflict=["user_id"]).execute()
+app = create_app()
@@ -0,0 +1,222 @@
+"""Backfill chat summaries, journal summaries and profiles for many users.
+
+Calls the summarization services directly (no HTTP, no per-user access
+token). Per user: every chat session is summarized (incrementally, so
+unchanged sessions are free), every calendar month with journal entries gets
+a hierarchical summary, then the profile is regenerated from the results.
+
+Completed tasks are appended to a checkpoint file; rerunning with the same
+file skips them, so an interrupted run resumes where it stopped.
+
+    python -m app_refactor.backfill                       # all users
+    python -m app_refactor.backfill --user <uuid> --user <uuid>
+    python -m app_refactor.backfill --users-file ids.txt --only chat,journal
+    python -m app_refactor.backfill --dry-run
+"""
+import argparse
+import asyncio
+import calendar
+import json
+import logging
+import os
+import sys
+import time
+from datetime import date
+from pathlib import Path
+from typing import Awaitable, Callable, List, Optional, Set
+
+from .llm import close_openai
+from .repository import repository
+from .schemas import JournalSummaryCreate
+from .services import chat_service, journal_service, profile_service
+
+logger = logging.getLogger(__name__)
+
+KINDS = ("chat", "journal", "profile")
+
+
+class Checkpoint:
+    """Append-only JSONL of finished task keys."""
+
+    def __init__(self, path: Path, reset: bool = False):
+        self.path = path
+        self.done: Set[str] = set()
+        if reset and path.exists():
+            path.unlink()
+        if path.exists():
+            with path.open() as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        self.done.add(json.loads(line)["key"])
+        self._file = None
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.done
+
+    def mark(self, key: str) -> None:
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = self.path.open("a")
+        self._file.write(json.dumps({"key": key, "at": time.time()}) + "\n")
+        self._file.flush()
+        self.done.add(key)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+
+
+class Progress:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.users = 0
+        self.planned = 0
+        self.done = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def line(self) -> str:
+        elapsed = time.perf_counter() - self.started
+        rate = self.done / elapsed if elapsed else 0.0
+        return (
+            f"users={self.users} tasks: {self.done} done, {self.skipped} skipped, "
+            f"{self.failed} failed, {self.planned} planned | {rate:.2f} tasks/s | {elapsed:.0f}s"
+        )
+
+
+def _months(days: List[str]) -> List[JournalSummaryCreate]:
+    months = sorted({d[:7] for d in days})
+    ranges = []
+    for ym in months:
+        year, month = int(ym[:4]), int(ym[5:7])
+        ranges.append(JournalSummaryCreate(
+            start_date=date(year, month, 1),
+            end_date=date(year, month, calendar.monthrange(year, month)[1]),
+        ))
+    return ranges
+
+
+class Backfill:
+    def __init__(self, args: argparse.Namespace, checkpoint: Checkpoint):
+        self.args = args
+        self.kinds = set(args.only)
+        self.checkpoint = checkpoint
+        self.progress = Progress()
+        self.semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def _task(self, key: str, run: Callable[[], Awaitable[object]]) -> bool:
+        if key in self.checkpoint:
+            self.progress.skipped += 1
+            return True
+        self.progress.planned += 1
+        if self.args.dry_run:
+            logger.info(f"[dry-run] would run {key}")
+            return True
+        async with self.semaphore:
+            try:
+                await run()
+            except Exception as e:
+                self.progress.failed += 1
+                logger.error(f"[ERROR] {key}: {e}")
+                return False
+        self.checkpoint.mark(key)
+        self.progress.done += 1
+        return True
+
+    async def backfill_user(self, user_id: str) -> None:
+        tasks = []
+        if "chat" in self.kinds:
+            for session_id in await repository.list_session_ids(user_id):
+                tasks.append(self._task(
+                    f"chat:{user_id}:{session_id}",
+                    lambda s=session_id: chat_service.create_chat_summary(user_id, s),
+                ))
+        if "journal" in self.kinds:
+            days = await repository.journal_days_between(user_id, "0001-01-01", "9999-12-31")
+            for payload in _months(days):
+                tasks.append(self._task(
+                    f"journal:{user_id}:{payload.start_date.isoformat()[:7]}",
+                    lambda p=payload: journal_service.create_journal_summary(user_id, p),
+                ))
+        ok = all(await asyncio.gather(*tasks))
+
+        # The profile is built from the summaries above, so it goes last and
+        # only once they all succeeded.
+        if "profile" in self.kinds and ok:
+            await self._task(f"profile:{user_id}", lambda: profile_service.regenerate_profile(user_id))
+        self.progress.users += 1
+
+    async def _report(self) -> None:
+        while True:
+            await asyncio.sleep(self.args.report_every)
+            logger.info(self.progress.line())
+
+    async def run(self, user_ids: List[str]) -> Progress:
+        queue: asyncio.Queue = asyncio.Queue()
+        for user_id in user_ids:
+            queue.put_nowait(user_id)
+
+        async def worker() -> None:
+            while not queue.empty():
+                user_id = queue.get_nowait()
+                try:
+                    await self.backfill_user(user_id)
+                except Exception as e:
+                    logger.error(f"[ERROR] user {user_id}: {e}")
+
+        reporter = asyncio.create_task(self._report())
+        try:
+            await asyncio.gather(*(worker() for _ in range(min(self.args.user_concurrency, len(user_ids)) or 1)))
+        finally:
+            reporter.cancel()
+        return self.progress
+
+
+def _parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user", action="append", default=[], help="Only this user_id (repeatable)")
+    parser.add_argument("--users-file", type=Path, help="File with one user_id per line")
+    parser.add_argument("--only", type=lambda s: s.split(","), default=list(KINDS),
+                        help=f"Comma-separated subset of {','.join(KINDS)}")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("BACKFILL_CONCURRENCY", "16")),
+                        help="Max summarization tasks in flight")
+    parser.add_argument("--user-concurrency", type=int, default=8, help="Users processed at once")
+    parser.add_argument("--checkpoint", type=Path, default=Path(".backfill_checkpoint.jsonl"))
+    parser.add_argument("--reset", action="store_true", help="Ignore and clear the checkpoint file")
+    parser.add_argument("--dry-run", action="store_true", help="List the work without calling the model or writing")
+    parser.add_argument("--report-every", type=float, default=10.0, help="Seconds between progress lines")
+    args = parser.parse_args(argv)
+    unknown = set(args.only) - set(KINDS)
+    if unknown:
+        parser.error(f"unknown --only kinds: {', '.join(sorted(unknown))}")
+    return args
+
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    args = _parse_args(argv)
+    user_ids = list(args.user)
+    if args.users_file:
+        user_ids += [line.strip() for line in args.users_file.read_text().splitlines() if line.strip()]
+
+    checkpoint = Checkpoint(args.checkpoint, reset=args.reset)
+    try:
+        if not user_ids:
+            user_ids = await repository.list_user_ids()
+        logger.info(
+            f"Backfilling {','.join(args.only)} for {len(user_ids)} users "
+            f"({len(checkpoint.done)} tasks already in {args.checkpoint})"
+            + (" [dry run]" if args.dry_run else "")
+        )
+        progress = await Backfill(args, checkpoint).run(user_ids)
+        logger.info(f"Finished: {progress.line()}")
+        return 1 if progress.failed else 0
+    finally:
+        checkpoint.close()
+        await close_openai()
+        await repository.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,508 @@
+"""Offline batch summarization: export -> submit -> ingest.
+
+Bulk summary work (chat sessions, daily journal summaries, weekly journal
+roll-ups, profiles) doesn't need interactive latency, so instead of one
+chat-completion call per item it can go through a batch API:
+
+    python -m app_refactor.batch_summaries export --kind chat [--user <uuid> ...]
+    python -m app_refactor.batch_summaries submit <job_id> --executor openai
+    python -m app_refactor.batch_summaries poll <job_id>
+    python -m app_refactor.batch_summaries ingest <job_id>
+    python -m app_refactor.batch_summaries status <job_id>
+
+Each job lives in ``<jobs-dir>/<job_id>/``: ``requests.jsonl`` in the OpenAI
+batch input format, ``manifest.jsonl`` with what each custom_id refers to,
+``results.jsonl`` and ``state.json``. Ingest records every custom_id it has
+written, and the upserts themselves are keyed, so re-ingesting a partial or
+repeated results file is safe.
+
+``--executor fake`` answers locally and deterministically, for tests and dry
+runs of the whole pipeline.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sys
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .llm import close_openai, get_openai
+from .repository import repository
+from .services import chat_service, journal_service, profile_service
+
+logger = logging.getLogger(__name__)
+
+KINDS = ("chat", "journal", "journal_week", "profile")
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_UPSERT_SIZE = int(os.getenv("BATCH_UPSERT_SIZE", "500"))
+EXPORT_CONCURRENCY = int(os.getenv("BATCH_EXPORT_CONCURRENCY", "16"))
+DEFAULT_JOBS_DIR = Path(os.getenv("BATCH_JOBS_DIR", "batch_jobs"))
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _read_jsonl(path: Path) -> Iterator[dict]:
+    if not path.exists():
+        return
+    with path.open() as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+# ─── Job state ───────────────────────────────────────────────────────────
+class BatchJob:
+    """Files and persisted state of one export."""
+
+    def __init__(self, jobs_dir: Path, job_id: str):
+        self.job_id = job_id
+        self.dir = jobs_dir / job_id
+        self.requests_path = self.dir / "requests.jsonl"
+        self.manifest_path = self.dir / "manifest.jsonl"
+        self.results_path = self.dir / "results.jsonl"
+        self.state_path = self.dir / "state.json"
+        self.state: dict = {}
+
+    @classmethod
+    def create(cls, jobs_dir: Path, kind: str) -> "BatchJob":
+        job = cls(jobs_dir, f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}-{kind}")
+        job.dir.mkdir(parents=True, exist_ok=False)
+        job.state = {
+            "job_id": job.job_id,
+            "kind": kind,
+            "status": "exporting",
+            "created_at": _now_iso(),
+            "requests": 0,
+            "executor": None,
+            "batch_id": None,
+            "ingested": [],
+            "failed": {},
+        }
+        job.save()
+        return job
+
+    @classmethod
+    def load(cls, jobs_dir: Path, job_id: str) -> "BatchJob":
+        job = cls(jobs_dir, job_id)
+        if not job.state_path.exists():
+            raise SystemExit(f"No batch job {job_id} in {jobs_dir}")
+        job.state = json.loads(job.state_path.read_text())
+        return job
+
+    def save(self) -> None:
+        tmp = self.state_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.state, indent=2))
+        os.replace(tmp, self.state_path)
+
+    def manifest(self) -> Dict[str, dict]:
+        return {row["custom_id"]: row for row in _read_jsonl(self.manifest_path)}
+
+
+# ─── Stage 1: export ─────────────────────────────────────────────────────
+async def _chat_jobs(user_id: str) -> List[Tuple[dict, dict]]:
+    jobs = []
+    for session_id in await repository.list_session_ids(user_id):
+        previous, job = await chat_service.prepare_chat_summary(session_id, user_id)
+        if job is None:
+            continue  # unchanged, or a session with no messages
+        jobs.append((job["request"], {
+            "user_id": user_id,
+            "session_id": session_id,
+            "last_message_at": job["last_message_at"],
+            "last_message_id": job["last_message_id"],
+        }))
+    return jobs
+
+
+async def _journal_jobs(user_id: str) -> List[Tuple[dict, dict]]:
+    """Days with a journal entry but no daily summary."""
+    days = await repository.journal_days_between(user_id, "0001-01-01", "9999-12-31")
+    if not days:
+        return []
+    summaries = await repository.journal_summaries_between(user_id, days[0], days[-1])
+    have = {r["start_date"] for r in summaries if r["start_date"] == r["end_date"]}
+    missing = [d for d in days if d not in have]
+    return [
+        (journal_service.journal_entry_request(j["content"]),
+         {"user_id": user_id, "start_date": j["journal_date"], "end_date": j["journal_date"]})
+        for j in await repository.journals_on(user_id, missing)
+        if j.get("content")
+    ]
+
+
+async def _journal_week_jobs(user_id: str) -> List[Tuple[dict, dict]]:
+    """Finished ISO weeks with two or more daily summaries but no weekly one."""
+    days = await repository.journal_days_between(user_id, "0001-01-01", "9999-12-31")
+    if not days:
+        return []
+    first = date.fromisoformat(days[0])
+    monday = first - timedelta(days=first.weekday())
+    last_sunday = datetime.now(timezone.utc).date() - timedelta(days=datetime.now(timezone.utc).date().weekday() + 1)
+    rows = await repository.journal_summaries_between(user_id, monday.isoformat(), last_sunday.isoformat())
+    stored = {(r["start_date"], r["end_date"]): r["summary_text"] for r in rows if not r.get("stale")}
+
+    jobs = []
+    while monday <= last_sunday:
+        sunday = monday + timedelta(days=6)
+        key = (monday.isoformat(), sunday.isoformat())
+        daily = [
+            stored[(d, d)]
+            for d in ((monday + timedelta(days=i)).isoformat() for i in range(7))
+            if (d, d) in stored
+        ]
+        if key not in stored and len(daily) >= 2:  # missing or stale
+            jobs.append((journal_service.journal_reduce_request(daily, monday, sunday),
+                         {"user_id": user_id, "start_date": key[0], "end_date": key[1]}))
+        monday += timedelta(days=7)
+    return jobs
+
+
+async def _profile_jobs(user_id: str) -> List[Tuple[dict, dict]]:
+    return [(await profile_service.profile_update_request(user_id), {"user_id": user_id})]
+
+
+_EXPORTERS = {
+    "chat": _chat_jobs,
+    "journal": _journal_jobs,
+    "journal_week": _journal_week_jobs,
+    "profile": _profile_jobs,
+}
+
+
+async def export(jobs_dir: Path, kind: str, user_ids: List[str]) -> BatchJob:
+    """Write every pending request of ``kind`` for ``user_ids`` (all users if empty)."""
+    if not user_ids:
+        user_ids = await repository.list_user_ids()
+    job = BatchJob.create(jobs_dir, kind)
+    semaphore = asyncio.Semaphore(EXPORT_CONCURRENCY)
+
+    async def collect(user_id: str) -> List[Tuple[dict, dict]]:
+        async with semaphore:
+            try:
+                return await _EXPORTERS[kind](user_id)
+            except Exception as e:
+                logger.error(f"[ERROR] export {kind} for user {user_id}: {e}")
+                return []
+
+    count = 0
+    with job.requests_path.open("w") as requests_file, job.manifest_path.open("w") as manifest_file:
+        for user_jobs in await asyncio.gather(*(collect(u) for u in user_ids)):
+            for body, meta in user_jobs:
+                custom_id = f"{kind}-{count}"
+                requests_file.write(json.dumps(
+                    {"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}
+                ) + "\n")
+                manifest_file.write(json.dumps({"custom_id": custom_id, **meta}) + "\n")
+                count += 1
+
+    job.state.update(status="exported", requests=count, users=len(user_ids))
+    job.save()
+    logger.info(f"Exported {count} {kind} requests for {len(user_ids)} users to {job.requests_path}")
+    return job
+
+
+# ─── Stage 2: executors ──────────────────────────────────────────────────
+class BatchExecutor:
+    """Runs a requests.jsonl somewhere and hands back a results.jsonl."""
+    name = ""
+
+    async def submit(self, requests_path: Path) -> str:
+        raise NotImplementedError
+
+    async def poll(self, batch_id: str) -> str:
+        """Provider status string; ``completed`` means results are ready."""
+        raise NotImplementedError
+
+    async def download(self, batch_id: str, results_path: Path) -> int:
+        """Write available results to ``results_path``; returns the line count."""
+        raise NotImplementedError
+
+
+class OpenAIBatchExecutor(BatchExecutor):
+    name = "openai"
+
+    async def submit(self, requests_path: Path) -> str:
+        client = get_openai()
+        with requests_path.open("rb") as f:
+            upload = await client.files.create(file=f, purpose="batch")
+        batch = await client.batches.create(
+            input_file_id=upload.id, endpoint=BATCH_ENDPOINT, completion_window="24h"
+        )
+        return batch.id
+
+    async def poll(self, batch_id: str) -> str:
+        return (await get_openai().batches.retrieve(batch_id)).status
+
+    async def download(self, batch_id: str, results_path: Path) -> int:
+        client = get_openai()
+        batch = await client.batches.retrieve(batch_id)
+        lines = 0
+        with results_path.open("w") as out:
+            # Failed requests are reported in a separate error file; both use the same line format.
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if not file_id:
+                    continue
+                text = (await client.files.content(file_id)).text
+                out.write(text if text.endswith("\n") else text + "\n")
+                lines += sum(1 for line in text.splitlines() if line.strip())
+        return lines
+
+
+class LocalFakeExecutor(BatchExecutor):
+    """Deterministic local stand-in: answers every request at submit time.
+
+    Replies are JSON objects, so they are valid both as summary text and as
+    profile data. ``fail_rate`` deterministically fails that share of requests
+    to exercise partial ingests.
+    """
+    name = "fake"
+
+    def __init__(self, fail_rate: float = 0.0):
+        self.fail_rate = fail_rate
+
+    def _output_path(self, batch_id: str) -> Path:
+        return Path(batch_id[len("fake:"):])
+
+    async def submit(self, requests_path: Path) -> str:
+        output = requests_path.with_name("fake_output.jsonl")
+        with output.open("w") as out:
+            for req in _read_jsonl(requests_path):
+                key = req["custom_id"] + json.dumps(req["body"], sort_keys=True)
+                digest = hashlib.sha256(key.encode()).hexdigest()
+                if int(digest[:8], 16) / 0xFFFFFFFF < self.fail_rate:
+                    line = {"id": f"fake_{digest[:12]}", "custom_id": req["custom_id"], "response": None,
+                            "error": {"code": "fake_error", "message": "Injected failure"}}
+                else:
+                    content = json.dumps({"name": "Fake", "summary": f"Fake summary {digest[:12]}"})
+                    line = {"id": f"fake_{digest[:12]}", "custom_id": req["custom_id"], "error": None,
+                            "response": {"status_code": 200, "request_id": digest[:12], "body": {
+                                "id": f"chatcmpl-{digest[:12]}",
+                                "object": "chat.completion",
+                                "model": req["body"].get("model"),
+                                "choices": [{"index": 0, "finish_reason": "stop",
+                                             "message": {"role": "assistant", "content": content}}],
+                            }}}
+                out.write(json.dumps(line) + "\n")
+        return f"fake:{output}"
+
+    async def poll(self, batch_id: str) -> str:
+        return "completed"
+
+    async def download(self, batch_id: str, results_path: Path) -> int:
+        text = self._output_path(batch_id).read_text()
+        results_path.write_text(text)
+        return sum(1 for line in text.splitlines() if line.strip())
+
+
+EXECUTORS = {"openai": OpenAIBatchExecutor, "fake": LocalFakeExecutor}
+
+
+def get_executor(name: str, **kwargs) -> BatchExecutor:
+    return EXECUTORS[name](**kwargs)
+
+
+async def submit(job: BatchJob, executor: BatchExecutor) -> None:
+    if job.state["requests"] == 0:
+        job.state["status"] = "completed"
+    else:
+        job.state["batch_id"] = await executor.submit(job.requests_path)
+        job.state["status"] = "submitted"
+    job.state.update(executor=executor.name, submitted_at=_now_iso())
+    job.save()
+
+
+async def poll(job: BatchJob, executor: BatchExecutor) -> str:
+    """Refresh the provider status; download results once they are ready."""
+    if not job.state.get("batch_id"):
+        return job.state["status"]
+    status = await executor.poll(job.state["batch_id"])
+    job.state["provider_status"] = status
+    if status == "completed":
+        job.state["results"] = await executor.download(job.state["batch_id"], job.results_path)
+        job.state["status"] = "completed"
+    elif status in ("failed", "expired", "cancelled"):
+        job.state["status"] = status
+    job.save()
+    return job.state["status"]
+
+
+# ─── Stage 3: ingest ─────────────────────────────────────────────────────
+def _reply_text(result: dict) -> Tuple[Optional[str], Optional[str]]:
+    """(content, error) of one batch output line."""
+    if result.get("error"):
+        return None, json.dumps(result["error"])
+    response = result.get("response") or {}
+    if response.get("status_code") != 200:
+        return None, f"status {response.get('status_code')}"
+    try:
+        return response["body"]["choices"][0]["message"]["content"], None
+    except (KeyError, IndexError, TypeError):
+        return None, "malformed response body"
+
+
+def _row(kind: str, meta: dict, text: str) -> Optional[dict]:
+    if kind == "chat":
+        return {
+            "user_id": meta["user_id"],
+            "session_id": meta["session_id"],
+            "summary_text": text,
+            "last_message_at": meta["last_message_at"],
+            "last_message_id": meta["last_message_id"],
+        }
+    if kind in ("journal", "journal_week"):
+        return {
+            "user_id": meta["user_id"],
+            "start_date": meta["start_date"],
+            "end_date": meta["end_date"],
+            "summary_text": text,
+            "stale": False,
+        }
+    profile = profile_service.parse_profile(text)
+    if profile is None:
+        return None
+    return {"user_id": meta["user_id"], "profile_data": profile}
+
+
+_UPSERTS = {
+    "chat": "upsert_chat_summaries",
+    "journal": "upsert_journal_summaries",
+    "journal_week": "upsert_journal_summaries",
+    "profile": "upsert_user_profiles",
+}
+
+
+async def ingest(job: BatchJob, results_path: Optional[Path] = None, batch_size: int = BATCH_UPSERT_SIZE) -> dict:
+    """Upsert results not yet ingested, in batches, recording progress after each one."""
+    kind = job.state["kind"]
+    manifest = job.manifest()
+    ingested = set(job.state["ingested"])
+    newly_ingested: List[str] = []
+    failed: Dict[str, str] = job.state["failed"]
+    pending: List[Tuple[str, dict]] = []
+    counts = {"upserted": 0, "skipped": 0, "failed": 0}
+
+    async def flush() -> None:
+        if not pending:
+            return
+        await getattr(repository, _UPSERTS[kind])([row for _, row in pending])
+        for custom_id, _ in pending:
+            ingested.add(custom_id)
+            newly_ingested.append(custom_id)
+            failed.pop(custom_id, None)
+        counts["upserted"] += len(pending)
+        pending.clear()
+        job.state["ingested"] = sorted(ingested)
+        job.save()
+
+    for result in _read_jsonl(results_path or job.results_path):
+        custom_id = result.get("custom_id")
+        if custom_id in ingested:
+            counts["skipped"] += 1
+            continue
+        meta = manifest.get(custom_id)
+        text, error = _reply_text(result)
+        row = _row(kind, meta, text) if meta and text is not None else None
+        if row is None:
+            failed[custom_id] = error or ("unknown custom_id" if not meta else "invalid profile JSON")
+            counts["failed"] += 1
+            continue
+        pending.append((custom_id, row))
+        if len(pending) >= batch_size:
+            await flush()
+    await flush()
+
+    if kind == "journal":
+        # New daily summaries make any stored week/month roll-up covering them stale.
+        days = {(manifest[c]["user_id"], manifest[c]["start_date"]) for c in newly_ingested}
+        semaphore = asyncio.Semaphore(EXPORT_CONCURRENCY)
+
+        async def mark(user_id: str, day: str) -> None:
+            async with semaphore:
+                await repository.mark_journal_summaries_stale(user_id, day)
+
+        await asyncio.gather(*(mark(u, d) for u, d in days))
+
+    job.state["failed"] = failed
+    job.state["status"] = "ingested" if len(ingested) >= job.state["requests"] else "partially_ingested"
+    job.state["ingested_at"] = _now_iso()
+    job.save()
+    logger.info(
+        f"Ingested job {job.job_id}: {counts['upserted']} upserted, {counts['skipped']} already ingested, "
+        f"{counts['failed']} failed ({len(ingested)}/{job.state['requests']} total)"
+    )
+    return counts
+
+
+# ─── CLI ─────────────────────────────────────────────────────────────────
+def _parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs-dir", type=Path, default=DEFAULT_JOBS_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("export", help="Write pending requests as a new job")
+    p.add_argument("--kind", choices=KINDS, required=True)
+    p.add_argument("--user", action="append", default=[], help="Only this user_id (repeatable)")
+
+    p = sub.add_parser("submit", help="Send a job's requests to an executor")
+    p.add_argument("job_id")
+    p.add_argument("--executor", choices=sorted(EXECUTORS), default="openai")
+    p.add_argument("--fail-rate", type=float, default=0.0, help="fake executor only")
+
+    p = sub.add_parser("poll", help="Check a submitted job; download results when done")
+    p.add_argument("job_id")
+    p.add_argument("--wait", type=float, default=0, help="Keep polling every N seconds until finished")
+
+    p = sub.add_parser("ingest", help="Upsert a job's results")
+    p.add_argument("job_id")
+    p.add_argument("--results", type=Path, help="Results file (defaults to the job's results.jsonl)")
+
+    p = sub.add_parser("status", help="Print a job's state")
+    p.add_argument("job_id")
+    return parser.parse_args(argv)
+
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    args = _parse_args(argv)
+    try:
+        if args.command == "export":
+            job = await export(args.jobs_dir, args.kind, args.user)
+            print(job.job_id)
+        elif args.command == "submit":
+            job = BatchJob.load(args.jobs_dir, args.job_id)
+            kwargs = {"fail_rate": args.fail_rate} if args.executor == "fake" else {}
+            await submit(job, get_executor(args.executor, **kwargs))
+            logger.info(f"Submitted {job.job_id} as {job.state['batch_id']}")
+        elif args.command == "poll":
+            job = BatchJob.load(args.jobs_dir, args.job_id)
+            executor = get_executor(job.state["executor"] or "openai")
+            while True:
+                status = await poll(job, executor)
+                logger.info(f"{job.job_id}: {status} ({job.state.get('provider_status')})")
+                if not args.wait or status != "submitted":
+                    break
+                await asyncio.sleep(args.wait)
+        elif args.command == "ingest":
+            job = BatchJob.load(args.jobs_dir, args.job_id)
+            counts = await ingest(job, args.results)
+            return 1 if counts["failed"] else 0
+        elif args.command == "status":
+            job = BatchJob.load(args.jobs_dir, args.job_id)
+            state = dict(job.state)
+            state["ingested"] = len(state["ingested"])
+            print(json.dumps(state, indent=2))
+        return 0
+    finally:
+        await close_openai()
+        await repository.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,119 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Hashable, Optional
+
+if TYPE_CHECKING:
+    from .shared_cache import SharedNamespace
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries also expire after a time-to-live.
+
+    Safe to share between the event loop and threadpool routes. Keeps simple
+    hit/miss/eviction counters so callers can report how well it is doing.
+
+    With ``shared`` (a namespace of the host-wide tier, see ``shared_cache``)
+    a local miss falls through to the entries other workers stored, and
+    sets and pops go to both tiers. ``local_ttl`` caps how long an entry
+    stays in the local tier then, bounding how stale a worker can be after
+    another one pops the key; 0 keeps only the shared copy.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float = 300.0,
+        shared: Optional["SharedNamespace"] = None,
+        local_ttl: Optional[float] = None,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.shared = shared
+        self.local_ttl = ttl if local_ttl is None or shared is None else local_ttl
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.shared_hits = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING and item[0] <= now:
+                del self._data[key]
+                self.expirations += 1
+                item = _MISSING
+            if item is not _MISSING:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if self.shared is None:
+                self.misses += 1
+                return default
+        found = self.shared.get(key)
+        if found is None:
+            with self._lock:
+                self.misses += 1
+            return default
+        value, remaining = found
+        self._set_local(key, value, min(remaining, self.local_ttl))
+        with self._lock:
+            self.shared_hits += 1
+            self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        self._set_local(key, value, min(ttl, self.local_ttl))
+        if self.shared is not None:
+            self.shared.set(key, value, ttl)
+
+    def _set_local(self, key: Hashable, value: Any, ttl: float) -> None:
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+        if self.shared is not None:
+            self.shared.delete(key)
+        return default if item is _MISSING else item[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            return item is not _MISSING and item[0] > time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            **({"shared_hits": self.shared_hits} if self.shared is not None else {}),
+        }
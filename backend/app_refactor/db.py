@@ -1,9 +1,73 @@
+import asyncio
+import importlib
 import os
+from typing import TYPE_CHECKING, Optional
+
+import httpx
 from dotenv import load_dotenv
-from supabase import create_client, Client
+
+if TYPE_CHECKING:
+    from supabase import AsyncClient
 
 load_dotenv()
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "50"))
+DB_TIMEOUT_SECONDS = float(os.getenv("DB_TIMEOUT_SECONDS", "30"))
+
+_http_client: Optional[httpx.AsyncClient] = None
+_supabase: Optional["AsyncClient"] = None
+_supabase_lock = asyncio.Lock()
+
+
+def get_http_pool() -> httpx.AsyncClient:
+    """Keep-alive connection pool shared by PostgREST and GoTrue calls."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            http2=True,
+            timeout=DB_TIMEOUT_SECONDS,
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=DB_POOL_SIZE,
+                max_keepalive_connections=DB_POOL_SIZE,
+            ),
+        )
+    return _http_client
+
+
+async def get_supabase() -> "AsyncClient":
+    """Return the process-wide async Supabase client, creating it on first use."""
+    global _supabase
+    if _supabase is None:
+        async with _supabase_lock:
+            if _supabase is None:
+                # Imported on first use; the SQLite backend never needs it
+                from supabase import AsyncClientOptions, acreate_client
+                _supabase = await acreate_client(
+                    SUPABASE_URL,
+                    SUPABASE_KEY,
+                    options=AsyncClientOptions(
+                        httpx_client=get_http_pool(),
+                        # Server-side client: never persist or refresh a user session on it.
+                        auto_refresh_token=False,
+                        persist_session=False,
+                    ),
+                )
+    return _supabase
+
+
+async def warm_supabase() -> None:
+    """Create the client and open a pooled connection to the project ahead of the first query."""
+    await asyncio.to_thread(importlib.import_module, "supabase")
+    await get_supabase()
+    await get_http_pool().head(f"{SUPABASE_URL.rstrip('/')}/rest/v1/", headers={"apikey": SUPABASE_KEY})
+
+
+async def close_supabase() -> None:
+    global _supabase, _http_client
+    _supabase = None
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
@@ -1,12 +1,21 @@
 from fastapi import Header, HTTPException, Depends
-from .db import supabase
+from .db import get_supabase
+from .telemetry import span
+from .token_verifier import token_verifier, TokenVerificationError
 from typing import Optional
 
+async def _get_remote_user(token: str):
+    return await (await get_supabase()).auth.get_user(token)
+
 async def get_current_user(authorization: Optional[str] = Header(None)):
     if not authorization:
         raise HTTPException(status_code=401, detail="Authorization header missing. Please log in.")
     token = authorization.replace("Bearer ", "").strip()
-    resp = supabase.auth.get_user(token)
-    if not resp.user:
+    try:
+        with span("auth", "verify_token"):
+            return await token_verifier.verify(
+                token,
+                remote_lookup=_get_remote_user,
+            )
+    except TokenVerificationError:
         raise HTTPException(401, "Invalid or expired token.")
-    return resp.user
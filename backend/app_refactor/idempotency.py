@@ -0,0 +1,315 @@
+"""``Idempotency-Key`` support for the POST endpoints that call the model.
+
+A retried or double-submitted request carrying the same key as an earlier
+one must not start a second completion or write a second set of rows. The
+middleware fingerprints each keyed request (method, path, query and the
+canonical JSON body) and, per authenticated user and key:
+
+    first request        runs normally; a 2xx response is stored for IDEMPOTENCY_TTL
+    repeat, finished     gets the stored response back with ``Idempotent-Replayed: true``
+    repeat, in flight    waits for the original and gets its response
+    different request    422, the key is already bound to another payload
+
+Anything other than a 2xx is not stored, so a retry after a failure runs
+again. Requests without the header, or whose token does not verify, pass
+straight through.
+
+Under ``serve.py`` with several workers a retry may land on another process,
+so stored responses and in-flight claims also go to the host-wide shared
+cache; a duplicate waiting on another worker's request polls it instead of
+awaiting a future.
+
+    IDEMPOTENCY_TTL             seconds a completed response is replayed
+    IDEMPOTENCY_CACHE_SIZE      stored responses kept in memory (LRU beyond that)
+    IDEMPOTENCY_WAIT_TIMEOUT    how long a duplicate waits on the original before a 409
+    IDEMPOTENCY_MAX_BODY        responses larger than this many bytes are not stored
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .cache import TTLCache
+from .shared_cache import shared_namespace
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "120"))
+IDEMPOTENCY_MAX_BODY = int(os.getenv("IDEMPOTENCY_MAX_BODY", str(1024 * 1024)))
+MAX_KEY_LENGTH = 255
+
+# The LLM-backed POST routes; the streaming variant is left out since an SSE
+# reply cannot be replayed meaningfully.
+IDEMPOTENT_ROUTES = (
+    "/api/chat",
+    "/api/chat-sessions/{session_id}/messages",
+    "/api/journals",
+    "/api/journal-summaries",
+    "/api/chat-summaries",
+)
+
+HEADER = b"idempotency-key"
+REPLAYED_HEADER = (b"idempotent-replayed", b"true")
+# How often a duplicate checks on a request running in another worker
+REMOTE_POLL_INTERVAL = 0.05
+
+# Returns the user id for an Authorization header value, or None if it does not verify
+OwnerLookup = Callable[[str], Awaitable[Optional[str]]]
+
+
+def fingerprint(method: str, path: str, query: bytes, body: bytes) -> str:
+    """sha256 of the request; JSON bodies are canonicalised so key order and whitespace don't matter."""
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode()
+    except (ValueError, UnicodeDecodeError):
+        pass
+    digest = hashlib.sha256()
+    for part in (method.encode(), path.encode(), query, body):
+        digest.update(part)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _encode_response(response: dict) -> dict:
+    return {
+        **response,
+        "headers": [[part.decode("latin-1") for part in h] for h in response["headers"]],
+        "body": base64.b64encode(response["body"]).decode(),
+    }
+
+
+def _decode_response(data: dict) -> dict:
+    return {
+        **data,
+        "headers": [[part.encode("latin-1") for part in h] for h in data["headers"]],
+        "body": base64.b64decode(data["body"]),
+    }
+
+
+class IdempotencyStore:
+    """Completed responses (TTL + LRU) and the requests still running.
+
+    A request running in this process is a future; one running in another
+    worker is a claim in the shared cache, returned by ``lookup`` with no
+    future.
+    """
+
+    def __init__(
+        self,
+        ttl: float = IDEMPOTENCY_TTL,
+        maxsize: int = IDEMPOTENCY_CACHE_SIZE,
+        claim_ttl: float = IDEMPOTENCY_WAIT_TIMEOUT,
+    ):
+        self.responses = TTLCache(
+            maxsize=maxsize, ttl=ttl,
+            shared=shared_namespace("idempotency", encode=_encode_response, decode=_decode_response),
+        )
+        self.claim_ttl = claim_ttl
+        self._claims = shared_namespace("idempotency_claim")
+        self._in_flight: Dict[Tuple[str, str], Tuple[str, asyncio.Future]] = {}
+        self.counts = {"stored": 0, "replayed": 0, "waited": 0, "mismatched": 0, "timed_out": 0}
+
+    def lookup(self, key: Tuple[str, str]) -> Tuple[Optional[dict], Optional[Tuple[str, Optional[asyncio.Future]]]]:
+        running = self._in_flight.get(key)
+        if running is None and self._claims is not None:
+            claim = self._claims.get(key)
+            running = (claim[0]["fingerprint"], None) if claim else None
+        return self.responses.get(key), running
+
+    def claim(self, key: Tuple[str, str], request_fingerprint: str) -> Optional[asyncio.Future]:
+        """Mark the request as running here; None if another worker claimed it first."""
+        if self._claims is not None and not self._claims.add(
+            key, {"fingerprint": request_fingerprint, "pid": os.getpid()}, self.claim_ttl
+        ):
+            return None
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = (request_fingerprint, future)
+        return future
+
+    async def wait(self, key: Tuple[str, str], running: Tuple[str, Optional[asyncio.Future]], timeout: float) -> Optional[dict]:
+        """The original request's response, or None if it ended without one; TimeoutError past ``timeout``."""
+        if running[1] is not None:
+            return await asyncio.wait_for(asyncio.shield(running[1]), timeout)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(REMOTE_POLL_INTERVAL)
+            found = self.responses.shared.get(key)
+            if found is not None:
+                return found[0]
+            if self._claims.get(key) is None:
+                return None
+        raise asyncio.TimeoutError
+
+    def release(self, key: Tuple[str, str], future: asyncio.Future, response: Optional[dict]) -> None:
+        """Hand ``response`` to the waiters and store it if it is worth replaying."""
+        self._in_flight.pop(key, None)
+        if response is not None and 200 <= response["status"] < 300:
+            self.responses.set(key, response)
+            self.counts["stored"] += 1
+        # After the response is stored, so a remote waiter never sees neither
+        if self._claims is not None:
+            self._claims.delete(key)
+        if not future.done():
+            future.set_result(response)
+
+    def stats(self) -> dict:
+        return {**self.responses.stats(), "in_flight": len(self._in_flight), **self.counts}
+
+
+idempotency_store = IdempotencyStore()
+
+
+def _route_pattern(template: str) -> "re.Pattern":
+    return re.compile("^" + re.sub(r"\\\{[^/]+?\\\}", "[^/]+", re.escape(template)) + "$")
+
+
+async def _send_json(send, status: int, detail: str) -> None:
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _replay(send, response: dict) -> None:
+    await send({
+        "type": "http.response.start",
+        "status": response["status"],
+        "headers": [tuple(h) for h in response["headers"]] + [REPLAYED_HEADER],
+    })
+    await send({"type": "http.response.body", "body": response["body"]})
+
+
+class IdempotencyMiddleware:
+    """ASGI middleware applying ``Idempotency-Key`` semantics to the given POST routes.
+
+    ``owner`` maps the Authorization header to a user id, so keys are scoped
+    per user and survive a token refresh. Plain ASGI, like the telemetry
+    middleware, so the body can be buffered once and handed on unchanged.
+    """
+
+    def __init__(
+        self,
+        app,
+        owner: OwnerLookup,
+        routes: Iterable[str] = IDEMPOTENT_ROUTES,
+        store: IdempotencyStore = idempotency_store,
+        wait_timeout: float = IDEMPOTENCY_WAIT_TIMEOUT,
+        max_body: int = IDEMPOTENCY_MAX_BODY,
+    ):
+        self.app = app
+        self.owner = owner
+        self.patterns = [_route_pattern(r) for r in routes]
+        self.store = store
+        self.wait_timeout = wait_timeout
+        self.max_body = max_body
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        idempotency_key = headers.get(HEADER)
+        if idempotency_key is None or not any(p.match(scope["path"]) for p in self.patterns):
+            return await self.app(scope, receive, send)
+        if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+            return await _send_json(send, 400, f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters.")
+
+        user_id = await self.owner(headers.get(b"authorization", b"").decode("latin-1"))
+        if user_id is None:
+            # Let the route reject the request with its usual 401
+            return await self.app(scope, receive, send)
+
+        body, receive = await _buffer_body(receive)
+        request_fingerprint = fingerprint(scope["method"], scope["path"], scope.get("query_string", b""), body)
+        key = (str(user_id), idempotency_key.decode("latin-1"))
+
+        while True:
+            stored, running = self.store.lookup(key)
+            seen = stored["fingerprint"] if stored else running[0] if running else None
+            if seen is not None and seen != request_fingerprint:
+                self.store.counts["mismatched"] += 1
+                return await _send_json(send, 422, "Idempotency-Key was already used for a different request.")
+            if stored is not None:
+                self.store.counts["replayed"] += 1
+                logger.info("Replaying response for Idempotency-Key %s of user %s", key[1], key[0])
+                return await _replay(send, stored)
+            if running is None:
+                future = self.store.claim(key, request_fingerprint)
+                if future is not None:
+                    break
+                continue  # another worker got there first; look again
+            self.store.counts["waited"] += 1
+            try:
+                response = await self.store.wait(key, running, self.wait_timeout)
+            except asyncio.TimeoutError:
+                self.store.counts["timed_out"] += 1
+                return await _send_json(send, 409, "A request with this Idempotency-Key is still in progress.")
+            if response is not None:
+                return await _replay(send, response)
+            # The original died without a response; run this one instead
+
+        captured: Optional[dict] = None
+        chunks: List[bytes] = []
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal captured, size
+            if message["type"] == "http.response.start":
+                captured = {
+                    "fingerprint": request_fingerprint,
+                    "status": message["status"],
+                    "headers": [list(h) for h in message.get("headers", [])],
+                    "body": b"",
+                }
+            elif message["type"] == "http.response.body" and captured is not None:
+                chunk = message.get("body", b"")
+                size += len(chunk)
+                if size <= self.max_body:
+                    chunks.append(chunk)
+                if not message.get("more_body", False):
+                    captured["body"] = b"".join(chunks) if size <= self.max_body else None
+            await send(message)
+
+        response = None
+        try:
+            await self.app(scope, receive, send_wrapper)
+            if captured is not None and captured["body"] is not None:
+                response = captured
+        finally:
+            self.store.release(key, future, response)
+
+
+async def _buffer_body(receive) -> Tuple[bytes, Callable]:
+    """Read the whole request body; returns it and a ``receive`` that hands it on once."""
+    parts = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            # Client went away before sending the body; let the app see that
+            parts = None
+            first = message
+            break
+        parts.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            first = {"type": "http.request", "body": b"".join(parts), "more_body": False}
+            break
+
+    delivered = False
+
+    async def replay_receive():
+        nonlocal delivered
+        if not delivered:
+            delivered = True
+            return first
+        return await receive()
+
+    return (b"".join(parts) if parts is not None else b""), replay_receive
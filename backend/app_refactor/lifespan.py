@@ -0,0 +1,73 @@
+"""Process lifecycle shared by both apps: start-up, background warm-up and shutdown.
+
+Importing the app builds nothing; clients are created on first use. The
+lifespan starts the chat-message writer (which replays its outbox) and
+then, without holding up readiness, warms what the first requests would
+otherwise pay for: heavy imports, the storage and LLM clients with an open
+keep-alive connection each, the JWKS and the tokenizer. Requests that
+arrive mid warm-up simply do the remaining work themselves.
+
+On shutdown the writer is flushed first, then every shared client is closed.
+
+    STARTUP_WARMUP            false skips the background warm-up
+    STARTUP_WARMUP_TIMEOUT    seconds before an unfinished warm-up step is abandoned
+"""
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from fastapi import FastAPI
+
+from .llm import close_llm, get_provider
+from .message_writer import message_writer
+from .prompt_builder import load_encoding
+from .repository import repository
+from .token_verifier import token_verifier
+
+logger = logging.getLogger(__name__)
+
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() in ("1", "true", "yes")
+STARTUP_WARMUP_TIMEOUT = float(os.getenv("STARTUP_WARMUP_TIMEOUT", "30"))
+
+
+async def _step(name: str, warm: Callable[[], Awaitable]) -> None:
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(warm(), STARTUP_WARMUP_TIMEOUT)
+    except Exception as e:
+        # A cold client is slower, not broken; the first request retries for real
+        logger.warning("Warm-up of %s failed after %.0f ms: %s", name, (time.perf_counter() - start) * 1000, e)
+    else:
+        logger.info("Warmed %s in %.0f ms", name, (time.perf_counter() - start) * 1000)
+
+
+async def warm_up() -> None:
+    """Prepare clients and caches in the order requests need them; every step is best effort."""
+    start = time.perf_counter()
+    # One after another: the imports contend for the GIL, so running them
+    # side by side would only delay the storage client every request needs.
+    await _step(f"storage ({repository.name})", repository.warm)
+    await _step("auth", token_verifier.warm)
+    await _step("llm", lambda: get_provider().warm())
+    await _step("tokenizer", lambda: asyncio.to_thread(load_encoding))
+    logger.info("Warm-up finished in %.0f ms", (time.perf_counter() - start) * 1000)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # Replays chat messages a previous process buffered but never flushed
+    await message_writer.start()
+    warming: Optional[asyncio.Task] = asyncio.create_task(warm_up()) if STARTUP_WARMUP else None
+    app.state.warm_up = warming
+    try:
+        yield
+    finally:
+        if warming is not None and not warming.done():
+            warming.cancel()
+            await asyncio.gather(warming, return_exceptions=True)
+        await message_writer.close()
+        await close_llm()
+        await repository.close()
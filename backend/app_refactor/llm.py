@@ -0,0 +1,307 @@
+import asyncio
+import importlib
+import logging
+import os
+import threading
+from collections import defaultdict
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Dict, Optional, Union
+
+import httpx
+from dotenv import load_dotenv
+from pydantic import BaseModel
+
+from .llm_cache import llm_cache
+from .llm_router import model_router
+from .llm_scheduler import Priority, llm_scheduler
+from .telemetry import record_llm_usage, span
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_POOL_SIZE = int(os.getenv("OPENAI_POOL_SIZE", "100"))
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
+# "openai" (default) or "fake" for offline load and capacity tests
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai").lower()
+
+_client: Optional["AsyncOpenAI"] = None
+
+
+def get_openai() -> "AsyncOpenAI":
+    """Return the process-wide AsyncOpenAI client with its own keep-alive pool."""
+    global _client
+    if _client is None:
+        # Imported here: the SDK is the heaviest import in the app and the
+        # fake provider never needs it.
+        from openai import AsyncOpenAI
+        _client = AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            timeout=OPENAI_TIMEOUT_SECONDS,
+            http_client=httpx.AsyncClient(
+                timeout=OPENAI_TIMEOUT_SECONDS,
+                limits=httpx.Limits(
+                    max_connections=OPENAI_POOL_SIZE,
+                    max_keepalive_connections=OPENAI_POOL_SIZE,
+                ),
+            ),
+        )
+    return _client
+
+
+# ─── Provider interface ──────────────────────────────────────────────────
+class Usage(BaseModel):
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+    # Prompt tokens served from the provider's prefix cache (see prompt_builder)
+    cached_tokens: int = 0
+
+
+class Completion(BaseModel):
+    text: str
+    model: str
+    usage: Usage = Usage()
+    finish_reason: Optional[str] = None
+
+
+class LLMProvider:
+    """A chat-completions backend. Arguments follow ``chat.completions.create``.
+
+    ``stream`` yields text deltas and, as its last item, the call's ``Usage``.
+    Errors are raised as the ``openai`` exception types so callers handle
+    every provider the same way.
+    """
+    name = ""
+
+    async def complete(self, **kwargs) -> Completion:
+        raise NotImplementedError
+
+    def stream(self, **kwargs) -> AsyncIterator[Union[str, Usage]]:
+        raise NotImplementedError
+
+    async def warm(self) -> None:
+        """Get ready for the first call (imports, client, connection); best effort."""
+
+    async def close(self) -> None:
+        pass
+
+
+def _usage_from(raw) -> Usage:
+    if raw is None:
+        return Usage()
+    return Usage(
+        prompt_tokens=raw.prompt_tokens or 0,
+        completion_tokens=raw.completion_tokens or 0,
+        total_tokens=raw.total_tokens or 0,
+        cached_tokens=getattr(getattr(raw, "prompt_tokens_details", None), "cached_tokens", None) or 0,
+    )
+
+
+class OpenAIProvider(LLMProvider):
+    name = "openai"
+
+    async def complete(self, **kwargs) -> Completion:
+        resp = await get_openai().chat.completions.create(**kwargs)
+        choice = resp.choices[0]
+        return Completion(
+            text=choice.message.content or "",
+            model=resp.model,
+            usage=_usage_from(resp.usage),
+            finish_reason=choice.finish_reason,
+        )
+
+    async def stream(self, **kwargs) -> AsyncIterator[Union[str, Usage]]:
+        stream = await get_openai().chat.completions.create(
+            stream=True, stream_options={"include_usage": True}, **kwargs
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if chunk.usage:
+                yield _usage_from(chunk.usage)
+
+    async def warm(self) -> None:
+        # Import off the event loop, then open the TLS connection with a free call
+        openai = await asyncio.to_thread(importlib.import_module, "openai")
+        try:
+            await get_openai().with_options(max_retries=0, timeout=10).models.list()
+        except openai.APIStatusError:
+            pass  # any HTTP answer means the connection is up
+
+    async def close(self) -> None:
+        await close_openai()
+
+
+_provider: Optional[LLMProvider] = None
+_usage: Dict[str, Dict[str, int]] = defaultdict(
+    lambda: {"calls": 0, "errors": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+)
+_usage_lock = threading.Lock()
+
+
+def get_provider() -> LLMProvider:
+    """The process-wide provider, chosen by LLM_PROVIDER on first use."""
+    global _provider
+    if _provider is None:
+        if LLM_PROVIDER == "fake":
+            from .llm_fake import FakeProvider
+            _provider = FakeProvider.from_env()
+        else:
+            _provider = OpenAIProvider()
+        logger.info("LLM provider: %s", _provider.name)
+    return _provider
+
+
+def set_provider(provider: LLMProvider) -> None:
+    """Swap the provider, e.g. to a configured FakeProvider in a benchmark."""
+    global _provider
+    _provider = provider
+
+
+def _record(model: str, usage: Optional[Usage], error: bool = False, first_token: Optional[float] = None) -> None:
+    with _usage_lock:
+        stats = _usage[model]
+        stats["calls"] += 1
+        stats["errors"] += int(error)
+        if usage is not None:
+            stats["prompt_tokens"] += usage.prompt_tokens
+            stats["cached_tokens"] += usage.cached_tokens
+            stats["completion_tokens"] += usage.completion_tokens
+    if usage is not None:
+        record_llm_usage(model, usage.prompt_tokens, usage.completion_tokens, usage.cached_tokens, first_token)
+
+
+def usage_stats() -> dict:
+    """Calls, errors and token totals per model since startup, with the share of prompt tokens served from cache."""
+    with _usage_lock:
+        models = {
+            m: {**s, "cached_ratio": round(s["cached_tokens"] / s["prompt_tokens"], 3) if s["prompt_tokens"] else 0.0}
+            for m, s in _usage.items()
+        }
+    return {"provider": get_provider().name, "models": models}
+
+
+# ─── Call helpers ────────────────────────────────────────────────────────
+async def chat_completion(
+    priority: Priority = Priority.INTERACTIVE, user: Optional[str] = None, route: Optional[str] = None, **kwargs
+) -> Completion:
+    """Run one chat completion on the configured provider, once the scheduler admits it.
+
+    ``priority`` and ``user`` place the call in the scheduler's queues; see
+    ``llm_scheduler``. Time spent queued is outside the ``llm`` span.
+    With ``route`` the model is chosen, hedged and fallen back by
+    ``model_router`` and any ``model`` argument is ignored.
+    """
+    if route is None:
+        return await _complete_once(priority, user, **kwargs)
+    plan = model_router.plan(route, kwargs.get("messages", []), "complete", priority)
+    return await model_router.complete(
+        plan, lambda model: _complete_once(priority, user, **{**kwargs, "model": model})
+    )
+
+
+async def _complete_once(priority: Priority, user: Optional[str], **kwargs) -> Completion:
+    model = kwargs.get("model", "unknown")
+    async with llm_scheduler.slot(priority, user) as lease:
+        with span("llm", model) as s:
+            try:
+                result = await get_provider().complete(**kwargs)
+            except Exception:
+                _record(model, None, error=True)
+                raise
+            lease.first_token()  # the whole reply arrives at once
+            s.attrs.update(
+                prompt_tokens=result.usage.prompt_tokens,
+                cached_tokens=result.usage.cached_tokens,
+                completion_tokens=result.usage.completion_tokens,
+            )
+    _record(model, result.usage, first_token=lease.latency)
+    return result
+
+
+async def complete_text(
+    cache: Optional[str] = None,
+    priority: Priority = Priority.INTERACTIVE,
+    user: Optional[str] = None,
+    route: Optional[str] = None,
+    validate: Optional[Callable[[str], bool]] = None,
+    **kwargs,
+) -> str:
+    """Run a chat completion and return just the first choice's text.
+
+    ``cache`` opts the call into the content-addressed response cache under
+    that call-site name. Use it only for non-interactive calls (summaries,
+    profiles), where a repeated prompt should reuse the stored answer.
+    Those calls also pass ``priority=Priority.BACKGROUND`` so chat turns go
+    first; ``user`` keeps one user's calls from crowding out everyone else's.
+    ``route`` names the request class the model is picked for (see
+    ``llm_router``); the cache key uses the route, not the model that answered.
+    ``validate`` decides whether a reply may be cached (it is returned either way).
+    """
+    async def call() -> str:
+        return (await chat_completion(priority=priority, user=user, route=route, **kwargs)).text
+
+    if cache is None:
+        return await call()
+    return await llm_cache.get_or_call(cache, {**kwargs, "route": route} if route else kwargs, call, validate)
+
+
+async def stream_text(
+    priority: Priority = Priority.INTERACTIVE, user: Optional[str] = None, route: Optional[str] = None, **kwargs
+) -> AsyncIterator[str]:
+    """Run a streaming chat completion and yield text deltas as they arrive.
+
+    The scheduler slot is held, and the ``llm`` span covers, the whole
+    stream, first token to last. ``route`` works as in ``chat_completion``;
+    hedging and fallback end once the first delta has been sent.
+    """
+    if route is None:
+        stream = _stream_once(priority, user, **kwargs)
+    else:
+        plan = model_router.plan(route, kwargs.get("messages", []), "stream", priority)
+        stream = model_router.stream(plan, lambda model: _stream_once(priority, user, **{**kwargs, "model": model}))
+    try:
+        async for delta in stream:
+            yield delta
+    finally:
+        await stream.aclose()
+
+
+async def _stream_once(priority: Priority, user: Optional[str], **kwargs) -> AsyncIterator[str]:
+    model = kwargs.get("model", "unknown")
+    usage = None
+    async with llm_scheduler.slot(priority, user) as lease:
+        with span("llm", model) as s:
+            try:
+                async for item in get_provider().stream(**kwargs):
+                    if isinstance(item, Usage):
+                        usage = item
+                        s.attrs.update(
+                            prompt_tokens=usage.prompt_tokens,
+                            cached_tokens=usage.cached_tokens,
+                            completion_tokens=usage.completion_tokens,
+                        )
+                    else:
+                        lease.first_token()
+                        yield item
+            except Exception:
+                _record(model, None, error=True)
+                raise
+    _record(model, usage, first_token=lease.latency)
+
+
+async def close_llm() -> None:
+    """Close the provider's clients, if one was created."""
+    if _provider is not None:
+        await _provider.close()
+
+
+async def close_openai() -> None:
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
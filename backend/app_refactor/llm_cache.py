@@ -0,0 +1,243 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Optional
+
+from .cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Replies restate users' text, so they only reach disk (for LLM_CACHE_TTL)
+# when a path is configured; prompts are never stored, only their hash
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(30 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "50000"))
+LLM_CACHE_MEMORY_SIZE = int(os.getenv("LLM_CACHE_MEMORY_SIZE", "1000"))
+
+
+def cache_key(kwargs: dict) -> str:
+    """sha256 of the canonical JSON of a completion request (model, messages, params)."""
+    canonical = json.dumps(kwargs, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class _SQLiteTier:
+    """Persistent tier: one row per response, TTL plus LRU eviction past max_entries."""
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_responses ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS llm_responses_last_access ON llm_responses (last_access)")
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT value, expires_at FROM llm_responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                db.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+                db.commit()
+                return None
+            db.execute("UPDATE llm_responses SET last_access = ? WHERE key = ?", (now, key))
+            db.commit()
+            return row[0]
+
+    def set(self, key: str, value: str, ttl: float) -> int:
+        """Store ``value``; returns how many rows were evicted to make room."""
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO llm_responses (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl, now),
+            )
+            evicted = db.execute("DELETE FROM llm_responses WHERE expires_at <= ?", (now,)).rowcount
+            excess = db.execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0] - self.max_entries
+            if excess > 0:
+                evicted += db.execute(
+                    "DELETE FROM llm_responses WHERE key IN"
+                    " (SELECT key FROM llm_responses ORDER BY last_access LIMIT ?)",
+                    (excess,),
+                ).rowcount
+            db.commit()
+            return evicted
+
+    def stats(self) -> dict:
+        with self._lock:
+            db = self._db()
+            entries = db.execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0]
+        size = sum(os.path.getsize(p) for p in (self.path, self.path + "-wal") if os.path.exists(p))
+        return {"path": self.path, "entries": entries, "max_entries": self.max_entries, "bytes": size}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db().execute("DELETE FROM llm_responses")
+            self._db().commit()
+
+
+class _InFlight:
+    """One shared call and the number of callers still waiting on it."""
+
+    def __init__(self, task: "asyncio.Task[str]"):
+        self.task = task
+        self.waiters = 0
+
+
+class LLMResponseCache:
+    """Content-addressed cache for non-interactive completions.
+
+    Lookups go memory LRU -> SQLite (only with a ``path``) -> model. Rows
+    hold the sha256 of the request and the reply, never the prompt.
+    Concurrent identical requests share one in-flight call, so a duplicate
+    click or an overlapping backfill never pays for the same prompt twice.
+    The call runs as its own task: a caller that is cancelled leaves it to
+    the others, and only when every caller has gone is it cancelled.
+
+    A ``validate`` callback keeps replies the caller cannot use (say, a
+    profile that isn't JSON) out of the cache, so a retry asks the model
+    again instead of replaying the same bad reply.
+    """
+
+    def __init__(
+        self,
+        path: str = LLM_CACHE_PATH,
+        ttl: float = LLM_CACHE_TTL,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        memory_size: int = LLM_CACHE_MEMORY_SIZE,
+        enabled: bool = LLM_CACHE_ENABLED,
+    ):
+        self.ttl = ttl
+        self.enabled = enabled
+        self.memory = TTLCache(maxsize=memory_size, ttl=ttl)
+        self.disk: Optional[_SQLiteTier] = _SQLiteTier(path, max_entries) if path else None
+        self._inflight: Dict[str, _InFlight] = {}
+        self._counts: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: {"memory_hits": 0, "disk_hits": 0, "shared": 0, "misses": 0, "rejected": 0}
+        )
+        self.disk_evictions = 0
+        self.disk_errors = 0
+
+    async def get_or_call(
+        self,
+        site: str,
+        kwargs: dict,
+        call: Callable[[], Awaitable[str]],
+        validate: Optional[Callable[[str], bool]] = None,
+    ) -> str:
+        """The cached reply for ``kwargs``, else ``call()``'s, stored only if ``validate`` accepts it."""
+        if not self.enabled:
+            return await call()
+        key = cache_key(kwargs)
+        counts = self._counts[site]
+
+        value = self.memory.get(key)
+        if value is not None:
+            counts["memory_hits"] += 1
+            return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            counts["shared"] += 1
+        else:
+            task = asyncio.ensure_future(self._fill(key, counts, call, validate))
+            inflight = self._inflight[key] = _InFlight(task)
+            task.add_done_callback(lambda t: self._finished(key, t))
+
+        inflight.waiters += 1
+        try:
+            return await asyncio.shield(inflight.task)
+        except asyncio.CancelledError:
+            if inflight.waiters == 1 and not inflight.task.done():
+                # Nobody is left to use the reply; a later caller starts afresh
+                self._finished(key, inflight.task)
+                inflight.task.cancel()
+            raise
+        finally:
+            inflight.waiters -= 1
+
+    async def _fill(
+        self, key: str, counts: Dict[str, int], call: Callable[[], Awaitable[str]],
+        validate: Optional[Callable[[str], bool]],
+    ) -> str:
+        value = await self._disk_get(key)
+        if value is not None and (validate is None or validate(value)):
+            counts["disk_hits"] += 1
+        else:
+            counts["misses"] += 1
+            value = await call()
+            if validate is not None and not validate(value):
+                counts["rejected"] += 1
+                return value
+            await self._disk_set(key, value)
+        self.memory.set(key, value)
+        return value
+
+    def _finished(self, key: str, task: "asyncio.Task[str]") -> None:
+        if self._inflight.get(key) is not None and self._inflight[key].task is task:
+            del self._inflight[key]
+        if task.done() and not task.cancelled():
+            task.exception()  # retrieved here when every caller had already gone
+
+    async def _disk_get(self, key: str) -> Optional[str]:
+        if self.disk is None:
+            return None
+        try:
+            return await asyncio.to_thread(self.disk.get, key)
+        except sqlite3.Error as e:
+            self.disk_errors += 1
+            logger.warning("LLM cache read failed: %s", e)
+            return None
+
+    async def _disk_set(self, key: str, value: str) -> None:
+        if self.disk is None:
+            return
+        try:
+            self.disk_evictions += await asyncio.to_thread(self.disk.set, key, value, self.ttl)
+        except sqlite3.Error as e:
+            self.disk_errors += 1
+            logger.warning("LLM cache write failed: %s", e)
+
+    def stats(self) -> dict:
+        sites = {}
+        for site, c in self._counts.items():
+            lookups = sum(c.values()) - c["rejected"]  # a rejected reply was also a miss
+            sites[site] = {**c, "hit_ratio": round((lookups - c["misses"]) / lookups, 4) if lookups else 0.0}
+        try:
+            disk = self.disk.stats() if self.disk is not None else {"path": None}
+        except sqlite3.Error as e:
+            disk = {"error": str(e)}
+        return {
+            "enabled": self.enabled,
+            "memory": self.memory.stats(),
+            "disk": {**disk, "evictions": self.disk_evictions, "errors": self.disk_errors},
+            "sites": sites,
+        }
+
+
+llm_cache = LLMResponseCache()
@@ -0,0 +1,251 @@
+"""In-process fake chat-completions backend for offline load and capacity tests.
+
+Select it with ``LLM_PROVIDER=fake``; tune it with:
+
+    FAKE_LLM_LATENCY            time to first token, e.g. ``fixed:0.3``,
+                                ``uniform:0.2:0.8``, ``normal:0.5:0.1`` or
+                                ``lognormal:0.4:0.5`` (median, sigma); seconds
+    FAKE_LLM_MODEL_LATENCY      per-model overrides, ``gpt-4o=lognormal:1.2:0.4;gpt-4o-mini=fixed:0.3``
+    FAKE_LLM_TOKENS_PER_SECOND  generation speed after the first token
+    FAKE_LLM_OUTPUT_TOKENS      reply length cap (``max_tokens`` also applies)
+    FAKE_LLM_ERROR_RATE         share of calls that fail, 0..1
+    FAKE_LLM_ERRORS             comma-separated kinds: rate_limit, timeout, server
+    FAKE_LLM_SEED               seed for latency and error sampling
+    FAKE_LLM_PREFIX_CACHE_SPEEDUP   share of the first-token delay a fully cached
+                                prompt saves (0 disables the prefix cache)
+
+Replies are a deterministic function of the request, so caching and
+idempotency behave as with a real model; requests that ask for JSON (a JSON
+``response_format``, or an "only valid JSON" instruction) get a
+profile-shaped JSON object. Like OpenAI's, the fake remembers prompt
+prefixes of 1024 tokens and more and reports the reused part as
+``cached_tokens`` (whole messages only, rounded down to 128 tokens).
+"""
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, List, Optional, Union
+
+import httpx
+import openai
+
+from .llm import Completion, LLMProvider, Usage
+from .prompt_builder import MESSAGE_OVERHEAD_TOKENS, count_message_tokens, count_tokens
+
+ERROR_KINDS = ("rate_limit", "timeout", "server")
+# OpenAI's prefix cache: shortest cacheable prompt, granularity, and how many
+# prefixes the fake keeps
+PREFIX_CACHE_MIN_TOKENS = 1024
+PREFIX_CACHE_STEP = 128
+PREFIX_CACHE_ENTRIES = 10000
+# How the profile prompts ask for JSON; a bare "JSON" also appears in the
+# profile metadata that every chat prompt carries
+_JSON_INSTRUCTION = re.compile(r"\bonly valid JSON\b", re.IGNORECASE)
+
+
+class LatencyDistribution:
+    """Samples seconds from a ``kind:a[:b]`` spec."""
+
+    def __init__(self, spec: str):
+        self.spec = spec
+        kind, *params = spec.split(":")
+        self.kind = kind
+        self.params = [float(p) for p in params]
+        expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+        if kind not in expected or len(self.params) != expected[kind]:
+            raise ValueError(f"Invalid latency spec {spec!r}")
+
+    def sample(self, rng: random.Random) -> float:
+        p = self.params
+        if self.kind == "fixed":
+            value = p[0]
+        elif self.kind == "uniform":
+            value = rng.uniform(p[0], p[1])
+        elif self.kind == "normal":
+            value = rng.gauss(p[0], p[1])
+        else:
+            value = rng.lognormvariate(math.log(p[0]), p[1])
+        return max(0.0, value)
+
+
+def _parse_model_latency(spec: str) -> Dict[str, LatencyDistribution]:
+    result = {}
+    for part in filter(None, (s.strip() for s in spec.split(";"))):
+        model, dist = part.split("=", 1)
+        result[model.strip()] = LatencyDistribution(dist.strip())
+    return result
+
+
+class FakeProvider(LLMProvider):
+    name = "fake"
+
+    def __init__(
+        self,
+        latency: str = "lognormal:0.4:0.5",
+        model_latency: Optional[Dict[str, str]] = None,
+        tokens_per_second: float = 60.0,
+        output_tokens: int = 120,
+        error_rate: float = 0.0,
+        errors: tuple = ERROR_KINDS,
+        seed: Optional[int] = None,
+        prefix_cache_speedup: float = 0.5,
+    ):
+        self.latency = LatencyDistribution(latency)
+        self.model_latency = {m: LatencyDistribution(s) for m, s in (model_latency or {}).items()}
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = output_tokens
+        self.error_rate = error_rate
+        self.errors = tuple(errors)
+        unknown = set(self.errors) - set(ERROR_KINDS)
+        if unknown:
+            raise ValueError(f"Unknown fake error kinds: {sorted(unknown)}")
+        self.rng = random.Random(seed)
+        self.calls = 0
+        self.prefix_cache_speedup = prefix_cache_speedup
+        self._prefixes: "OrderedDict[str, None]" = OrderedDict()
+
+    @classmethod
+    def from_env(cls) -> "FakeProvider":
+        seed = os.getenv("FAKE_LLM_SEED")
+        provider = cls(
+            latency=os.getenv("FAKE_LLM_LATENCY", "lognormal:0.4:0.5"),
+            tokens_per_second=float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "60")),
+            output_tokens=int(os.getenv("FAKE_LLM_OUTPUT_TOKENS", "120")),
+            error_rate=float(os.getenv("FAKE_LLM_ERROR_RATE", "0")),
+            errors=tuple(e.strip() for e in os.getenv("FAKE_LLM_ERRORS", ",".join(ERROR_KINDS)).split(",") if e.strip()),
+            seed=int(seed) if seed else None,
+            prefix_cache_speedup=float(os.getenv("FAKE_LLM_PREFIX_CACHE_SPEEDUP", "0.5")),
+        )
+        provider.model_latency = _parse_model_latency(os.getenv("FAKE_LLM_MODEL_LATENCY", ""))
+        return provider
+
+    # ─── Reply generation ────────────────────────────────────────────────
+    def _reply_tokens(self, kwargs: dict) -> List[str]:
+        digest = hashlib.sha256(
+            json.dumps({k: kwargs.get(k) for k in ("model", "messages", "max_tokens", "temperature")},
+                       sort_keys=True, default=str).encode()
+        ).hexdigest()
+        text_rng = random.Random(digest)
+        limit = min(kwargs.get("max_tokens") or self.output_tokens, self.output_tokens)
+
+        if self._wants_json(kwargs):
+            reply = json.dumps({
+                "name": "Fake User",
+                "ratings": [{"category": "mood", "description": f"steady ({digest[:6]})"}],
+                "metadata": {"format": "JSONB", "source": "fake-llm", "version": "1.0", "created_at": ""},
+                "strengths": {"reflection": "Writes regularly"},
+                "weaknesses": {"sleep": "Irregular schedule"},
+            })
+            # ~4 characters per token keeps streaming pace realistic
+            return [reply[i:i + 4] for i in range(0, len(reply), 4)]
+
+        words = ("you", "feel", "today", "and", "that", "is", "okay", "it", "sounds", "like",
+                 "a", "lot", "of", "work", "rest", "week", "progress", "steady", "calm", "notice")
+        return [(" " if i else "") + text_rng.choice(words) for i in range(max(1, limit))]
+
+    @staticmethod
+    def _wants_json(kwargs: dict) -> bool:
+        response_format = kwargs.get("response_format") or {}
+        if response_format.get("type") in ("json_object", "json_schema"):
+            return True
+        return any(_JSON_INSTRUCTION.search(m.get("content") or "") for m in kwargs.get("messages", []))
+
+    def _cached_tokens(self, kwargs: dict) -> int:
+        """Tokens of the longest remembered message prefix; remembers this prompt's prefixes."""
+        if self.prefix_cache_speedup <= 0:
+            return 0
+        digest = hashlib.sha256(str(kwargs.get("model")).encode())
+        cached = length = 0
+        for message in kwargs.get("messages", []):
+            digest.update(json.dumps(message, sort_keys=True).encode())
+            length += MESSAGE_OVERHEAD_TOKENS + count_tokens(message.get("content") or "")
+            if length < PREFIX_CACHE_MIN_TOKENS:
+                continue
+            key = digest.hexdigest()
+            if key in self._prefixes:
+                self._prefixes.move_to_end(key)
+                cached = length
+            else:
+                self._prefixes[key] = None
+        while len(self._prefixes) > PREFIX_CACHE_ENTRIES:
+            self._prefixes.popitem(last=False)
+        return cached - cached % PREFIX_CACHE_STEP
+
+    def _usage(self, kwargs: dict, completion_tokens: int, cached_tokens: int) -> Usage:
+        prompt_tokens = count_message_tokens(kwargs.get("messages", []))
+        return Usage(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+            cached_tokens=min(cached_tokens, prompt_tokens),
+        )
+
+    # ─── Latency and errors ──────────────────────────────────────────────
+    def _first_token_delay(self, kwargs: dict, cached_tokens: int) -> float:
+        delay = self.model_latency.get(kwargs.get("model", "fake"), self.latency).sample(self.rng)
+        if cached_tokens:
+            prompt_tokens = count_message_tokens(kwargs.get("messages", []))
+            delay *= 1 - self.prefix_cache_speedup * min(1.0, cached_tokens / prompt_tokens)
+        return delay
+
+    def _maybe_error(self) -> Optional[str]:
+        if self.errors and self.error_rate > 0 and self.rng.random() < self.error_rate:
+            return self.rng.choice(self.errors)
+        return None
+
+    @staticmethod
+    def _raise(kind: str) -> None:
+        request = httpx.Request("POST", "https://fake-llm.local/v1/chat/completions")
+        if kind == "rate_limit":
+            raise openai.RateLimitError(
+                "Rate limit reached (injected by fake provider)",
+                response=httpx.Response(429, request=request), body=None,
+            )
+        if kind == "timeout":
+            raise openai.APITimeoutError(request=request)
+        raise openai.InternalServerError(
+            "Server error (injected by fake provider)",
+            response=httpx.Response(500, request=request), body=None,
+        )
+
+    # ─── Provider API ────────────────────────────────────────────────────
+    async def complete(self, **kwargs) -> Completion:
+        self.calls += 1
+        model = kwargs.get("model", "fake")
+        error = self._maybe_error()
+        tokens = self._reply_tokens(kwargs)
+        cached_tokens = self._cached_tokens(kwargs)
+        delay = self._first_token_delay(kwargs, cached_tokens)
+        if error:
+            await asyncio.sleep(delay)
+            self._raise(error)
+        await asyncio.sleep(delay + len(tokens) / self.tokens_per_second)
+        return Completion(
+            text="".join(tokens),
+            model=model,
+            usage=self._usage(kwargs, len(tokens), cached_tokens),
+            finish_reason="length" if len(tokens) >= (kwargs.get("max_tokens") or math.inf) else "stop",
+        )
+
+    async def stream(self, **kwargs) -> AsyncIterator[Union[str, Usage]]:
+        self.calls += 1
+        error = self._maybe_error()
+        tokens = self._reply_tokens(kwargs)
+        # Injected stream errors hit before the first token or part-way through.
+        fail_at = self.rng.randrange(len(tokens) + 1) if error else None
+        cached_tokens = self._cached_tokens(kwargs)
+        await asyncio.sleep(self._first_token_delay(kwargs, cached_tokens))
+        for i, token in enumerate(tokens):
+            if i == fail_at:
+                self._raise(error)
+            if i:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            yield token
+        if fail_at == len(tokens):
+            self._raise(error)
+        yield self._usage(kwargs, len(tokens), cached_tokens)
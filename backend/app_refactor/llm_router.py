@@ -0,0 +1,326 @@
+"""Model selection per request class, with hedged requests and fallback.
+
+Call sites name what they need (``route="chat"``, ``"summary"``, ...) rather
+than a model. Each route has a policy: the quality tier it requires, and
+optionally a lighter tier for short messages (a "thanks" does not need the
+premium model). Downgrading is off by default: a short reply in a therapy
+chat can still be the one that matters, so a route only uses its light tier
+when it is listed in ``LLM_LIGHT_ROUTES`` and ``LLM_LIGHT_MESSAGE_TOKENS`` is
+set. Within the tier the router prefers the catalogue order but moves to
+another model of the same tier once the preferred one is clearly slower
+(``LLM_ROUTER_SWITCH_RATIO``) or keeps failing.
+
+Hedging: on routes that allow it, when the chosen model has not answered
+(for streams, sent its first token) by its own p90 latency, a second
+request goes to the fastest other model of the same tier (of any tier
+only on routes in ``LLM_LIGHT_ROUTES``, so a hedge never downgrades a route
+that has not opted in). Whichever answers first is used and the other is
+cancelled, which closes its HTTP request and frees its scheduler slot.
+Hedges are skipped while the LLM scheduler has calls waiting, since they
+would only add load.
+
+Fallback: if the chosen model fails with a retryable error (429, 5xx,
+timeout, connection) the next model is tried: the rest of the tier, then
+the other tiers. A stream can only fall back before its first token.
+
+Per-model latency percentiles, wins, hedges and fallbacks are kept for
+``stats()`` and exported as ``llm_router_events_total``.
+
+    LLM_MODELS                  catalogue, ``model=tier`` in order of preference
+    LLM_LIGHT_MESSAGE_TOKENS    messages shorter than this use the light tier (0, the default, disables)
+    LLM_LIGHT_ROUTES            comma-separated routes that may downgrade or hedge across tiers
+    LLM_HEDGE_PERCENTILE        latency percentile of the primary after which to hedge
+    LLM_HEDGE_DEFAULT_DELAY     hedge delay until a model has enough samples
+    LLM_HEDGE_MIN_DELAY         never hedge sooner than this
+    LLM_ROUTER_SWITCH_RATIO     how much slower the preferred model may be before another is used
+    LLM_MODEL_COOLDOWN          seconds a model is skipped after repeated failures
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+from .llm_scheduler import LLMBusyError, Priority, llm_scheduler
+from .prompt_builder import count_tokens
+from .telemetry import llm_router_events
+
+logger = logging.getLogger(__name__)
+
+TIERS = ("standard", "premium")
+LLM_MODELS = os.getenv("LLM_MODELS", "gpt-4o=premium,gpt-4-turbo=premium,gpt-4o-mini=standard")
+LLM_LIGHT_MESSAGE_TOKENS = int(os.getenv("LLM_LIGHT_MESSAGE_TOKENS", "0"))
+LLM_LIGHT_ROUTES = frozenset(filter(None, (r.strip() for r in os.getenv("LLM_LIGHT_ROUTES", "").split(","))))
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "90"))
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "3"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+LLM_ROUTER_SWITCH_RATIO = float(os.getenv("LLM_ROUTER_SWITCH_RATIO", "1.5"))
+LLM_MODEL_COOLDOWN = float(os.getenv("LLM_MODEL_COOLDOWN", "30"))
+
+# Latency samples kept per model, and needed before percentiles are trusted
+_WINDOW = 200
+_MIN_SAMPLES = 20
+# Failures in a row that put a model on cooldown
+_MAX_CONSECUTIVE_ERRORS = 3
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class RoutePolicy:
+    tier: str
+    light_tier: Optional[str] = None  # for short messages, if the route is in LLM_LIGHT_ROUTES
+    hedge: bool = False
+
+
+POLICIES: Dict[str, RoutePolicy] = {
+    "chat": RoutePolicy(tier="premium", light_tier="standard", hedge=True),
+    "insight": RoutePolicy(tier="premium", hedge=True),
+    "summary": RoutePolicy(tier="standard"),
+    "profile": RoutePolicy(tier="standard"),
+}
+
+
+@dataclass
+class Plan:
+    route: str
+    kind: str  # "complete" (latency = whole call) or "stream" (latency = first token)
+    primary: str
+    fallbacks: List[str]
+    hedge: Optional[str] = None
+    hedge_delay: float = 0.0
+
+
+def _parse_models(spec: str) -> Dict[str, str]:
+    models = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, tier = part.split("=", 1)
+        if tier.strip() not in TIERS:
+            raise ValueError(f"Unknown tier {tier!r} for model {name!r}")
+        models[name.strip()] = tier.strip()
+    return models
+
+
+def _retryable(error: BaseException) -> bool:
+    """Whether another model might succeed where this one failed."""
+    if isinstance(error, LLMBusyError):
+        return False  # every model waits in the same queue
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    # openai's APITimeoutError / APIConnectionError carry no status
+    return isinstance(error, (asyncio.TimeoutError, ConnectionError)) or type(error).__name__ in (
+        "APITimeoutError", "APIConnectionError",
+    )
+
+
+class ModelStats:
+    def __init__(self):
+        self.latency: Dict[str, Deque[float]] = {"complete": deque(maxlen=_WINDOW), "stream": deque(maxlen=_WINDOW)}
+        self.counts = {"calls": 0, "errors": 0, "wins": 0, "losses": 0, "hedges": 0, "hedge_wins": 0, "fallbacks": 0}
+        self.consecutive_errors = 0
+        self.cooldown_until = 0.0
+
+    def percentile(self, kind: str, pct: float) -> Optional[float]:
+        samples = self.latency[kind]
+        if len(samples) < _MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def snapshot(self) -> dict:
+        races = self.counts["wins"] + self.counts["losses"]
+        return {
+            **self.counts,
+            "win_rate": round(self.counts["wins"] / races, 3) if races else None,
+            "cooling_down": self.cooldown_until > time.monotonic(),
+            **{
+                f"{kind}_p{pct}_ms": round(v * 1000, 1)
+                for kind in self.latency for pct in (50, 90)
+                if (v := self.percentile(kind, pct)) is not None
+            },
+        }
+
+
+class ModelRouter:
+    def __init__(self, models: str = LLM_MODELS, policies: Dict[str, RoutePolicy] = POLICIES):
+        self.models = _parse_models(models)
+        self.policies = policies
+        self._stats: Dict[str, ModelStats] = {m: ModelStats() for m in self.models}
+        self._lock = threading.Lock()
+
+    def _model_stats(self, model: str) -> ModelStats:
+        with self._lock:
+            return self._stats.setdefault(model, ModelStats())
+
+    def _event(self, model: str, event: str) -> None:
+        self._model_stats(model).counts[event] += 1
+        llm_router_events.inc(model=model, event=event)
+
+    # ─── Choosing ────────────────────────────────────────────────────────
+    def default_model(self, route: str) -> str:
+        """The route's preferred model, ignoring latency; for batch jobs and cache keys."""
+        tier = self.policies[route].tier
+        return next(m for m, t in self.models.items() if t == tier)
+
+    def _tier(self, route: str, messages: List[dict]) -> str:
+        policy = self.policies[route]
+        if policy.light_tier and LLM_LIGHT_MESSAGE_TOKENS and route in LLM_LIGHT_ROUTES:
+            last_user = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+            if count_tokens(last_user) < LLM_LIGHT_MESSAGE_TOKENS:
+                return policy.light_tier
+        return policy.tier
+
+    def _available(self, model: str) -> bool:
+        return self._model_stats(model).cooldown_until <= time.monotonic()
+
+    def plan(self, route: str, messages: List[dict], kind: str, priority: Priority) -> Plan:
+        if route not in self.policies:
+            raise ValueError(f"Unknown LLM route {route!r}")
+        tier = self._tier(route, messages)
+        in_tier = [m for m, t in self.models.items() if t == tier] or list(self.models)
+        others = [m for m, t in sorted(self.models.items(), key=lambda mt: -TIERS.index(mt[1])) if t != tier]
+        candidates = [m for m in in_tier if self._available(m)] or in_tier
+
+        # Stay with the preferred model unless another in the tier is clearly faster
+        primary = candidates[0]
+        p50 = {m: self._model_stats(m).percentile(kind, 50) for m in candidates}
+        measured = {m: v for m, v in p50.items() if v is not None}
+        if p50[primary] is not None and measured:
+            fastest = min(measured, key=measured.get)
+            if p50[primary] > measured[fastest] * LLM_ROUTER_SWITCH_RATIO:
+                primary = fastest
+
+        fallbacks = [m for m in in_tier + others if m != primary]
+        plan = Plan(route=route, kind=kind, primary=primary, fallbacks=fallbacks)
+        # Hedge within the tier; a lighter tier only where the route allows downgrades
+        hedgeable = fallbacks if route in LLM_LIGHT_ROUTES else [m for m in in_tier if m != primary]
+        if self.policies[route].hedge and hedgeable and llm_scheduler.has_headroom(priority):
+            plan.hedge = self._fastest(kind, [m for m in hedgeable if self._available(m)] or hedgeable)
+            delay = self._model_stats(primary).percentile(kind, LLM_HEDGE_PERCENTILE)
+            plan.hedge_delay = max(LLM_HEDGE_MIN_DELAY, delay if delay is not None else LLM_HEDGE_DEFAULT_DELAY)
+        return plan
+
+    def _fastest(self, kind: str, models: List[str]) -> str:
+        # Measured models by p50; until there are samples, a lighter tier is assumed faster
+        measured = {m: self._model_stats(m).percentile(kind, 50) for m in models}
+        tier_rank = {m: TIERS.index(self.models.get(m, TIERS[-1])) for m in models}
+        return min(models, key=lambda m: (measured[m] is None, measured[m] or 0.0, tier_rank[m]))
+
+    # ─── Outcomes ────────────────────────────────────────────────────────
+    async def _attempt(self, model: str, kind: str, call: Callable[[str], Awaitable[T]]) -> T:
+        stats = self._model_stats(model)
+        stats.counts["calls"] += 1
+        start = time.monotonic()
+        try:
+            result = await call(model)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._event(model, "errors")
+            stats.consecutive_errors += 1
+            if stats.consecutive_errors >= _MAX_CONSECUTIVE_ERRORS:
+                stats.cooldown_until = time.monotonic() + LLM_MODEL_COOLDOWN
+                logger.warning("Model %s failed %d times in a row; skipping it for %.0fs",
+                               model, stats.consecutive_errors, LLM_MODEL_COOLDOWN)
+            raise
+        stats.consecutive_errors = 0
+        stats.latency[kind].append(time.monotonic() - start)
+        return result
+
+    async def _race(
+        self, plan: Plan, call: Callable[[str], Awaitable[T]], discard: Optional[Callable[[T], Awaitable]] = None
+    ) -> Tuple[str, T]:
+        """Run the primary, hedge after ``plan.hedge_delay``; returns the first success and cancels the rest."""
+        tasks = {asyncio.create_task(self._attempt(plan.primary, plan.kind, call)): plan.primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=plan.hedge_delay)
+            if not done and plan.hedge is not None:
+                tasks[asyncio.create_task(self._attempt(plan.hedge, plan.kind, call))] = plan.hedge
+                self._event(plan.hedge, "hedges")
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((t for t in done if t.exception() is None), None)
+                if winner is None:
+                    continue  # that one failed; the other may still answer
+                model = tasks[winner]
+                if len(tasks) > 1:
+                    self._event(model, "wins")
+                    for loser in set(tasks) - {winner}:
+                        self._event(tasks[loser], "losses")
+                    if model == plan.hedge:
+                        self._event(model, "hedge_wins")
+                for other in done - {winner}:
+                    if discard is not None and other.exception() is None:
+                        await discard(other.result())
+                return model, winner.result()
+            # Everything failed: report the primary's error so the caller can fall back
+            primary = next(iter(tasks))
+            raise primary.exception()
+        finally:
+            losers = [t for t in tasks if not t.done()]
+            for t in losers:
+                t.cancel()
+            await asyncio.gather(*losers, return_exceptions=True)
+
+    async def _with_fallback(
+        self, plan: Plan, call: Callable[[str], Awaitable[T]], discard: Optional[Callable[[T], Awaitable]] = None
+    ) -> T:
+        try:
+            return (await self._race(plan, call, discard))[1]
+        except Exception as e:
+            error = e
+        for model in plan.fallbacks:
+            if not _retryable(error):
+                break
+            logger.warning("Route %s: falling back to %s after %s", plan.route, model, type(error).__name__)
+            self._event(model, "fallbacks")
+            try:
+                return await self._attempt(model, plan.kind, call)
+            except Exception as e:
+                error = e
+        raise error
+
+    async def complete(self, plan: Plan, call: Callable[[str], Awaitable[T]]) -> T:
+        """Run ``call(model)`` under the plan: hedged first attempt, then fallbacks on retryable errors."""
+        return await self._with_fallback(plan, call)
+
+    async def stream(self, plan: Plan, open_stream: Callable[[str], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """Stream from the plan's model; hedging and fallback apply until the first delta arrives."""
+
+        async def first_delta(model: str) -> Tuple[AsyncIterator[str], Optional[str]]:
+            stream = open_stream(model)
+            try:
+                return stream, await stream.__anext__()
+            except StopAsyncIteration:
+                return stream, None
+            except BaseException:
+                await stream.aclose()
+                raise
+
+        async def close(opened: Tuple[AsyncIterator[str], Optional[str]]) -> None:
+            await opened[0].aclose()
+
+        stream, first = await self._with_fallback(plan, first_delta, discard=close)
+        try:
+            if first is not None:
+                yield first
+                async for delta in stream:
+                    yield delta
+        finally:
+            await stream.aclose()
+
+    def stats(self) -> dict:
+        with self._lock:
+            models = dict(self._stats)
+        return {
+            "routes": {r: p.__dict__ for r, p in self.policies.items()},
+            "models": {m: {"tier": self.models.get(m), **s.snapshot()} for m, s in models.items()},
+        }
+
+
+model_router = ModelRouter()
@@ -0,0 +1,299 @@
+"""Admission control for model calls: an adaptive concurrency limit, priorities and per-user fairness.
+
+Every completion and stream takes a slot from ``llm_scheduler`` for as long
+as it runs. The number of slots adapts AIMD-style: it grows by about one per
+window of successful calls while the slots are actually in use, halves when
+the provider answers 429 (or 503, overloaded), and shrinks by a tenth when
+recent chat latency drifts well above its long-run average. Latency is
+averaged per priority: background calls are long summaries whose duration
+says little about provider load, so only the interactive signal backs off.
+A burst of failures from the same overload only counts once per cooldown.
+
+Calls come in two classes. ``INTERACTIVE`` (chat turns) is always admitted
+first; ``BACKGROUND`` (summaries, profile regeneration, backfills) may never
+hold more than ``LLM_BACKGROUND_SHARE`` of the slots, so chat keeps headroom
+even while a backfill saturates the rest. Within a class, waiting calls are
+queued per user and admitted round-robin, so one user with many calls in
+flight delays only themselves.
+
+The limit is per process; with several workers each adapts on its own to the
+same 429s, which converges just the same.
+
+    LLM_SCHEDULER_ENABLED           false admits every call immediately
+    LLM_CONCURRENCY_INITIAL         slots at start-up
+    LLM_CONCURRENCY_MIN / _MAX      bounds of the adaptive limit
+    LLM_BACKGROUND_SHARE            fraction of the slots background calls may hold
+    LLM_LATENCY_TOLERANCE           recent/long-run latency ratio that counts as overload
+    LLM_QUEUE_TIMEOUT_INTERACTIVE   seconds a chat call may wait for a slot
+    LLM_QUEUE_TIMEOUT_BACKGROUND    seconds a background call may wait for a slot
+"""
+import asyncio
+import enum
+import logging
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Optional
+
+from .telemetry import llm_concurrency, llm_queue_depth, llm_queue_wait, llm_scheduler_events
+
+logger = logging.getLogger(__name__)
+
+LLM_SCHEDULER_ENABLED = os.getenv("LLM_SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CONCURRENCY_INITIAL = float(os.getenv("LLM_CONCURRENCY_INITIAL", "16"))
+LLM_CONCURRENCY_MIN = float(os.getenv("LLM_CONCURRENCY_MIN", "2"))
+LLM_CONCURRENCY_MAX = float(os.getenv("LLM_CONCURRENCY_MAX", os.getenv("OPENAI_POOL_SIZE", "100")))
+LLM_BACKGROUND_SHARE = float(os.getenv("LLM_BACKGROUND_SHARE", "0.5"))
+LLM_LATENCY_TOLERANCE = float(os.getenv("LLM_LATENCY_TOLERANCE", "2.0"))
+LLM_QUEUE_TIMEOUT_INTERACTIVE = float(os.getenv("LLM_QUEUE_TIMEOUT_INTERACTIVE", "30"))
+LLM_QUEUE_TIMEOUT_BACKGROUND = float(os.getenv("LLM_QUEUE_TIMEOUT_BACKGROUND", "300"))
+# Retry-After, in seconds, on the 503 a chat turn gets when it times out in the queue
+LLM_BUSY_RETRY_AFTER = 5
+
+# Status codes that mean "slow down" rather than "this request is wrong"
+OVERLOAD_STATUSES = (429, 503, 529)
+# Weights of the recent and long-run latency averages
+_FAST_EWMA = 0.3
+_SLOW_EWMA = 0.02
+# Samples before the latency signal is trusted
+_LATENCY_WARMUP = 20
+
+
+class Priority(enum.IntEnum):
+    """Lower values are admitted first."""
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+class LLMBusyError(Exception):
+    """Raised when a call waited longer than its class allows for a slot."""
+
+
+class Lease:
+    """A held slot. Streams call ``first_token()`` so latency means time to first token."""
+
+    def __init__(self, priority: Priority, waited: float):
+        self.priority = priority
+        self.waited = waited
+        self.started = time.monotonic()
+        self.latency: Optional[float] = None
+
+    def first_token(self) -> None:
+        if self.latency is None:
+            self.latency = time.monotonic() - self.started
+
+
+def _is_overload(error: BaseException) -> bool:
+    # openai's APIStatusError carries the HTTP status; checked by attribute so
+    # this module does not import the SDK
+    return getattr(error, "status_code", None) in OVERLOAD_STATUSES
+
+
+class LLMScheduler:
+    def __init__(
+        self,
+        initial: float = LLM_CONCURRENCY_INITIAL,
+        minimum: float = LLM_CONCURRENCY_MIN,
+        maximum: float = LLM_CONCURRENCY_MAX,
+        background_share: float = LLM_BACKGROUND_SHARE,
+        latency_tolerance: float = LLM_LATENCY_TOLERANCE,
+        enabled: bool = LLM_SCHEDULER_ENABLED,
+    ):
+        self.enabled = enabled
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = min(max(initial, minimum), maximum)
+        self.background_share = background_share
+        self.latency_tolerance = latency_tolerance
+        self.timeouts = {
+            Priority.INTERACTIVE: LLM_QUEUE_TIMEOUT_INTERACTIVE,
+            Priority.BACKGROUND: LLM_QUEUE_TIMEOUT_BACKGROUND,
+        }
+        self.in_flight: Dict[Priority, int] = {p: 0 for p in Priority}
+        # priority -> user -> waiting futures, and the users in round-robin order
+        self._queues: Dict[Priority, Dict[str, Deque[asyncio.Future]]] = {p: {} for p in Priority}
+        self._turns: Dict[Priority, Deque[str]] = {p: deque() for p in Priority}
+        self._queued: Dict[Priority, int] = {p: 0 for p in Priority}
+        # Recent and long-run latency averages, kept apart per priority
+        self._latency_fast: Dict[Priority, float] = {p: 0.0 for p in Priority}
+        self._latency_slow: Dict[Priority, float] = {p: 0.0 for p in Priority}
+        self._latency_samples: Dict[Priority, int] = {p: 0 for p in Priority}
+        self._last_decrease = 0.0
+        self.counts = {"admitted": 0, "waited": 0, "timed_out": 0, "rate_limited": 0, "latency_backoffs": 0}
+        llm_concurrency.set(self.slots, kind="limit")
+
+    # ─── Admission ───────────────────────────────────────────────────────
+    @property
+    def slots(self) -> int:
+        return int(self.limit)
+
+    def _admissible(self, priority: Priority) -> bool:
+        if sum(self.in_flight.values()) >= self.slots:
+            return False
+        if priority is Priority.BACKGROUND:
+            return self.in_flight[priority] < max(1, int(self.slots * self.background_share))
+        return True
+
+    def has_headroom(self, priority: Priority) -> bool:
+        """Whether a call of ``priority`` would be admitted right now without queueing."""
+        return not self.enabled or (not any(self._queued.values()) and self._admissible(priority))
+
+    def _take(self, priority: Priority) -> None:
+        self.in_flight[priority] += 1
+        self.counts["admitted"] += 1
+        llm_concurrency.set(sum(self.in_flight.values()), kind="in_flight")
+
+    def _enqueue(self, priority: Priority, user: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues[priority].get(user)
+        if queue is None:
+            queue = self._queues[priority][user] = deque()
+            self._turns[priority].append(user)
+        queue.append(future)
+        self._queued[priority] += 1
+        self.counts["waited"] += 1
+        llm_queue_depth.set(self._queued[priority], priority=priority.name.lower())
+        return future
+
+    def _next(self, priority: Priority) -> Optional[asyncio.Future]:
+        """The first waiter of the user whose turn it is; that user goes to the back of the line."""
+        turns = self._turns[priority]
+        while turns:
+            user = turns.popleft()
+            queue = self._queues[priority][user]
+            future = queue.popleft()
+            if queue:
+                turns.append(user)
+            else:
+                del self._queues[priority][user]
+            self._queued[priority] -= 1
+            llm_queue_depth.set(self._queued[priority], priority=priority.name.lower())
+            if not future.done():
+                return future
+        return None
+
+    def _discard(self, priority: Priority, user: str, future: asyncio.Future) -> None:
+        queue = self._queues[priority].get(user)
+        if queue is None or future not in queue:
+            return
+        queue.remove(future)
+        if not queue:
+            del self._queues[priority][user]
+            self._turns[priority].remove(user)
+        self._queued[priority] -= 1
+        llm_queue_depth.set(self._queued[priority], priority=priority.name.lower())
+
+    def _dispatch(self) -> None:
+        for priority in Priority:
+            while self._queued[priority] and self._admissible(priority):
+                future = self._next(priority)
+                if future is None:
+                    break
+                self._take(priority)
+                future.set_result(None)
+
+    async def acquire(self, priority: Priority, user: Optional[str]) -> float:
+        """Wait for a slot; returns the seconds spent queued."""
+        waiting_ahead = any(self._queued[p] for p in Priority if p <= priority)
+        if not waiting_ahead and self._admissible(priority):
+            self._take(priority)
+            llm_queue_wait.observe(0.0, priority=priority.name.lower())
+            return 0.0
+
+        start = time.monotonic()
+        user = user or ""
+        future = self._enqueue(priority, user)
+        try:
+            await asyncio.wait_for(future, self.timeouts[priority])
+        except asyncio.TimeoutError:
+            self._discard(priority, user, future)
+            self.counts["timed_out"] += 1
+            llm_scheduler_events.inc(event="timed_out", priority=priority.name.lower())
+            raise LLMBusyError(
+                f"No model capacity within {self.timeouts[priority]:g}s ({self._queued[priority]} calls waiting)"
+            )
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release(priority)  # admitted just as the caller gave up
+            else:
+                self._discard(priority, user, future)
+            raise
+        waited = time.monotonic() - start
+        llm_queue_wait.observe(waited, priority=priority.name.lower())
+        return waited
+
+    def _release(self, priority: Priority) -> None:
+        self.in_flight[priority] -= 1
+        llm_concurrency.set(sum(self.in_flight.values()), kind="in_flight")
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority = Priority.INTERACTIVE, user: Optional[str] = None) -> AsyncIterator[Lease]:
+        """Hold a slot for the duration of one model call and feed its outcome back into the limit."""
+        if not self.enabled:
+            yield Lease(priority, 0.0)
+            return
+        waited = await self.acquire(priority, user)
+        lease = Lease(priority, waited)
+        busy = sum(self.in_flight.values()) >= self.slots
+        try:
+            yield lease
+        except BaseException as e:
+            if _is_overload(e):
+                self._decrease(0.5, "rate_limited")
+            raise
+        else:
+            latency = lease.latency if lease.latency is not None else time.monotonic() - lease.started
+            self._on_success(priority, latency, busy)
+        finally:
+            self._release(priority)
+
+    # ─── Adapting the limit ──────────────────────────────────────────────
+    def _on_success(self, priority: Priority, latency: float, busy: bool) -> None:
+        self._latency_samples[priority] += 1
+        if self._latency_samples[priority] == 1:
+            self._latency_fast[priority] = self._latency_slow[priority] = latency
+        else:
+            self._latency_fast[priority] += _FAST_EWMA * (latency - self._latency_fast[priority])
+            self._latency_slow[priority] += _SLOW_EWMA * (latency - self._latency_slow[priority])
+        if (
+            priority is Priority.INTERACTIVE
+            and self._latency_samples[priority] > _LATENCY_WARMUP
+            and self._latency_fast[priority] > self._latency_slow[priority] * self.latency_tolerance
+        ):
+            self._decrease(0.9, "latency_backoffs")
+        elif busy:
+            # Only grow while the limit is what holds calls back
+            self._set_limit(self.limit + 1 / self.limit)
+
+    def _decrease(self, factor: float, reason: str) -> None:
+        now = time.monotonic()
+        # One overload episode usually fails every call in flight; count it once
+        if now - self._last_decrease < max(1.0, self._latency_fast[Priority.INTERACTIVE]):
+            return
+        self._last_decrease = now
+        self.counts[reason] += 1
+        llm_scheduler_events.inc(event=reason)
+        self._set_limit(self.limit * factor)
+        logger.warning("LLM concurrency limit lowered to %d (%s)", self.slots, reason.replace("_", " "))
+
+    def _set_limit(self, limit: float) -> None:
+        self.limit = min(max(limit, self.minimum), self.maximum)
+        llm_concurrency.set(self.slots, kind="limit")
+        self._dispatch()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "limit": self.slots,
+            "in_flight": {p.name.lower(): n for p, n in self.in_flight.items()},
+            "queued": {p.name.lower(): n for p, n in self._queued.items()},
+            "users_queued": {p.name.lower(): len(q) for p, q in self._queues.items()},
+            "latency_recent_ms": {p.name.lower(): round(v * 1000, 1) for p, v in self._latency_fast.items()},
+            "latency_baseline_ms": {p.name.lower(): round(v * 1000, 1) for p, v in self._latency_slow.items()},
+            **self.counts,
+        }
+
+
+llm_scheduler = LLMScheduler()
@@ -0,0 +1,226 @@
+"""Logging that stays off the request path.
+
+``configure_logging()`` replaces the root handlers with a ``QueueHandler``:
+a request only drops the unformatted record on a bounded queue, and a
+background ``QueueListener`` thread formats, redacts and writes it. On top
+of that:
+
+    APP_ENV          development (DEBUG) | staging (INFO) | production (INFO, chatty libraries at WARNING)
+    LOG_LEVEL        overrides the environment's root level
+    LOG_LEVELS       per-logger overrides, ``httpx=WARNING,app_refactor.llm=DEBUG``
+    LOG_SAMPLE_RATES share of DEBUG/INFO records kept per route template,
+                     ``/api/chat-sessions/{session_id}/messages=0.1,default=1``;
+                     warnings and errors are always kept
+    LOG_CONTENT      log chat/journal text verbatim (development default) instead of its length
+    LOG_QUEUE_SIZE   records buffered before new ones are dropped (and counted)
+
+Bearer tokens, JWTs and API keys are masked in every formatted line.
+
+Logs are not the only place user text can be kept: with ``LLM_CACHE_PATH``
+set, the LLM response cache stores summary and profile replies, which
+restate what users wrote, in that SQLite file for ``LLM_CACHE_TTL`` (30
+days by default). Rows are keyed by a hash of the prompt; the prompt itself
+is not stored. Without the setting, the default, replies stay in memory.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+from typing import Dict, List, Optional
+from uuid import UUID
+
+from .telemetry import BACKGROUND, current_trace
+
+# Railway deployments default to production so user text never reaches its log drain
+APP_ENV = (os.getenv("APP_ENV") or ("production" if os.getenv("RAILWAY_ENVIRONMENT") else "development")).lower()
+
+_ENV_DEFAULTS = {
+    "development": {"level": "DEBUG", "content": True, "quiet": ()},
+    "staging": {"level": "INFO", "content": False, "quiet": ("hpack", "httpcore")},
+    "production": {"level": "INFO", "content": False, "quiet": ("hpack", "httpcore", "httpx", "openai")},
+}
+_defaults = _ENV_DEFAULTS.get(APP_ENV, _ENV_DEFAULTS["production"])
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", _defaults["level"]).upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+LOG_CONTENT = os.getenv("LOG_CONTENT", str(_defaults["content"])).lower() in ("1", "true", "yes")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+_SECRETS = (
+    (re.compile(r"(?i)\b(bearer)\s+[A-Za-z0-9._~+/=-]+"), r"\1 [REDACTED]"),
+    (re.compile(r"\beyJ[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+\.[A-Za-z0-9_-]*"), "[JWT]"),
+    (re.compile(r"\bsk-[A-Za-z0-9_-]{8,}"), "[API_KEY]"),
+    (re.compile(r"(?i)((?:access|refresh)_token['\"]?\s*[:=]\s*['\"]?)[^'\",\s}]+"), r"\1[REDACTED]"),
+)
+
+
+def redact(text: str) -> str:
+    for pattern, replacement in _SECRETS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+# ─── Lazy, redacted arguments ────────────────────────────────────────────
+class UserText:
+    """Log argument for user text: the text itself only when LOG_CONTENT is on.
+
+    ``logger.info("Received %s", UserText(message))`` costs nothing until the
+    record is formatted on the listener thread, and never if it is filtered.
+    """
+    __slots__ = ("text", "preview")
+
+    def __init__(self, text: Optional[str], preview: int = 30):
+        self.text = text or ""
+        self.preview = preview
+
+    def __str__(self) -> str:
+        if LOG_CONTENT:
+            return repr(self.text[:self.preview] + ("..." if len(self.text) > self.preview else ""))
+        return f"<{len(self.text)} chars>"
+
+
+class MessagesPayload:
+    """Log argument for a chat-completions message list, rendered as JSON on demand."""
+    __slots__ = ("messages",)
+
+    def __init__(self, messages: List[dict]):
+        self.messages = list(messages)  # the caller may go on appending to its list
+
+    def __str__(self) -> str:
+        if LOG_CONTENT:
+            return json.dumps(self.messages, indent=2)
+        return json.dumps([{"role": m.get("role"), "chars": len(m.get("content") or "")} for m in self.messages])
+
+
+# ─── Pipeline ────────────────────────────────────────────────────────────
+def _parse_rates(spec: str) -> Dict[str, float]:
+    rates = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        route, rate = part.rsplit("=", 1)
+        rates[route.strip()] = float(rate)
+    return rates
+
+
+class RouteSampler(logging.Filter):
+    """Keeps a per-route share of DEBUG/INFO records; WARNING and above always pass."""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self.default = rates.get("default", 1.0)
+        self.rng = random.Random()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        trace = current_trace()
+        rate = self.rates.get(trace.route if trace else BACKGROUND, self.default)
+        return rate >= 1 or self.rng.random() < rate
+
+
+# Arguments that cannot change between the call and the listener formatting them
+_LAZY_ARGS = (str, bytes, int, float, bool, type(None), UUID, BaseException, UserText, MessagesPayload)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Enqueues records, leaving formatting to the listener where that is safe.
+
+    The stock handler formats in the caller's thread; here ``msg % args`` and
+    the ``UserText``/``MessagesPayload`` wrappers are only evaluated on the
+    listener as long as every argument is immutable. A record with a dict,
+    list or other object among its arguments is formatted on the spot, so it
+    logs the state at the call rather than whatever the request did next.
+    A full queue drops the record instead of stalling the request.
+    """
+
+    def __init__(self, q: queue.Queue):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        args = record.args
+        if not isinstance(record.msg, str) or (
+            args and (not isinstance(args, tuple) or not all(isinstance(a, _LAZY_ARGS) for a in args))
+        ):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # Block rather than fail when stopping with a full queue; the thread is draining it
+        self.queue.put(self._sentinel)
+
+
+class RedactingFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return redact(super().format(record))
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[NonBlockingQueueHandler] = None
+
+
+def configure_logging(stream=None) -> None:
+    """Install the queue-backed pipeline on the root logger; safe to call twice."""
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(stream)
+    output.setFormatter(RedactingFormatter(LOG_FORMAT))
+
+    _queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    _queue_handler.addFilter(RouteSampler(_parse_rates(LOG_SAMPLE_RATES)))
+
+    if APP_ENV != "development":
+        # LOG_FORMAT uses none of these; skipping them saves a stack walk per record
+        logging._srcfile = None
+        logging.logThreads = False
+        logging.logProcesses = False
+        logging.logMultiprocessing = False
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(LOG_LEVEL)
+    for name in _defaults["quiet"]:
+        logging.getLogger(name).setLevel(logging.WARNING)
+    for part in filter(None, (p.strip() for p in LOG_LEVELS.split(","))):
+        name, level = part.split("=", 1)
+        logging.getLogger(name.strip()).setLevel(level.strip().upper())
+
+    _listener = _Listener(_queue_handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def logging_stats() -> dict:
+    q = _queue_handler.queue if _queue_handler else None
+    return {
+        "env": APP_ENV,
+        "level": LOG_LEVEL,
+        "queued": q.qsize() if q else 0,
+        "dropped": _queue_handler.dropped if _queue_handler else 0,
+    }
@@ -1,24 +1,67 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 
-from .db import supabase
 from .dependencies import get_current_user
+from .idempotency import IdempotencyMiddleware
+from .lifespan import lifespan
+from .llm_scheduler import LLM_BUSY_RETRY_AFTER, LLMBusyError
+from .logging_config import configure_logging
 from .routers import auth, journals, chats, profiles
+from .services.chat_service import SessionAccessError
+from .telemetry import TelemetryMiddleware, TimedJSONResponse, metrics_response
 
-app = FastAPI()
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"], allow_credentials=True,
-    allow_methods=["*"], allow_headers=["*"],
-)
+async def idempotency_owner(authorization: str):
+    if not authorization:
+        return None
+    try:
+        return (await get_current_user(authorization)).id
+    except HTTPException:
+        return None
 
-# mount routers
-app.include_router(auth.router,   prefix="/api")
-app.include_router(journals.router, prefix="/api")
-app.include_router(chats.router,  prefix="/api")
-app.include_router(profiles.router, prefix="/api")
 
-@app.get("/")
 async def health_check():
     return {"message": "API is running!"}
+
+
+def metrics():
+    return metrics_response()
+
+
+async def model_busy(request: Request, exc: LLMBusyError):
+    return JSONResponse(
+        {"detail": str(exc)}, status_code=503, headers={"Retry-After": str(LLM_BUSY_RETRY_AFTER)}
+    )
+
+
+async def session_access_denied(request: Request, exc: SessionAccessError):
+    return JSONResponse({"detail": str(exc)}, status_code=403)
+
+
+def create_app() -> FastAPI:
+    configure_logging()
+    app = FastAPI(default_response_class=TimedJSONResponse, lifespan=lifespan)
+    app.add_exception_handler(LLMBusyError, model_busy)
+    app.add_exception_handler(SessionAccessError, session_access_denied)
+
+    app.add_middleware(IdempotencyMiddleware, owner=idempotency_owner)  # inside CORS so replays carry its headers
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"], allow_credentials=True,
+        allow_methods=["*"], allow_headers=["*"],
+    )
+    app.add_middleware(TelemetryMiddleware)
+
+    # mount routers
+    app.include_router(auth.router,   prefix="/api")
+    app.include_router(journals.router, prefix="/api")
+    app.include_router(chats.router,  prefix="/api")
+    app.include_router(profiles.router, prefix="/api")
+
+    app.add_api_route("/", health_check, methods=["GET"])
+    app.add_api_route("/metrics", metrics, methods=["GET"], include_in_schema=False)
+    return app
+
+
+app = create_app()
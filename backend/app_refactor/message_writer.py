@@ -0,0 +1,417 @@
+"""Write-behind persistence for ChatMessages.
+
+A chat turn no longer waits on its ``ChatMessages`` inserts. ``enqueue()``
+builds the complete row (chat_id, created_at) itself, appends it to a
+local SQLite outbox (fsynced, so an acknowledged message survives a crash)
+and returns it. A background task drains the outbox in FIFO order with
+multi-row inserts across users and sessions, every
+``WRITE_BEHIND_INTERVAL`` seconds or sooner once ``WRITE_BEHIND_BATCH``
+rows are waiting. On start-up whatever is still in the outbox is replayed.
+
+Ordering per session holds because created_at is assigned monotonically
+per session at enqueue time and batches are flushed strictly in outbox
+order; a failed batch is retried before anything behind it. Inserts skip
+existing chat_ids, so replaying a batch that landed just before a crash is
+harmless. Readers that need a session's latest messages call
+``wait_for_session()`` first, which only waits while that session has
+unflushed rows in the outbox, whichever worker enqueued them.
+
+Worker processes of one server share the outbox file. Each row records the
+process that enqueued it, as its pid plus the boot and process start time
+(so a pid reused after a restart is not mistaken for the old owner), and
+every worker flushes only its own rows; on start,
+and every ``WRITE_BEHIND_ADOPT_INTERVAL`` seconds after, a worker adopts
+the rows of owners that are no longer running, so a crashed worker's
+messages are replayed without waiting for a restart.
+
+    WRITE_BEHIND_ENABLED         false writes each message inline, as before
+    WRITE_BEHIND_PATH            outbox file
+    WRITE_BEHIND_INTERVAL        seconds between flushes
+    WRITE_BEHIND_BATCH           rows per multi-row insert
+    WRITE_BEHIND_MAX_ATTEMPTS    failed tries before a batch is split row by row
+                                 and rows that still fail are parked as dead letters
+    WRITE_BEHIND_ADOPT_INTERVAL  seconds between checks for rows of crashed workers
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .repository import repository
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "true").lower() in ("1", "true", "yes")
+WRITE_BEHIND_PATH = os.getenv("WRITE_BEHIND_PATH", ".chat_outbox.sqlite3")
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "0.2"))
+WRITE_BEHIND_BATCH = int(os.getenv("WRITE_BEHIND_BATCH", "200"))
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", "5"))
+# How long a reader waits for its session to flush before reading what is there
+WRITE_BEHIND_READ_TIMEOUT = float(os.getenv("WRITE_BEHIND_READ_TIMEOUT", "5"))
+WRITE_BEHIND_ADOPT_INTERVAL = float(os.getenv("WRITE_BEHIND_ADOPT_INTERVAL", "2"))
+
+
+def _start_token(pid: int) -> str:
+    """Boot id and start time of ``pid``; empty where /proc is not available."""
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as f:
+            boot_id = f.read().strip()
+        with open(f"/proc/{pid}/stat") as f:
+            # Field 22, counted after the parenthesised command name
+            start_time = f.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        return ""
+    return f"{boot_id}/{start_time}"
+
+
+_owner_cache: Tuple[int, str] = (0, "")
+
+
+def _owner() -> str:
+    """This process as an outbox owner, ``pid:start-token``; recomputed after a fork."""
+    global _owner_cache
+    pid = os.getpid()
+    if _owner_cache[0] != pid:
+        _owner_cache = (pid, f"{pid}:{_start_token(pid)}")
+    return _owner_cache[1]
+
+
+def _alive(owner) -> bool:
+    if owner is None:
+        return False
+    # Outboxes written before owners had start tokens hold bare pids
+    pid_text, _, token = str(owner).partition(":")
+    pid = int(pid_text)
+    if pid == os.getpid():
+        return str(owner) == _owner()
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # exists, owned by another user
+    return not token or token == _start_token(pid)
+
+
+class _Outbox:
+    """Durable FIFO of pending rows: one SQLite table, fully synced on every append."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                " seq INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, row TEXT NOT NULL,"
+                " owner TEXT)"
+            )
+            if "owner" not in [c[1] for c in conn.execute("PRAGMA table_info(outbox)")]:
+                # Outbox written before rows had owners; NULL rows are adopted on start
+                conn.execute("ALTER TABLE outbox ADD COLUMN owner TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS outbox_session ON outbox (session_id)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS dead_letters ("
+                " seq INTEGER PRIMARY KEY, session_id TEXT NOT NULL, row TEXT NOT NULL,"
+                " error TEXT, failed_at TEXT NOT NULL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def append(self, session_id: str, row: dict) -> None:
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT INTO outbox (session_id, row, owner) VALUES (?, ?, ?)",
+                (session_id, json.dumps(row), _owner()),
+            )
+            db.commit()
+
+    def adopt_orphans(self) -> Dict[str, int]:
+        """Take over the rows of processes that are no longer running; returns the rows adopted per session."""
+        with self._lock:
+            db = self._db()
+            owners = [o for (o,) in db.execute("SELECT DISTINCT owner FROM outbox")]
+            orphaned = [o for o in owners if o != _owner() and not _alive(o)]
+            if not orphaned:
+                return {}
+            adopted: Dict[str, int] = defaultdict(int)
+            for owner in orphaned:
+                for session_id, count in db.execute(
+                    "SELECT session_id, COUNT(*) FROM outbox WHERE owner IS ? GROUP BY session_id", (owner,)
+                ):
+                    adopted[session_id] += count
+            db.executemany("UPDATE outbox SET owner = ? WHERE owner IS ?", [(_owner(), o) for o in orphaned])
+            db.commit()
+        return dict(adopted)
+
+    def has_session(self, session_id: str) -> bool:
+        """Whether any worker still has unflushed rows of ``session_id``."""
+        with self._lock:
+            return self._db().execute(
+                "SELECT 1 FROM outbox WHERE session_id = ? LIMIT 1", (session_id,)
+            ).fetchone() is not None
+
+    def peek(self, limit: int) -> List[Tuple[int, str, dict]]:
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT seq, session_id, row FROM outbox WHERE owner = ? ORDER BY seq LIMIT ?",
+                (_owner(), limit),
+            ).fetchall()
+        return [(seq, session_id, json.loads(row)) for seq, session_id, row in rows]
+
+    def remove(self, seqs: List[int]) -> None:
+        with self._lock:
+            db = self._db()
+            db.executemany("DELETE FROM outbox WHERE seq = ?", [(s,) for s in seqs])
+            db.commit()
+
+    def park(self, seq: int, error: str) -> None:
+        """Move one row to dead_letters so it stops blocking the queue."""
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO dead_letters (seq, session_id, row, error, failed_at)"
+                " SELECT seq, session_id, row, ?, ? FROM outbox WHERE seq = ?",
+                (error, datetime.now(timezone.utc).isoformat(), seq),
+            )
+            db.execute("DELETE FROM outbox WHERE seq = ?", (seq,))
+            db.commit()
+
+    def pending_by_session(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT session_id, COUNT(*) FROM outbox WHERE owner = ? GROUP BY session_id", (_owner(),)
+            ).fetchall()
+        return dict(rows)
+
+    def dead_letter_count(self) -> int:
+        with self._lock:
+            return self._db().execute("SELECT COUNT(*) FROM dead_letters").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class ChatMessageWriter:
+    def __init__(
+        self,
+        path: str = WRITE_BEHIND_PATH,
+        interval: float = WRITE_BEHIND_INTERVAL,
+        batch_size: int = WRITE_BEHIND_BATCH,
+        max_attempts: int = WRITE_BEHIND_MAX_ATTEMPTS,
+        enabled: bool = WRITE_BEHIND_ENABLED,
+    ):
+        self.enabled = enabled
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.outbox = _Outbox(path)
+        self._pending: Dict[str, int] = defaultdict(int)
+        self._last_created: Dict[str, datetime] = {}
+        self._wake: Optional[asyncio.Event] = None
+        self._progress: Optional[asyncio.Condition] = None
+        self._task: Optional[asyncio.Task] = None
+        self._started: Optional[asyncio.Future] = None
+        self._closing = False
+        self._adopted_at = 0.0
+        self.counts = {
+            "enqueued": 0, "flushed": 0, "batches": 0, "failures": 0, "dead_letters": 0, "replayed": 0, "adopted": 0,
+        }
+
+    # ─── Writing ─────────────────────────────────────────────────────────
+    def _created_at(self, session_id: str) -> str:
+        """Now, nudged forward if needed so each session's rows sort in enqueue order."""
+        now = datetime.now(timezone.utc)
+        last = self._last_created.get(session_id)
+        if last is not None and now <= last:
+            now = last + timedelta(microseconds=1)
+        self._last_created[session_id] = now
+        return now.isoformat(timespec="microseconds")
+
+    async def enqueue(self, session_id: str, user_id: str, role: str, content: str) -> dict:
+        """Persist one message durably and return its row; the database insert happens later."""
+        if not self.enabled:
+            return await repository.insert_chat_message(session_id, user_id, role, content)
+        await self.start()
+        row = {
+            "chat_id": str(uuid.uuid4()),
+            "session_id": session_id,
+            "user_id": user_id,
+            "role": role,
+            "content": content,
+            "created_at": self._created_at(session_id),
+        }
+        await asyncio.to_thread(self.outbox.append, session_id, row)
+        self._pending[session_id] += 1
+        self.counts["enqueued"] += 1
+        if sum(self._pending.values()) >= self.batch_size:
+            self._wake.set()
+        return row
+
+    async def wait_for_session(self, session_id: str) -> None:
+        """Return once every row enqueued for ``session_id``, by any worker, has reached the database."""
+        if not self.enabled:
+            return
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + WRITE_BEHIND_READ_TIMEOUT
+        while True:
+            remaining = deadline - loop.time()
+            if self._pending.get(session_id) and self._progress is not None:
+                # Our own rows: hurry our flusher and wait for it
+                self._wake.set()
+                try:
+                    async with self._progress:
+                        await asyncio.wait_for(
+                            self._progress.wait_for(lambda: not self._pending.get(session_id)), max(0.0, remaining)
+                        )
+                except asyncio.TimeoutError:
+                    break
+            elif not await asyncio.to_thread(self.outbox.has_session, session_id):
+                return
+            elif remaining <= 0:
+                break
+            else:
+                # Another worker's rows; its flusher drains them within an interval
+                await asyncio.sleep(min(self.interval, remaining))
+        logger.warning("Session %s still has unflushed messages; reading without them", session_id)
+
+    # ─── Flushing ────────────────────────────────────────────────────────
+    async def start(self) -> None:
+        """Start the flusher (idempotent) and pick up rows left by a previous process."""
+        if self._started is None:
+            self._started = asyncio.ensure_future(self._start())
+        # Concurrent callers share one start-up; each waits until the leftovers are counted
+        await asyncio.shield(self._started)
+
+    async def _start(self) -> None:
+        self._wake = asyncio.Event()
+        self._progress = asyncio.Condition()
+        # Count the leftovers before the flusher runs, or it drains rows not yet counted
+        try:
+            await asyncio.to_thread(self.outbox.adopt_orphans)
+            leftover = await asyncio.to_thread(self.outbox.pending_by_session)
+        except BaseException:
+            self._started = None  # let the next call try again
+            raise
+        self._adopted_at = asyncio.get_running_loop().time()
+        for session_id, count in leftover.items():
+            self._pending[session_id] += count
+        if leftover:
+            self.counts["replayed"] = sum(leftover.values())
+            logger.info("Replaying %d buffered chat messages from %s", self.counts["replayed"], self.outbox.path)
+            self._wake.set()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        failures = 0
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self._backoff(failures))
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self._adopt_orphans()
+                while await self._flush_batch(isolate=failures >= self.max_attempts):
+                    failures = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures += 1
+                self.counts["failures"] += 1
+                logger.warning("Chat message flush failed (attempt %d): %s", failures, e)
+            if self._closing and (failures or not sum(self._pending.values())):
+                return
+
+    async def _adopt_orphans(self) -> None:
+        """Pick up, now and then, the rows of workers that died since start-up."""
+        now = asyncio.get_running_loop().time()
+        if now - self._adopted_at < WRITE_BEHIND_ADOPT_INTERVAL:
+            return
+        self._adopted_at = now
+        adopted = await asyncio.to_thread(self.outbox.adopt_orphans)
+        for session_id, count in adopted.items():
+            self._pending[session_id] += count
+        if adopted:
+            self.counts["adopted"] += sum(adopted.values())
+            logger.info("Adopted %d chat messages left by a stopped worker", sum(adopted.values()))
+
+    def _backoff(self, failures: int) -> float:
+        return min(30.0, self.interval * (2 ** failures)) if failures else self.interval
+
+    async def _flush_batch(self, isolate: bool = False) -> bool:
+        """Insert the oldest batch; returns whether there was anything to flush."""
+        batch = await asyncio.to_thread(self.outbox.peek, self.batch_size)
+        if not batch:
+            return False
+        if isolate:
+            # A batch kept failing: insert row by row and park the rows that still fail
+            for seq, session_id, row in batch:
+                try:
+                    await repository.insert_chat_messages([row])
+                except Exception as e:
+                    logger.error("Parking chat message %s of session %s: %s", row["chat_id"], session_id, e)
+                    await asyncio.to_thread(self.outbox.park, seq, str(e))
+                    self.counts["dead_letters"] += 1
+                else:
+                    await asyncio.to_thread(self.outbox.remove, [seq])
+                    self.counts["flushed"] += 1
+                await self._settle([session_id])
+            return True
+
+        await repository.insert_chat_messages([row for _, _, row in batch])
+        await asyncio.to_thread(self.outbox.remove, [seq for seq, _, _ in batch])
+        self.counts["flushed"] += len(batch)
+        self.counts["batches"] += 1
+        await self._settle([session_id for _, session_id, _ in batch])
+        return True
+
+    async def _settle(self, session_ids: List[str]) -> None:
+        for session_id in session_ids:
+            self._pending[session_id] -= 1
+            if self._pending[session_id] <= 0:
+                self._pending.pop(session_id, None)
+                self._last_created.pop(session_id, None)
+        async with self._progress:
+            self._progress.notify_all()
+
+    async def close(self) -> None:
+        """Flush what is buffered (rows that cannot be flushed stay in the outbox) and stop."""
+        if self._task is not None:
+            self._closing = True
+            self._wake.set()
+            try:
+                await asyncio.wait_for(self._task, WRITE_BEHIND_READ_TIMEOUT * 2)
+            except asyncio.TimeoutError:
+                self._task.cancel()
+            self._task = None
+        self._started = None
+        await asyncio.to_thread(self.outbox.close)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "pending": sum(self._pending.values()),
+            "sessions_pending": len(self._pending),
+            **self.counts,
+        }
+
+
+message_writer = ChatMessageWriter()
@@ -0,0 +1,100 @@
+import base64
+import json
+import os
+from datetime import datetime
+from uuid import UUID
+from typing import List, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException, Query
+
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "50"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "200"))
+
+
+class Cursor(NamedTuple):
+    """Keyset position: the sort timestamp plus the row id as a tie-breaker."""
+    ts: str
+    id: str
+
+
+def encode_cursor(ts: str, row_id: str) -> str:
+    raw = json.dumps([ts, str(row_id)], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _row_id(value) -> str:
+    # Row ids are UUIDs or integers; anything else is not a cursor we issued
+    if isinstance(value, int) and not isinstance(value, bool):
+        return str(value)
+    value = str(value)
+    if value.isdigit():
+        return str(int(value))
+    return str(UUID(value))
+
+
+def decode_cursor(cursor: str) -> Cursor:
+    """Parse a client-supplied cursor; its values end up in a PostgREST filter, so both are validated."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        ts, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(ts, str):
+            raise TypeError("timestamp must be a string")
+        datetime.fromisoformat(ts)
+        return Cursor(ts, _row_id(row_id))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor.")
+
+
+class PageParams(NamedTuple):
+    limit: int
+    before: Optional[Cursor]
+    after: Optional[Cursor]
+
+
+def page_params(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    before: Optional[str] = Query(None, description="Return rows older than this cursor"),
+    after: Optional[str] = Query(None, description="Return rows newer than this cursor"),
+) -> PageParams:
+    """FastAPI dependency for the ``limit``/``before``/``after`` query parameters."""
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either 'before' or 'after', not both.")
+    return PageParams(
+        limit=limit,
+        before=decode_cursor(before) if before else None,
+        after=decode_cursor(after) if after else None,
+    )
+
+
+def keyset_filter(ts_col: str, id_col: str, cursor: Cursor, op: str) -> str:
+    """PostgREST ``or`` expression for rows strictly past ``cursor``.
+
+    ``op`` is ``lt`` (older) or ``gt`` (newer). Values are double-quoted so
+    timestamps with ``+``/``:`` survive PostgREST's filter grammar.
+    """
+    return (
+        f'{ts_col}.{op}."{cursor.ts}",'
+        f'and({ts_col}.eq."{cursor.ts}",{id_col}.{op}."{cursor.id}")'
+    )
+
+
+def finish_page(
+    rows: List[dict],
+    params: PageParams,
+    ts_col: str,
+    id_col: str,
+    newest_first: bool,
+) -> Tuple[List[dict], Optional[str]]:
+    """Trim the ``limit + 1`` probe row, build ``next_cursor`` and put rows in display order.
+
+    ``rows`` must be in fetch order: ascending when paging ``after`` a cursor,
+    descending otherwise. ``next_cursor`` continues in the same direction.
+    """
+    has_more = len(rows) > params.limit
+    rows = rows[:params.limit]
+    next_cursor = encode_cursor(rows[-1][ts_col], rows[-1][id_col]) if has_more and rows else None
+
+    fetched_newest_first = params.after is None
+    if fetched_newest_first != newest_first:
+        rows = list(reversed(rows))
+    return rows, next_cursor
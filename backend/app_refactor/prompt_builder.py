@@ -0,0 +1,234 @@
+"""Chat prompts laid out for the provider's prompt-prefix cache.
+
+OpenAI reuses the computation for the longest prefix (1024 tokens and up,
+in 128-token steps) it has seen recently, billing those tokens at a
+discount and answering sooner; ``usage.prompt_tokens_details.cached_tokens``
+reports how much was reused (see ``llm_tokens_total{type="cached"}`` and
+``llm_first_token_seconds``). The prefix must match byte for byte, so a
+prompt is laid out from what changes least to what changes most:
+
+1. the persona (``SESSION_SYSTEM_PROMPT`` / ``CHAT_SYSTEM_PROMPT``), the same
+   string in every deployment;
+2. one system message with the user's profile and summaries, rendered as
+   canonical JSON (sorted keys, fixed separators) so that equal data gives
+   equal bytes: profile, journal summaries oldest first, last chat summary;
+3. the conversation history, oldest first;
+4. per-request context sent by the client, then the new user message.
+"""
+import json
+import logging
+import os
+import textwrap
+from typing import Iterable, List, Optional
+
+from pydantic import BaseModel, Field
+
+logger = logging.getLogger(__name__)
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "4000"))
+PROFILE_TOKEN_CAP = int(os.getenv("PROFILE_TOKEN_CAP", "800"))
+SUMMARIES_TOKEN_CAP = int(os.getenv("SUMMARIES_TOKEN_CAP", "1200"))
+# Turns fetched per chat request; the budget decides how many are sent.
+HISTORY_FETCH_LIMIT = int(os.getenv("HISTORY_FETCH_LIMIT", "30"))
+
+# Chat formatting overhead per message, as counted by OpenAI for gpt-4 family models.
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMING_TOKENS = 3
+CHARS_PER_TOKEN = 4
+
+SESSION_SYSTEM_PROMPT = (
+    "I want you to talk to me like a grounded, emotionally intelligent person. Don't sugarcoat things. "
+    "Be honest but warm. If I'm being irrational or idealizing something, gently point it out. I don't want "
+    "therapist-speak or shallow positivity. I want someone who can see through the noise, be real with me, and "
+    "still understand that I'm trying my best to figure life out. You don't need to offer advice unless it feels "
+    "necessary—sometimes I just want to be heard. Respond as if you genuinely care, but you're not here to "
+    "flatter or coddle me."
+)
+CHAT_SYSTEM_PROMPT = textwrap.dedent("""\
+    You are an empathetic therapist named Therapist.
+    You help users process their thoughts and emotions through thoughtful conversation.
+    Use the provided context about the user's journal entries and previous chat
+    to give thoughtful, therapeutic responses. Focus on being supportive while
+    maintaining professional boundaries. Avoid giving medical advice.
+    Keep responses concise (2-3 paragraphs maximum) and focused on the user's immediate concerns.
+    Ask thoughtful follow-up questions to deepen the conversation.""")
+
+_encoding = None
+_encoding_tried = False
+
+
+def _get_encoding():
+    # tiktoken is optional and its BPE ranks take a while to load, so both
+    # happen on first use (or in the startup warm-up), not at import.
+    global _encoding, _encoding_tried
+    if _encoding is None and not _encoding_tried:
+        _encoding_tried = True
+        try:
+            import tiktoken
+        except ImportError:  # optional; fall back to a character estimate
+            return None
+        try:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:  # encoding files unavailable offline
+            logger.warning("tiktoken encoding unavailable, estimating tokens from length: %s", e)
+            return None
+    return _encoding
+
+
+def load_encoding() -> bool:
+    """Load the tokenizer now; returns whether exact counting is available."""
+    return _get_encoding() is not None
+
+
+def count_tokens(text: str) -> int:
+    """Token count of ``text``; exact with tiktoken, otherwise ~4 chars per token."""
+    if not text:
+        return 0
+    enc = _get_encoding()
+    if enc is not None:
+        return len(enc.encode(text))
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def count_message_tokens(messages: Iterable[dict]) -> int:
+    return sum(MESSAGE_OVERHEAD_TOKENS + count_tokens(m["content"]) for m in messages) + REPLY_PRIMING_TOKENS
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut ``text`` to at most ``max_tokens``, marking the cut with an ellipsis."""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    enc = _get_encoding()
+    if enc is not None:
+        return enc.decode(enc.encode(text)[:max_tokens - 1]) + "…"
+    return text[:(max_tokens - 1) * CHARS_PER_TOKEN] + "…"
+
+
+def compact_json(value) -> str:
+    """Canonical JSON: the same data always renders to the same bytes."""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), sort_keys=True, default=str)
+
+
+class BuiltPrompt(BaseModel):
+    """Messages ready for chat.completions, plus what the budget did to them."""
+    messages: List[dict]
+    token_count: int
+    budget: int
+    history_kept: int = 0
+    history_dropped: int = 0
+    truncated: List[str] = Field(default_factory=list)
+    dropped: List[str] = Field(default_factory=list)
+
+
+def build_chat_prompt(
+    system_prompt: str,
+    user_message: str,
+    profile: Optional[dict] = None,
+    journal_summaries: Optional[List[dict]] = None,
+    chat_summary: Optional[str] = None,
+    context: Optional[str] = None,
+    history: Optional[List[dict]] = None,
+    budget: int = PROMPT_TOKEN_BUDGET,
+) -> BuiltPrompt:
+    """
+    Fill ``budget`` tokens by priority: system prompt and the new user message
+    always go in, then the profile, then summaries (``context`` text, last
+    chat summary, journal summaries newest first), then as many of the most
+    recent ``history`` turns as still fit. Lower-priority sections are
+    truncated or dropped first. Unless the turn itself is near the budget,
+    the profile and summaries are cut by their fixed caps, so they render
+    the same whatever the length of the new message.
+
+    Layout, stable to volatile (see the module docstring): system prompt,
+    one system message with profile and summaries, history oldest first,
+    a system message with ``context``, the new user message.
+    """
+    history = history or []
+    truncated: List[str] = []
+    dropped: List[str] = []
+
+    fixed = [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_message}]
+    remaining = budget - count_message_tokens(fixed)
+
+    # One context message holds profile and summaries; pay its overhead once.
+    context_budget = remaining - MESSAGE_OVERHEAD_TOKENS
+
+    def take(label: str, text: str, cap: int) -> Optional[str]:
+        nonlocal context_budget
+        allowed = min(cap, context_budget)
+        piece = truncate_to_tokens(text, allowed)
+        if not piece:
+            dropped.append(label)
+            return None
+        if piece != text:
+            truncated.append(label)
+        context_budget -= count_tokens(piece) + 1  # joining newline
+        return piece
+
+    stable: List[tuple] = []  # (position, piece)
+    if profile:
+        piece = take("profile", f"User profile: {compact_json(profile)}", PROFILE_TOKEN_CAP)
+        if piece:
+            stable.append(((0,), piece))
+
+    # Summaries are chosen by priority (journals newest first, so the cap
+    # drops the oldest) but placed oldest first: a new summary only changes
+    # the tail. Client context changes every request and goes last.
+    summaries_cap = SUMMARIES_TOKEN_CAP
+    summary_sections = []
+    if context:
+        summary_sections.append(("context", None, f"Context from user's journal entries and previous chats: {context}"))
+    if chat_summary:
+        summary_sections.append(("chat_summary", (2,), f"Last chat summary: {chat_summary}"))
+    for s in journal_summaries or []:
+        label = f"journal_summary:{s.get('start_date')}..{s.get('end_date')}"
+        entry = {k: s.get(k) for k in ("start_date", "end_date", "summary_text")}
+        position = (1, str(s.get("start_date")), str(s.get("end_date")))
+        summary_sections.append((label, position, f"Journal summary: {compact_json(entry)}"))
+    volatile: List[dict] = []
+    for label, position, text in summary_sections:
+        before = context_budget
+        piece = take(label, text, summaries_cap)
+        if not piece:
+            continue
+        summaries_cap -= before - context_budget
+        if position is None:
+            volatile.append({"role": "system", "content": piece})
+        else:
+            stable.append((position, piece))
+
+    messages = [fixed[0]]
+    if stable:
+        messages.append({"role": "system", "content": "\n".join(piece for _, piece in sorted(stable))})
+    if len(messages) > 1 or volatile:
+        remaining -= count_message_tokens(messages[1:] + volatile) - REPLY_PRIMING_TOKENS
+
+    # Recent turns get what is left, newest first; the oldest are dropped.
+    kept: List[dict] = []
+    for msg in reversed(history):
+        cost = MESSAGE_OVERHEAD_TOKENS + count_tokens(msg["content"])
+        if cost > remaining:
+            break
+        kept.append({"role": msg["role"], "content": msg["content"]})
+        remaining -= cost
+    kept.reverse()
+
+    messages.extend(kept)
+    messages.extend(volatile)
+    messages.append(fixed[1])
+    built = BuiltPrompt(
+        messages=messages,
+        token_count=count_message_tokens(messages),
+        budget=budget,
+        history_kept=len(kept),
+        history_dropped=len(history) - len(kept),
+        truncated=truncated,
+        dropped=dropped,
+    )
+    logger.info(
+        "Prompt built: %d/%d tokens, history %d kept/%d dropped, truncated=%s dropped=%s",
+        built.token_count, budget, built.history_kept, built.history_dropped, truncated, dropped,
+    )
+    return built
@@ -0,0 +1,469 @@
+import functools
+import inspect
+import os
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from .db import close_supabase, get_supabase, warm_supabase
+from .pagination import Cursor, PageParams, finish_page, keyset_filter
+from .telemetry import span
+
+# "supabase" (default) or "sqlite" for an embedded single-node database
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase").lower()
+
+
+def _utcnow() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _first(rows: Optional[list]) -> Optional[dict]:
+    return rows[0] if rows else None
+
+
+class Repository:
+    """A storage backend for the app's tables.
+
+    ``SupabaseRepository`` defines the calls and the row shapes they return;
+    other backends implement the same methods so routes and services work
+    against any of them. Every public call is timed as a ``db`` span named
+    after the method, so metrics read the same whichever backend is in use.
+    """
+    name = ""
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for attr, fn in list(vars(cls).items()):
+            if not attr.startswith("_") and attr not in ("warm", "close") and inspect.iscoroutinefunction(fn):
+                setattr(cls, attr, _timed(attr, fn))
+
+    async def warm(self) -> None:
+        """Open connections ahead of the first request; best effort, called at startup."""
+
+    async def close(self) -> None:
+        pass
+
+
+def _timed(name: str, fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        with span("db", name):
+            return await fn(*args, **kwargs)
+    return wrapper
+
+
+class SupabaseRepository(Repository):
+    """Async data access for every table the API touches.
+
+    Routes and services go through this instead of building PostgREST queries
+    inline, so no request ever blocks the event loop on a database round trip.
+    """
+    name = "supabase"
+
+    async def warm(self) -> None:
+        await warm_supabase()
+
+    async def close(self) -> None:
+        await close_supabase()
+
+    async def _table(self, name: str):
+        return (await get_supabase()).table(name)
+
+    async def _keyset_page(
+        self, query, params: PageParams, ts_col: str, id_col: str, newest_first: bool
+    ) -> Tuple[List[dict], Optional[str]]:
+        """Run ``query`` as one keyset page ordered by (ts_col, id_col)."""
+        if params.after is not None:
+            query = query.or_(keyset_filter(ts_col, id_col, params.after, "gt"))
+            desc = False
+        else:
+            if params.before is not None:
+                query = query.or_(keyset_filter(ts_col, id_col, params.before, "lt"))
+            desc = True
+        res = await query \
+            .order(ts_col, desc=desc) \
+            .order(id_col, desc=desc) \
+            .limit(params.limit + 1) \
+            .execute()
+        return finish_page(res.data or [], params, ts_col, id_col, newest_first)
+
+    # ─── Users ───────────────────────────────────────────────────────────
+    async def create_user(self, user_id: str, email: str) -> Optional[dict]:
+        res = await (await self._table("Users")).insert({
+            "user_id": user_id,
+            "email": email,
+            "created_at": _utcnow(),
+        }).execute()
+        return _first(res.data)
+
+    async def list_user_ids(self, batch_size: int = 1000) -> List[str]:
+        """Every user_id in Users, read in user_id order one batch at a time."""
+        user_ids: List[str] = []
+        while True:
+            query = (await self._table("Users")).select("user_id")
+            if user_ids:
+                query = query.gt("user_id", user_ids[-1])
+            res = await query.order("user_id").limit(batch_size).execute()
+            batch = [row["user_id"] for row in res.data or []]
+            user_ids.extend(batch)
+            if len(batch) < batch_size:
+                return user_ids
+
+    # ─── ChatHistory ─────────────────────────────────────────────────────
+    async def list_chat_history(self, user_id: str, page: PageParams) -> Tuple[List[dict], Optional[str]]:
+        """One page of ChatHistory, oldest first within the page."""
+        query = (await self._table("ChatHistory")) \
+            .select("*") \
+            .eq("user_id", user_id)
+        return await self._keyset_page(query, page, "created_at", "id", newest_first=False)
+
+    async def recent_chat_history(self, user_id: str, limit: int = 10) -> List[dict]:
+        """Last ``limit`` ChatHistory rows for the user, oldest first."""
+        res = await (await self._table("ChatHistory")) \
+            .select("*") \
+            .eq("user_id", user_id) \
+            .order("created_at", desc=True) \
+            .limit(limit) \
+            .execute()
+        return list(reversed(res.data or []))
+
+    async def insert_chat_history(self, rows: List[dict]) -> List[dict]:
+        res = await (await self._table("ChatHistory")).insert(rows).execute()
+        return res.data or []
+
+    # ─── Journals ────────────────────────────────────────────────────────
+    async def upsert_journal(self, user_id: str, journal_date: str, content: str) -> Optional[dict]:
+        res = await (await self._table("Journals")).upsert({
+            "user_id": user_id,
+            "journal_date": journal_date,
+            "content": content,
+        }, on_conflict="user_id, journal_date").execute()
+        return _first(res.data)
+
+    async def list_journal_dates(self, user_id: str) -> List[str]:
+        res = await (await self._table("Journals")) \
+            .select("created_at") \
+            .eq("user_id", user_id) \
+            .execute()
+        return [row["created_at"] for row in res.data or []]
+
+    async def list_journals(
+        self,
+        user_id: str,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+    ) -> List[dict]:
+        """Journal entries (content, journal_date) in a date range, oldest first."""
+        query = (await self._table("Journals")) \
+            .select("content, journal_date") \
+            .eq("user_id", user_id)
+        if start_date:
+            query = query.gte("journal_date", start_date)
+        if end_date:
+            query = query.lte("journal_date", end_date)
+        res = await query.order("journal_date").execute()
+        return res.data or []
+
+    async def journal_days_between(self, user_id: str, start_date: str, end_date: str) -> List[str]:
+        """Dates in [start_date, end_date] that have a journal entry, without the text."""
+        res = await (await self._table("Journals")) \
+            .select("journal_date") \
+            .eq("user_id", user_id) \
+            .gte("journal_date", start_date) \
+            .lte("journal_date", end_date) \
+            .order("journal_date") \
+            .execute()
+        return [row["journal_date"] for row in res.data or []]
+
+    async def journals_on(self, user_id: str, days: List[str]) -> List[dict]:
+        """Journal entries (content, journal_date) for specific dates."""
+        if not days:
+            return []
+        res = await (await self._table("Journals")) \
+            .select("content, journal_date") \
+            .eq("user_id", user_id) \
+            .in_("journal_date", days) \
+            .execute()
+        return res.data or []
+
+    # ─── JournalSummaries ────────────────────────────────────────────────
+    async def upsert_journal_summary(
+        self, user_id: str, start_date: str, end_date: str, summary_text: str
+    ) -> Optional[dict]:
+        res = await (await self._table("JournalSummaries")).upsert({
+            "user_id": user_id,
+            "start_date": start_date,
+            "end_date": end_date,
+            "summary_text": summary_text,
+            "stale": False,
+        }, on_conflict="user_id, start_date, end_date").execute()
+        return _first(res.data)
+
+    async def insert_journal_summary(
+        self, user_id: str, start_date: str, end_date: str, summary_text: str
+    ) -> Optional[dict]:
+        res = await (await self._table("JournalSummaries")).insert([{
+            "user_id": user_id,
+            "start_date": start_date,
+            "end_date": end_date,
+            "summary_text": summary_text,
+        }]).execute()
+        return _first(res.data)
+
+    async def get_journal_summary(self, user_id: str, start_date: str, end_date: str) -> Optional[dict]:
+        res = await (await self._table("JournalSummaries")) \
+            .select("*") \
+            .eq("user_id", user_id) \
+            .eq("start_date", start_date) \
+            .eq("end_date", end_date) \
+            .limit(1) \
+            .execute()
+        return _first(res.data)
+
+    async def journal_summaries_between(
+        self, user_id: str, start_date: str, end_date: str, daily_only: bool = False
+    ) -> List[dict]:
+        """Summaries fully inside [start_date, end_date], newest first.
+
+        ``daily_only`` leaves out the week/month roll-ups, which repeat what
+        the daily rows they were built from say.
+        """
+        query = (await self._table("JournalSummaries")) \
+            .select("start_date,end_date,summary_text,stale") \
+            .eq("user_id", user_id) \
+            .gte("start_date", start_date) \
+            .lte("end_date", end_date)
+        if daily_only:
+            query = query.is_("daily", "true")
+        res = await query.order("start_date", desc=True).execute()
+        return res.data or []
+
+    async def upsert_journal_summaries(self, rows: List[dict]) -> int:
+        """Bulk upsert of JournalSummaries rows keyed on (user_id, start_date, end_date)."""
+        if not rows:
+            return 0
+        res = await (await self._table("JournalSummaries")) \
+            .upsert(rows, on_conflict="user_id, start_date, end_date") \
+            .execute()
+        return len(res.data or [])
+
+    async def mark_journal_summaries_stale(self, user_id: str, day: str) -> None:
+        """Flag multi-day summaries whose range contains ``day`` as stale; regenerating one clears it."""
+        await (await self._table("JournalSummaries")) \
+            .update({"stale": True}) \
+            .eq("user_id", user_id) \
+            .lte("start_date", day) \
+            .gte("end_date", day) \
+            .or_(f"start_date.lt.{day},end_date.gt.{day}") \
+            .execute()
+
+    async def recent_journal_summaries(self, user_id: str, limit: int = 5) -> List[dict]:
+        res = await (await self._table("JournalSummaries")) \
+            .select("summary_text") \
+            .eq("user_id", user_id) \
+            .order("inserted_at", desc=True) \
+            .limit(limit) \
+            .execute()
+        return res.data or []
+
+    # ─── ChatSessions ────────────────────────────────────────────────────
+    async def list_chat_sessions(self, user_id: str, page: PageParams) -> Tuple[List[dict], Optional[str]]:
+        """One page of the user's sessions, newest first."""
+        query = (await self._table("ChatSessions")) \
+            .select("session_id, created_at, notes") \
+            .eq("user_id", user_id)
+        return await self._keyset_page(query, page, "created_at", "session_id", newest_first=True)
+
+    async def list_session_ids(self, user_id: str) -> List[str]:
+        res = await (await self._table("ChatSessions")) \
+            .select("session_id") \
+            .eq("user_id", user_id) \
+            .order("created_at") \
+            .execute()
+        return [row["session_id"] for row in res.data or []]
+
+    async def create_chat_session(self, user_id: str) -> Optional[dict]:
+        res = await (await self._table("ChatSessions")).insert({"user_id": user_id}).execute()
+        return _first(res.data)
+
+    async def get_chat_session(self, session_id: str) -> Optional[dict]:
+        res = await (await self._table("ChatSessions")) \
+            .select("session_id, user_id") \
+            .eq("session_id", session_id) \
+            .limit(1) \
+            .execute()
+        return _first(res.data)
+
+    async def session_belongs_to(self, session_id: str, user_id: str) -> bool:
+        res = await (await self._table("ChatSessions")) \
+            .select("session_id") \
+            .eq("session_id", session_id) \
+            .eq("user_id", user_id) \
+            .limit(1) \
+            .execute()
+        return bool(res.data)
+
+    # ─── ChatMessages ────────────────────────────────────────────────────
+    async def list_session_messages(self, session_id: str, page: PageParams) -> Tuple[List[dict], Optional[str]]:
+        """One page of a session's messages, oldest first within the page."""
+        query = (await self._table("ChatMessages")) \
+            .select("*") \
+            .eq("session_id", session_id)
+        return await self._keyset_page(query, page, "created_at", "chat_id", newest_first=False)
+
+    async def session_transcript(self, session_id: str) -> List[dict]:
+        """Every (role, content) in a session, oldest first, for summarization."""
+        res = await (await self._table("ChatMessages")) \
+            .select("role, content") \
+            .eq("session_id", session_id) \
+            .order("created_at") \
+            .execute()
+        return res.data or []
+
+    async def session_messages_after(self, session_id: str, after: Optional[Cursor] = None) -> List[dict]:
+        """Messages strictly after the (created_at, chat_id) watermark, oldest first."""
+        query = (await self._table("ChatMessages")) \
+            .select("chat_id, role, content, created_at") \
+            .eq("session_id", session_id)
+        if after is not None:
+            query = query.or_(keyset_filter("created_at", "chat_id", after, "gt"))
+        res = await query.order("created_at").order("chat_id").execute()
+        return res.data or []
+
+    async def recent_session_messages(self, session_id: str, limit: int = 10) -> List[dict]:
+        """Last ``limit`` (role, content) pairs of a session, oldest first."""
+        res = await (await self._table("ChatMessages")) \
+            .select("role, content") \
+            .eq("session_id", session_id) \
+            .order("created_at", desc=True) \
+            .limit(limit) \
+            .execute()
+        return list(reversed(res.data or []))
+
+    async def insert_chat_message(self, session_id: str, user_id: str, role: str, content: str) -> Optional[dict]:
+        res = await (await self._table("ChatMessages")).insert({
+            "session_id": session_id,
+            "user_id": user_id,
+            "role": role,
+            "content": content,
+            "created_at": _utcnow(),
+        }).execute()
+        return _first(res.data)
+
+    async def insert_chat_messages(self, rows: List[dict]) -> int:
+        """Multi-row insert of complete rows (chat_id and created_at set by the caller).
+
+        Rows whose chat_id already exists are skipped, so replaying a batch
+        that may have landed before a crash is harmless.
+        """
+        from postgrest import ReturnMethod
+
+        if not rows:
+            return 0
+        await (await self._table("ChatMessages")) \
+            .upsert(rows, on_conflict="chat_id", ignore_duplicates=True, returning=ReturnMethod.minimal) \
+            .execute()
+        return len(rows)
+
+    # ─── ChatSummaries ───────────────────────────────────────────────────
+    async def insert_chat_summary(
+        self,
+        user_id: str,
+        session_id: str,
+        summary_text: str,
+        last_message_at: Optional[str] = None,
+        last_message_id: Optional[str] = None,
+    ) -> Optional[dict]:
+        row = {
+            "user_id": user_id,
+            "session_id": session_id,
+            "summary_text": summary_text,
+        }
+        if last_message_id is not None:
+            row["last_message_at"] = last_message_at
+            row["last_message_id"] = last_message_id
+        res = await (await self._table("ChatSummaries")).insert([row]).execute()
+        return _first(res.data)
+
+    async def upsert_chat_summaries(self, rows: List[dict]) -> int:
+        """Bulk upsert keyed on (session_id, last_message_id): one row per summarized watermark."""
+        if not rows:
+            return 0
+        res = await (await self._table("ChatSummaries")) \
+            .upsert(rows, on_conflict="session_id, last_message_id") \
+            .execute()
+        return len(res.data or [])
+
+    async def latest_session_summary(self, session_id: str, user_id: str) -> Optional[dict]:
+        """Newest summary row of a user's session, including its watermark columns."""
+        res = await (await self._table("ChatSummaries")) \
+            .select("*") \
+            .eq("session_id", session_id) \
+            .eq("user_id", user_id) \
+            .order("inserted_at", desc=True) \
+            .limit(1) \
+            .execute()
+        return _first(res.data)
+
+    async def list_chat_summaries(self, user_id: str, page: PageParams) -> Tuple[List[dict], Optional[str]]:
+        """One page of the user's chat summaries, newest first; only the latest of each session."""
+        # Every incremental fold adds a row; the view hides the ones it superseded
+        query = (await self._table("LatestChatSummaries")) \
+            .select("*") \
+            .eq("user_id", user_id)
+        return await self._keyset_page(query, page, "inserted_at", "id", newest_first=True)
+
+    async def latest_chat_summaries(self, user_id: str, limit: int = 1, since: Optional[str] = None) -> List[dict]:
+        query = (await self._table("ChatSummaries")) \
+            .select("summary_text, inserted_at") \
+            .eq("user_id", user_id)
+        if since:
+            query = query.gte("inserted_at", since)
+        res = await query.order("inserted_at", desc=True).limit(limit).execute()
+        return res.data or []
+
+    # ─── UserProfiles ────────────────────────────────────────────────────
+    async def get_user_profile(self, user_id: str) -> Optional[dict]:
+        res = await (await self._table("UserProfiles")) \
+            .select("*") \
+            .eq("user_id", user_id) \
+            .limit(1) \
+            .execute()
+        return _first(res.data)
+
+    async def insert_user_profile(self, user_id: str, profile_data: dict) -> Optional[dict]:
+        res = await (await self._table("UserProfiles")).insert({
+            "user_id": user_id,
+            "profile_data": profile_data,
+            "updated_at": _utcnow(),
+        }).execute()
+        return _first(res.data)
+
+    async def upsert_user_profiles(self, rows: List[dict]) -> int:
+        """Bulk upsert of (user_id, profile_data) rows."""
+        if not rows:
+            return 0
+        now = _utcnow()
+        res = await (await self._table("UserProfiles")) \
+            .upsert([{**row, "updated_at": now} for row in rows], on_conflict="user_id") \
+            .execute()
+        return len(res.data or [])
+
+    async def upsert_user_profile(self, user_id: str, profile_data: dict) -> Optional[dict]:
+        res = await (await self._table("UserProfiles")).upsert([{
+            "user_id": user_id,
+            "profile_data": profile_data,
+            "updated_at": _utcnow(),
+        }], on_conflict="user_id").execute()
+        return _first(res.data)
+
+
+def _create_repository() -> Repository:
+    if STORAGE_BACKEND == "sqlite":
+        from .sqlite_repository import SQLiteRepository
+        return SQLiteRepository()
+    if STORAGE_BACKEND != "supabase":
+        raise ValueError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r}")
+    return SupabaseRepository()
+
+
+repository = _create_repository()
@@ -1,50 +1,45 @@
 
+import logging
+
 from fastapi.responses import JSONResponse
 from ..schemas import UserSignup, UserLogin, RefreshRequest, RefreshResponse
-from ..db import supabase
+from ..db import get_supabase
+from ..repository import repository
 from ..dependencies import get_current_user
-from datetime import datetime
 from fastapi import APIRouter, HTTPException, Depends, status
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 @router.post("/signup")
 async def signup(user: UserSignup):
     try:
         # First, check if the user already exists
-        print(f"Attempting to sign up user with email: {user.email}")
+        logger.info("Signing up a new user")
         
         # Sign up the user with Supabase
-        response = supabase.auth.sign_up({"email": user.email, "password": user.password})
+        sb = await get_supabase()
+        response = await sb.auth.sign_up({"email": user.email, "password": user.password})
         
-        # Log the response
-        print("Supabase Signup Response:", response)
-
         if response.user is None:
-            print("Signup failed: User is None")
+            logger.warning("Signup failed: Supabase returned no user")
             raise HTTPException(status_code=400, detail="Signup failed. Check email/password validity.")
 
         try:
             # Try to save user email to database
-            print(f"Attempting to save user to database with ID: {response.user.id}")
-            supabase.table("users").insert({
-                "id": response.user.id,  # Use the Supabase user ID as the primary key
-                "email": user.email,
-                "created_at": datetime.utcnow().isoformat()
-            }).execute()
-            print("Successfully saved user to database")
+            # Use the Supabase user ID as the primary key
+            await repository.create_user(response.user.id, user.email)
+            logger.info("Saved new user %s", response.user.id)
         except Exception as db_error:
             # If database save fails, continue with auth flow but log the error
-            print(f"Warning: Failed to save user to database: {str(db_error)}")
+            logger.warning("Failed to save user %s to database: %s", response.user.id, db_error)
             # This shouldn't stop the signup process
 
         try:
             # Try to sign in the user immediately after signup
-            print("Attempting to sign in the user after signup")
-            signin_response = supabase.auth.sign_in_with_password({"email": user.email, "password": user.password})
-            print("Signin response after signup:", signin_response)
+            signin_response = await sb.auth.sign_in_with_password({"email": user.email, "password": user.password})
             
             if signin_response.user is None:
-                print("Warning: Auto-login failed after signup")
+                logger.warning("Auto-login failed after signup for user %s", response.user.id)
                 # If sign-in fails after signup, still return success but without tokens
                 return {
                     "message": "User signed up successfully but auto-login failed. Please log in manually.",
@@ -53,7 +48,6 @@ async def signup(user: UserSignup):
                 }
 
             # Return both user info and tokens
-            print("Successfully signed up and logged in user")
             return {
                 "message": "User signed up successfully!",
                 "user_id": response.user.id,
@@ -63,20 +57,20 @@ async def signup(user: UserSignup):
             }
         except Exception as signin_error:
             # If auto-login fails, still consider signup successful
-            print(f"Auto-login failed after signup: {str(signin_error)}")
+            logger.warning("Auto-login failed after signup for user %s: %s", response.user.id, signin_error)
             return {
                 "message": "User signed up successfully but auto-login failed. Please log in manually.",
                 "user_id": response.user.id,
                 "email": response.user.email
             }
     except Exception as e:
-        print("Error during signup:", str(e))
-        print("Error details:", e)
+        logger.exception("Error during signup: %s", e)
         raise HTTPException(status_code=500, detail=f"Signup failed: {str(e)}")
 
 @router.post("/login")
 async def login(user: UserLogin):
-    response = supabase.auth.sign_in_with_password({"email": user.email, "password": user.password})
+    sb = await get_supabase()
+    response = await sb.auth.sign_in_with_password({"email": user.email, "password": user.password})
     
     if response.user is None:
         raise HTTPException(status_code=400, detail=response.error.message)
@@ -86,19 +80,17 @@ async def login(user: UserLogin):
 @router.post("/refresh", response_model=RefreshResponse)
 async def refresh_token(req: RefreshRequest):
     # Call supabase to rotate the session
-    result = supabase.auth.refresh_session(req.refresh_token)
-
-    # supabase-py returns a dict with 'data' and 'error'
-    err = result.get("error")
-    if err:
+    sb = await get_supabase()
+    try:
+        result = await sb.auth.refresh_session(req.refresh_token)
+    except Exception as err:
         # Something went wrong on the Supabase side
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=f"Refresh failed: {err}"
         )
 
-    data = result.get("data") or {}
-    session = data.get("session")
+    session = result.session
     if not session:
         # No session in the payload means refresh failed
         raise HTTPException(
@@ -108,12 +100,12 @@ async def refresh_token(req: RefreshRequest):
 
     # Optionally, set the new refresh token in an HttpOnly cookie:
     resp = JSONResponse(content={
-        "access_token": session["access_token"],
-        "refresh_token": session["refresh_token"],
+        "access_token": session.access_token,
+        "refresh_token": session.refresh_token,
     })
     resp.set_cookie(
         key="refresh_token",
-        value=session["refresh_token"],
+        value=session.refresh_token,
         httponly=True,
         secure=True,       # False on localhost/http
         samesite="strict"  # or "lax"
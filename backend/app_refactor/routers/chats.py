@@ -1,6 +1,8 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from typing import List
 from ..dependencies import get_current_user
+from ..sse import sse_response
+from ..pagination import PageParams, page_params
 from ..services.chat_service import (
     chat_conversation,
     list_chat_summaries,
@@ -8,12 +10,14 @@ from ..services.chat_service import (
     get_user_chat_sessions,
     create_chat_session,
     get_session_messages,
-    send_message_to_session
+    send_message_to_session,
+    stream_message_to_session
 )
 from ..schemas import (
     ChatMessageIn,
     ChatSummaryCreate,
     ChatSummaryOut,
+    ChatSummaryPage,
     SessionMessageCreate,
     SessionMessageOut  # define this in schemas for your message endpoints
 )
@@ -34,25 +38,35 @@ async def post_chat_summary(
     payload: ChatSummaryCreate,
     user    = Depends(get_current_user)
 ):
-    return await create_chat_summary(user.id, str(payload.session_id))
+    record = await create_chat_summary(user.id, str(payload.session_id))
+    if record is None:
+        raise HTTPException(status_code=404, detail="No messages to summarize in this chat session.")
+    return record
 
-@router.get("/chat-summaries", response_model=List[ChatSummaryOut])
-async def get_chat_summaries(user = Depends(get_current_user)):
-    return await list_chat_summaries(user.id)
+@router.get("/chat-summaries", response_model=ChatSummaryPage)
+async def get_chat_summaries(
+    page: PageParams = Depends(page_params),
+    user = Depends(get_current_user)
+):
+    return await list_chat_summaries(user.id, page)
 
 
 # --- new chat‑sessions endpoints ---
 @router.get("/chat-sessions")
-async def list_sessions(user=Depends(get_current_user)):
-    return await get_user_chat_sessions(user.id)
+async def list_sessions(page: PageParams = Depends(page_params), user=Depends(get_current_user)):
+    return await get_user_chat_sessions(user.id, page)
 
 @router.post("/chat-sessions")
 async def new_session(user=Depends(get_current_user)):
     return await create_chat_session(user.id)
 
 @router.get("/chat-sessions/{session_id}/messages")
-async def read_session_messages(session_id: str, user=Depends(get_current_user)):
-    return await get_session_messages(user.id, session_id)
+async def read_session_messages(
+    session_id: str,
+    page: PageParams = Depends(page_params),
+    user=Depends(get_current_user)
+):
+    return await get_session_messages(user.id, session_id, page)
 
 @router.post("/chat-sessions/{session_id}/messages", response_model=SessionMessageOut)
 async def post_session_message(
@@ -60,4 +74,12 @@ async def post_session_message(
     msg: SessionMessageCreate,
     user=Depends(get_current_user)
 ):
-    return await send_message_to_session(user.id, session_id, msg.message)
\ No newline at end of file
+    return await send_message_to_session(user.id, session_id, msg.message)
+
+@router.post("/chat-sessions/{session_id}/messages/stream")
+async def stream_session_message(
+    session_id: str,
+    msg: SessionMessageCreate,
+    user=Depends(get_current_user)
+):
+    return sse_response(await stream_message_to_session(user.id, session_id, msg.message))
@@ -31,6 +31,8 @@ class JournalSummaryOut(BaseModel):
     end_date: date
     summary_text: str
     inserted_at: datetime
+    # A journal in the range changed since; POST the range again to refresh it
+    stale: bool = False
     model_config = ConfigDict(from_attributes=True)
 
 # --- Chats ---
@@ -45,6 +47,10 @@ class ChatSummaryOut(BaseModel):
     inserted_at: datetime
     model_config = ConfigDict(from_attributes=True)
 
+class ChatSummaryPage(BaseModel):
+    summaries: List[ChatSummaryOut]
+    next_cursor: Optional[str] = None
+
 class ChatMessageIn(BaseModel):
     message: str
     context: Optional[str] = None
@@ -1,144 +1,181 @@
-import os, logging
+import logging
 from datetime import datetime
-from typing import List, Optional
-from openai import OpenAI
-from ..db import supabase
+from typing import AsyncIterator, List, Optional, Tuple
+from ..llm import complete_text, stream_text
+from ..llm_router import model_router
+from ..llm_scheduler import Priority
+from ..message_writer import message_writer
+from ..sse import sse_event
+from ..repository import repository
+from ..pagination import Cursor, PageParams
+from ..prompt_builder import CHAT_SYSTEM_PROMPT, HISTORY_FETCH_LIMIT, SESSION_SYSTEM_PROMPT, build_chat_prompt
+from .context_service import assemble_context, invalidate_user_context
 
 logger = logging.getLogger(__name__)
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+
+class SessionAccessError(PermissionError):
+    """The chat session does not exist or belongs to another user."""
 
 async def chat_conversation(
     user_id: str,
     message: str,
     context: Optional[str] = None
 ) -> str:
-    # 1) pull last 10 chat messages
-    history = (
-        supabase.table("ChatHistory")
-                 .select("*")
-                 .eq("user_id", user_id)
-                 .order("created_at")
-                 .limit(10)
-                 .execute()
-                 .data
-    )
+    # 1) pull recent chat messages
+    history = await repository.recent_chat_history(user_id, limit=HISTORY_FETCH_LIMIT)
 
-    # 2) build OpenAI payload
-    messages = [
-        {"role": "system", "content": "You are an empathetic AI therapist named Therapost. ..."}
-    ]
-    if context:
-        messages.append({"role": "system", "content": context})
-    for msg in reversed(history):
-        messages.append({"role": msg["role"], "content": msg["content"]})
-    messages.append({"role": "user", "content": message})
+    # 2) build OpenAI payload within the token budget
+    messages = build_chat_prompt(
+        system_prompt=CHAT_SYSTEM_PROMPT,
+        user_message=message,
+        context=context,
+        history=history,
+    ).messages
 
     # 3) call GPT
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
+    ai_reply = await complete_text(
+        user=user_id,
+        route="chat",
         messages=messages,
         max_tokens=1000,
         temperature=0.7
     )
-    ai_reply = resp.choices[0].message.content
 
     # 4) persist both user & assistant messages
     now = datetime.utcnow().isoformat()
-    supabase.table("ChatHistory").insert([
+    await repository.insert_chat_history([
         {"user_id": user_id, "role": "user",      "content": message,  "created_at": now},
         {"user_id": user_id, "role": "assistant", "content": ai_reply,  "created_at": now},
-    ]).execute()
+    ])
 
     return ai_reply
 
-async def list_chat_summaries(user_id: str) -> List[dict]:
-    data = (
-        supabase.table("ChatSummaries")
-                 .select("*")
-                 .eq("user_id", user_id)
-                 .order("inserted_at", ascending=False)
-                 .execute()
-                 .data
-    )
-    return data or []
-
-async def create_chat_summary(user_id: str, session_id: str) -> dict:
-    msgs = (
-        supabase.table("ChatMessages")
-                 .select("role, content")
-                 .eq("session_id", session_id)
-                 .order("created_at", ascending=True)
-                 .execute()
-                 .data
-    )
+async def list_chat_summaries(user_id: str, page: PageParams) -> dict:
+    summaries, next_cursor = await repository.list_chat_summaries(user_id, page)
+    return {"summaries": summaries, "next_cursor": next_cursor}
+
+def _summary_watermark(summary: Optional[dict]) -> Optional[Cursor]:
+    if not summary or not summary.get("last_message_id"):
+        return None  # rows written before watermarks existed cover an unknown range
+    return Cursor(summary["last_message_at"], summary["last_message_id"])
+
+
+async def prepare_chat_summary(session_id: str, user_id: str) -> Tuple[Optional[dict], Optional[dict]]:
+    """
+    Work out the next incremental summary of a session. Returns
+    ``(previous_summary, job)``; ``job`` is None when nothing is new (both
+    are None for a session without messages), else
+    ``{"request": <chat.completions kwargs>, "last_message_at", "last_message_id"}``.
+    Shared by the online endpoint and the batch pipeline. Raises
+    ``SessionAccessError`` unless ``user_id`` owns the session.
+    """
+    if not await repository.session_belongs_to(session_id, user_id):
+        raise SessionAccessError("Access denied to this chat session.")
+    await message_writer.wait_for_session(session_id)
+    previous = await repository.latest_session_summary(session_id, user_id)
+    watermark = _summary_watermark(previous)
+    msgs = await repository.session_messages_after(session_id, watermark)
+    if not msgs:
+        return previous, None
+
     convo = "\n".join(f"{m['role']}: {m['content']}" for m in msgs)
-    prompt = f"Please summarize this conversation:\n\n{convo}"
-
-    ai_resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system",  "content": "You are a concise summarizer."},
-            {"role": "user",    "content": prompt}
-        ],
-        max_tokens=300
-    ).choices[0].message.content
-
-    res = (
-        supabase.table("ChatSummaries")
-                 .insert([{
-                     "user_id":      user_id,
-                     "session_id":   session_id,
-                     "summary_text": ai_resp
-                 }])
-                 .execute()
+    if watermark is not None:
+        prompt = (
+            f"Here is the summary of the conversation so far:\n\n{previous['summary_text']}\n\n"
+            f"Update it to also cover these new messages:\n\n{convo}"
+        )
+    else:
+        prompt = f"Please summarize this conversation:\n\n{convo}"
+
+    last = msgs[-1]
+    return previous, {
+        "request": dict(
+            model=model_router.default_model("summary"),
+            messages=[
+                {"role": "system",  "content": "You are a concise summarizer."},
+                {"role": "user",    "content": prompt}
+            ],
+            max_tokens=300
+        ),
+        "last_message_at": last.get("created_at"),
+        "last_message_id": last.get("chat_id"),
+    }
+
+
+async def create_chat_summary(user_id: str, session_id: str) -> Optional[dict]:
+    """
+    Summarize a session incrementally. Only messages after the latest
+    summary's watermark are read and folded into that summary, so the cost
+    scales with what is new; a session with nothing new returns the existing
+    summary, and one without any messages returns None, without calling the
+    model.
+    """
+    previous, job = await prepare_chat_summary(session_id, user_id)
+    if job is None:
+        if previous is None:
+            logger.info("Session %s has no messages; nothing to summarize.", session_id)
+            return None
+        logger.info("Session %s unchanged since last summary; skipping.", session_id)
+        return previous
+
+    ai_resp = await complete_text(
+        cache="chat_summary", route="summary", priority=Priority.BACKGROUND, user=user_id, **job["request"]
     )
-    return res.data[0]
 
-
-async def get_user_chat_sessions(user_id: str) -> List[dict]:
-    """Retrieve all chat sessions for the given user."""
-    resp = (
-        supabase.table("ChatSessions")
-                 .select("session_id, created_at, notes")
-                 .eq("user_id", user_id)
-                 .order("created_at", ascending=False)
-                 .execute()
+    record = await repository.insert_chat_summary(
+        user_id, session_id, ai_resp,
+        last_message_at=job["last_message_at"],
+        last_message_id=job["last_message_id"],
     )
-    return resp.data or []
+    invalidate_user_context(user_id)
+    return record
+
+
+async def get_user_chat_sessions(user_id: str, page: PageParams) -> dict:
+    """Retrieve one page of chat sessions for the given user, newest first."""
+    sessions, next_cursor = await repository.list_chat_sessions(user_id, page)
+    return {"sessions": sessions, "next_cursor": next_cursor}
 
 
 async def create_chat_session(user_id: str) -> dict:
     """Create a new chat session for the user and return it."""
-    resp = (
-        supabase.table("ChatSessions")
-                 .insert({"user_id": user_id})
-                 .execute()
-    )
-    data = resp.data or []
-    return data[0] if data else {}
+    return await repository.create_chat_session(user_id) or {}
 
 
-async def get_session_messages(user_id: str, session_id: str) -> List[dict]:
-    """Verify ownership, then fetch all messages in the specified session."""
+async def get_session_messages(user_id: str, session_id: str, page: PageParams) -> dict:
+    """Verify ownership, then fetch one page of messages in the specified session."""
     # Verify session belongs to user
-    check = (
-        supabase.table("ChatSessions")
-                 .select("user_id")
-                 .eq("session_id", session_id)
-                 .execute()
-    )
-    if not check.data or check.data[0]["user_id"] != user_id:
-        return []
-
-    # Fetch messages
-    resp = (
-        supabase.table("ChatMessages")
-                 .select("*")
-                 .eq("session_id", session_id)
-                 .order("created_at", ascending=True)
-                 .execute()
-    )
-    return resp.data or []
+    session = await repository.get_chat_session(session_id)
+    if not session or session["user_id"] != user_id:
+        return {"messages": [], "next_cursor": None}
+
+    # Fetch messages, including any still waiting in the write-behind outbox
+    await message_writer.wait_for_session(session_id)
+    messages, next_cursor = await repository.list_session_messages(session_id, page)
+    return {"messages": messages, "next_cursor": next_cursor}
+
+
+async def _prepare_session_turn(user_id: str, session_id: str, message: str):
+    """Verify ownership, save the user message and build the GPT payload."""
+    # Fetch context, ownership and recent messages concurrently
+    ctx = await assemble_context(user_id, session_id=session_id, history_limit=HISTORY_FETCH_LIMIT)
+    if not ctx.session_owned:
+        raise Exception("Access denied to this chat session.")
+
+    # 1) Save user message
+    saved_user = await message_writer.enqueue(session_id, user_id, "user", message)
+
+    # 2) Build context for GPT within the token budget
+    messages = build_chat_prompt(
+        system_prompt=SESSION_SYSTEM_PROMPT,
+        user_message=message,
+        profile=ctx.profile,
+        journal_summaries=ctx.journal_summaries,
+        chat_summary=ctx.last_chat_summary,
+        history=ctx.history,
+    ).messages
+    return saved_user, messages
 
 
 async def send_message_to_session(
@@ -150,65 +187,57 @@ async def send_message_to_session(
     Save a user message in a session, call GPT for a reply,
     save the AI response, and return both saved records.
     """
-    # Verify session ownership
-    check = (
-        supabase.table("ChatSessions")
-                 .select("user_id")
-                 .eq("session_id", session_id)
-                 .execute()
-    )
-    if not check.data or check.data[0]["user_id"] != user_id:
-        raise Exception("Access denied to this chat session.")
-
-    now = datetime.utcnow().isoformat()
-
-    # 1) Save user message
-    user_resp = supabase.table("ChatMessages").insert({
-        "session_id": session_id,
-        "user_id":    user_id,
-        "role":       "user",
-        "content":    message,
-        "created_at": now
-    }).execute()
-    saved_user = (user_resp.data or [None])[0]
-
-    # 2) Build context for GPT: last 10 messages
-    history = (
-        supabase.table("ChatMessages")
-                 .select("role, content")
-                 .eq("session_id", session_id)
-                 .order("created_at", ascending=False)
-                 .limit(10)
-                 .execute()
-                 .data
-    )
-    messages = [
-        {"role": "system", "content": "You are an empathetic AI therapist named Therapost."}
-    ]
-    for msg in reversed(history):
-        messages.append({"role": msg["role"], "content": msg["content"]})
-    messages.append({"role": "user", "content": message})
+    saved_user, messages = await _prepare_session_turn(user_id, session_id, message)
 
     # 3) Call OpenAI
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
+    ai_reply = await complete_text(
+        user=user_id,
+        route="chat",
         messages=messages,
         max_tokens=300,
         temperature=0.7
     )
-    ai_reply = resp.choices[0].message.content
 
     # 4) Save AI response
-    ai_resp = supabase.table("ChatMessages").insert({
-        "session_id": session_id,
-        "user_id":    user_id,
-        "role":       "assistant",
-        "content":    ai_reply,
-        "created_at": now
-    }).execute()
-    saved_ai = (ai_resp.data or [None])[0]
+    saved_ai = await message_writer.enqueue(session_id, user_id, "assistant", ai_reply)
 
     return {
         "userMessage": saved_user,
         "aiMessage":   saved_ai
-    }
\ No newline at end of file
+    }
+
+
+async def stream_message_to_session(
+    user_id: str,
+    session_id: str,
+    message: str
+) -> AsyncIterator[str]:
+    """
+    Like send_message_to_session, but returns a stream of Server-Sent Events:
+    the saved user message, each token as GPT produces it, and a final `done`
+    event with both saved records once the full reply is persisted.
+    Ownership is checked before the stream is returned.
+    """
+    saved_user, messages = await _prepare_session_turn(user_id, session_id, message)
+
+    async def events():
+        yield sse_event("user_message", saved_user)
+        try:
+            parts = []
+            async for delta in stream_text(
+                user=user_id,
+                route="chat",
+                messages=messages,
+                max_tokens=300,
+                temperature=0.7
+            ):
+                parts.append(delta)
+                yield sse_event("token", {"delta": delta})
+
+            saved_ai = await message_writer.enqueue(session_id, user_id, "assistant", "".join(parts))
+            yield sse_event("done", {"userMessage": saved_user, "aiMessage": saved_ai})
+        except Exception as e:
+            logger.exception("Error streaming reply for session %s: %s", session_id, e)
+            yield sse_event("error", {"detail": str(e)})
+
+    return events()
@@ -0,0 +1,228 @@
+import asyncio
+import logging
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+from ..cache import TTLCache
+from ..message_writer import message_writer
+from ..repository import repository
+from ..shared_cache import shared_namespace
+
+logger = logging.getLogger(__name__)
+
+# Journal summaries shown to the model cover the week before last.
+JOURNAL_WINDOW_START_DAYS = 14
+JOURNAL_WINDOW_END_DAYS = 7
+
+CONTEXT_CACHE_SIZE = int(os.getenv("CONTEXT_CACHE_SIZE", "5000"))
+CONTEXT_CACHE_TTL = float(os.getenv("CONTEXT_CACHE_TTL", "900"))
+
+# user_id -> {"date", "profile", "journal_summaries", "latest_chat_summary"}.
+# Entries are dropped by invalidate_user_context() from every write path that
+# changes them, so the TTL is only a backstop for writes made outside the API.
+# With several workers the bundle lives only in the host-wide tier: a write
+# served by one worker must invalidate it for all of them.
+context_cache = TTLCache(
+    maxsize=CONTEXT_CACHE_SIZE, ttl=CONTEXT_CACHE_TTL,
+    shared=shared_namespace("context"), local_ttl=0,
+)
+# session_id -> owning user_id. Ownership never changes, so only the size bounds it.
+session_owner_cache = TTLCache(
+    maxsize=CONTEXT_CACHE_SIZE * 4, ttl=24 * 3600, shared=shared_namespace("session_owner")
+)
+_generations: Dict[str, int] = {}
+_shared_generations = shared_namespace("context_generation")
+
+
+def default_profile() -> dict:
+    """Profile inserted for users who don't have one yet."""
+    return {
+        "name": "New User",
+        "ratings": [],
+        "metadata": {
+            "format": "JSONB",
+            "source": "Initial Default Profile",
+            "version": "1.0",
+            "created_at": datetime.now(timezone.utc).isoformat()
+        },
+        "strengths": {},
+        "weaknesses": {},
+    }
+
+
+class ChatContext(BaseModel):
+    """Everything a chat turn needs from the database before calling the model."""
+    profile: dict
+    journal_summaries: List[dict] = Field(default_factory=list)
+    last_chat_summary: Optional[str] = None
+    # Only populated when a session_id was given
+    session_owned: Optional[bool] = None
+    history: List[dict] = Field(default_factory=list)
+    cache_hit: bool = False
+    timings_ms: Dict[str, float] = Field(default_factory=dict)
+
+
+def _generation(user_id: str) -> int:
+    if _shared_generations is not None:
+        return _shared_generations.counter(user_id)
+    return _generations.get(user_id, 0)
+
+
+def invalidate_user_context(user_id: str) -> None:
+    """Drop the cached context bundle; call after writing profile or summaries."""
+    user_id = str(user_id)
+    if _shared_generations is not None:
+        _shared_generations.incr(user_id)
+    else:
+        _generations[user_id] = _generations.get(user_id, 0) + 1
+    context_cache.pop(user_id)
+
+
+def _deep_sizeof(obj, seen=None) -> int:
+    seen = seen if seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_sizeof(k, seen) + _deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(_deep_sizeof(i, seen) for i in obj)
+    return size
+
+
+def context_cache_stats() -> dict:
+    """Hit ratio and approximate memory footprint of the context caches."""
+    if context_cache.shared is not None:
+        # Bundles live only in the host-wide tier; report its size there
+        shared = context_cache.shared.stats()
+        footprint = {"shared_entries": shared["entries"], "approx_bytes": shared["bytes"]}
+    else:
+        with context_cache._lock:
+            bundles = [value for _, value in context_cache._data.values()]
+        footprint = {"approx_bytes": _deep_sizeof(bundles)}
+    return {
+        "context": {**context_cache.stats(), **footprint},
+        "session_owner": session_owner_cache.stats(),
+    }
+
+
+async def _timed(name: str, timings: Dict[str, float], coro):
+    start = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        timings[name] = round((time.perf_counter() - start) * 1000, 2)
+
+
+async def _load_profile(user_id: str) -> dict:
+    row = await repository.get_user_profile(user_id)
+    if row:
+        return row["profile_data"]
+    logger.info("[Auto-Init] No profile found for user %s, inserting default.", user_id)
+    profile = default_profile()
+    await repository.insert_user_profile(user_id, profile)
+    return profile
+
+
+async def _load_latest_chat_summary(user_id: str) -> Optional[dict]:
+    rows = await repository.latest_chat_summaries(user_id, limit=1)
+    return rows[0] if rows else None
+
+
+async def _load_history(session_id: str, limit: int) -> List[dict]:
+    # Messages still in the write-behind outbox must be in the history too
+    await message_writer.wait_for_session(session_id)
+    return await repository.recent_session_messages(session_id, limit=limit)
+
+
+async def _check_ownership(session_id: str, user_id: str) -> bool:
+    owned = await repository.session_belongs_to(session_id, user_id)
+    if owned:
+        session_owner_cache.set(session_id, user_id)
+    return owned
+
+
+def _summary_since(summary: Optional[dict], since_days: Optional[int], today: date) -> Optional[str]:
+    # The newest summary is the only candidate for "newest since X", so the
+    # cached row can answer any since_days without another query.
+    if not summary:
+        return None
+    if since_days is not None and summary.get("inserted_at", "") < (today - timedelta(days=since_days)).isoformat():
+        return None
+    return summary["summary_text"]
+
+
+async def assemble_context(
+    user_id: str,
+    session_id: Optional[str] = None,
+    history_limit: int = 10,
+    chat_summary_since_days: Optional[int] = None,
+) -> ChatContext:
+    """
+    Build a chat turn's context. The per-user bundle (profile, journal-summary
+    window, latest chat summary) comes from the context cache when possible;
+    anything missing, plus session ownership and recent history, is fetched
+    concurrently so pre-LLM latency is the slowest round trip, not the sum.
+    """
+    user_id = str(user_id)
+    today = datetime.now(timezone.utc).date()
+    timings: Dict[str, float] = {}
+    sources = {}
+
+    bundle = context_cache.get(user_id)
+    if bundle is not None and bundle["date"] != today.isoformat():
+        bundle = None  # the journal window moved at midnight
+    generation = _generation(user_id)
+    if bundle is None:
+        sources["profile"] = _load_profile(user_id)
+        sources["journal_summaries"] = repository.journal_summaries_between(
+            user_id,
+            (today - timedelta(days=JOURNAL_WINDOW_START_DAYS)).isoformat(),
+            (today - timedelta(days=JOURNAL_WINDOW_END_DAYS)).isoformat(),
+            daily_only=True,
+        )
+        sources["latest_chat_summary"] = _load_latest_chat_summary(user_id)
+
+    session_owned = None
+    if session_id is not None:
+        if session_owner_cache.get(session_id) == user_id:
+            session_owned = True
+        else:
+            sources["session_owned"] = _check_ownership(session_id, user_id)
+        sources["history"] = _load_history(session_id, history_limit)
+
+    start = time.perf_counter()
+    results = dict(zip(
+        sources.keys(),
+        await asyncio.gather(*(_timed(name, timings, coro) for name, coro in sources.items())),
+    ))
+    timings["total"] = round((time.perf_counter() - start) * 1000, 2)
+
+    cache_hit = bundle is not None
+    if bundle is None:
+        bundle = {
+            "date": today.isoformat(),
+            "profile": results["profile"],
+            "journal_summaries": results["journal_summaries"],
+            "latest_chat_summary": results["latest_chat_summary"],
+        }
+        # Skip the fill if a write invalidated this user while we were reading.
+        if _generation(user_id) == generation:
+            context_cache.set(user_id, bundle)
+    logger.debug("Context for user %s assembled (cache_hit=%s) in %s", user_id, cache_hit, timings)
+
+    return ChatContext(
+        profile=bundle["profile"],
+        journal_summaries=bundle["journal_summaries"],
+        last_chat_summary=_summary_since(bundle["latest_chat_summary"], chat_summary_since_days, today),
+        session_owned=results.get("session_owned", session_owned),
+        history=results.get("history", []),
+        cache_hit=cache_hit,
+        timings_ms=timings,
+    )
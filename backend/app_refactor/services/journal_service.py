@@ -1,68 +1,183 @@
-import os
+import asyncio
 import logging
-from datetime import date
-from typing import Optional
-from openai import OpenAI
-from ..db import supabase
+import os
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+from ..llm import complete_text
+from ..llm_router import model_router
+from ..llm_scheduler import Priority
+from ..prompt_builder import count_tokens
+from ..repository import repository
 from ..schemas import JournalSummaryCreate
+from .context_service import invalidate_user_context
 
 logger = logging.getLogger(__name__)
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-async def create_journal_summary(user_id: str, payload: JournalSummaryCreate) -> dict:
-    """Summarize journals for a given user and date range, persist, and return the summary record."""
-    # 1) fetch raw journals
-    journals_resp = (
-        supabase.table("Journals")
-                 .select("content")
-                 .eq("user_id", user_id)
-                 .gte("journal_date", payload.start_date.isoformat())
-                 .lte("journal_date", payload.end_date.isoformat())
-                 .order("journal_date")
-                 .execute()
+JOURNAL_SUMMARY_CONCURRENCY = int(os.getenv("JOURNAL_SUMMARY_CONCURRENCY", "8"))
+# Input budget for one reduce call; larger sets of child summaries are reduced in batches.
+REDUCE_INPUT_TOKENS = int(os.getenv("REDUCE_INPUT_TOKENS", "6000"))
+
+Span = Tuple[date, date]
+
+
+def journal_entry_request(content: str) -> dict:
+    """chat.completions kwargs for the one-day summary of a journal entry."""
+    prompt = f"Summarize the following journal entry with emotional insight:\n\n{content}"
+    return dict(
+        model=model_router.default_model("summary"),
+        messages=[
+            {"role": "system", "content": "You are an empathetic AI therapist. Summarize the user's thoughts and feelings."},
+            {"role": "user", "content": prompt}
+        ],
+        max_tokens=300
     )
-    journals = journals_resp.data or []
 
-    # 2) build prompt
-    entries = "\n".join(f"- {entry['content']}" for entry in journals)
+
+def journal_reduce_request(texts: List[str], start: date, end: date) -> dict:
+    """chat.completions kwargs that merge child summaries covering [start, end]."""
+    entries = "\n".join(f"- {t}" for t in texts)
     prompt = (
-        f"As an AI therapist, please summarize the user's journal entries "
-        f"from {payload.start_date} to {payload.end_date}:\n\n{entries}"
+        f"As an AI therapist, please combine these summaries of the user's journal entries into one summary. "
+        f"Focus on the users highs, lows, and emotinal changes from {start} to {end}:\n\n{entries}"
     )
-
-    # 3) call OpenAI
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
+    return dict(
+        model=model_router.default_model("summary"),
         messages=[
-            {"role": "system", "content": "You are an empathetic summarizer."},
+            {"role": "system", "content": "You are an empathetic summarizer. Focus on emotional changes and insights. Use second person pronouns like 'you' and 'your' when addressing the user."},
             {"role": "user", "content": prompt}
         ],
         max_tokens=500
     )
-    ai_reply = resp.choices[0].message.content
-
-    # 4) persist summary and return
-    insert_resp = (
-        supabase.table("JournalSummaries")
-                 .insert([{
-                     "user_id": user_id,
-                     "start_date": payload.start_date.isoformat(),
-                     "end_date": payload.end_date.isoformat(),
-                     "summary_text": ai_reply
-                 }])
-                 .execute()
+
+
+async def summarize_journal_entry(content: str, user_id: Optional[str] = None) -> str:
+    """One-day summary of a single journal entry (the leaf of every range summary)."""
+    return await complete_text(
+        cache="journal_entry", route="summary", priority=Priority.BACKGROUND, user=user_id,
+        **journal_entry_request(content),
+    )
+
+
+async def _reduce(texts: List[str], start: date, end: date, user_id: Optional[str] = None) -> str:
+    """Merge child summaries into one, batching so no call exceeds REDUCE_INPUT_TOKENS."""
+    batches: List[List[str]] = [[]]
+    used = 0
+    for text in texts:
+        cost = count_tokens(text) + 2
+        if batches[-1] and used + cost > REDUCE_INPUT_TOKENS:
+            batches.append([])
+            used = 0
+        batches[-1].append(text)
+        used += cost
+    if len(batches) > 1:
+        texts = await asyncio.gather(*(_reduce(batch, start, end, user_id) for batch in batches))
+        if len(texts) > 1:
+            return await _reduce(list(texts), start, end, user_id)
+        return texts[0]
+
+    return await complete_text(
+        cache="journal_reduce", route="summary", priority=Priority.BACKGROUND, user=user_id,
+        **journal_reduce_request(texts, start, end),
+    )
+
+
+def _split(start: date, end: date) -> List[Span]:
+    """Children of a span: calendar months, else ISO weeks, else days, clipped to the span."""
+    if (start.year, start.month) != (end.year, end.month):
+        spans, cur = [], start
+        while cur <= end:
+            next_month = (cur.replace(day=28) + timedelta(days=4)).replace(day=1)
+            spans.append((cur, min(end, next_month - timedelta(days=1))))
+            cur = next_month
+        return spans
+    if start.isocalendar()[:2] != end.isocalendar()[:2]:
+        spans, cur = [], start
+        while cur <= end:
+            sunday = cur + timedelta(days=6 - cur.weekday())
+            spans.append((cur, min(end, sunday)))
+            cur = sunday + timedelta(days=1)
+        return spans
+    return [(start + timedelta(days=i), start + timedelta(days=i)) for i in range((end - start).days + 1)]
+
+
+class _RangeSummarizer:
+    """Map-reduce over stored summaries: day -> ISO week -> calendar month -> range.
+
+    Any span already in JournalSummaries is reused as-is; new intermediate
+    spans are stored so later ranges can reuse them. Saving a journal marks
+    the multi-day rows covering that day stale; those are not reused but
+    rebuilt, which clears the flag.
+    """
+
+    def __init__(self, user_id: str, stored: Dict[Span, str]):
+        self.user_id = user_id
+        self.stored = stored
+        self.reduced = 0
+
+    async def summarize(self, start: date, end: date, store: bool = True) -> Optional[str]:
+        if (start, end) in self.stored:
+            return self.stored[(start, end)]
+        if start == end:
+            return None  # no journal that day
+        children = await asyncio.gather(*(self.summarize(s, e) for s, e in _split(start, end)))
+        texts = [t for t in children if t]
+        if not texts:
+            return None
+        if len(texts) == 1:
+            return texts[0]
+        text = await _reduce(texts, start, end, self.user_id)
+        self.reduced += 1
+        self.stored[(start, end)] = text
+        if store:
+            await repository.upsert_journal_summary(self.user_id, start.isoformat(), end.isoformat(), text)
+        return text
+
+
+async def _fill_missing_leaves(user_id: str, start: date, end: date, stored: Dict[Span, str]) -> int:
+    """Summarize, in parallel, journal days in the range that have no daily summary yet."""
+    days = await repository.journal_days_between(user_id, start.isoformat(), end.isoformat())
+    missing = [d for d in days if (date.fromisoformat(d), date.fromisoformat(d)) not in stored]
+    if not missing:
+        return 0
+    journals = await repository.journals_on(user_id, missing)
+    semaphore = asyncio.Semaphore(JOURNAL_SUMMARY_CONCURRENCY)
+
+    async def leaf(entry: dict) -> None:
+        async with semaphore:
+            text = await summarize_journal_entry(entry["content"], user_id)
+        day = entry["journal_date"]
+        await repository.upsert_journal_summary(user_id, day, day, text)
+        stored[(date.fromisoformat(day), date.fromisoformat(day))] = text
+
+    await asyncio.gather(*(leaf(j) for j in journals if j.get("content")))
+    return len(journals)
+
+
+async def create_journal_summary(user_id: str, payload: JournalSummaryCreate) -> dict:
+    """Summarize journals for a date range from the stored daily summaries, persist, and return the record."""
+    start, end = payload.start_date, payload.end_date
+    rows = await repository.journal_summaries_between(user_id, start.isoformat(), end.isoformat())
+    stored: Dict[Span, str] = {
+        (date.fromisoformat(r["start_date"]), date.fromisoformat(r["end_date"])): r["summary_text"]
+        for r in rows
+        if not r.get("stale")
+    }
+
+    leaves = await _fill_missing_leaves(user_id, start, end, stored)
+    summarizer = _RangeSummarizer(user_id, stored)
+    # The requested range itself is written below so its record can be returned.
+    text = await summarizer.summarize(start, end, store=False)
+    logger.info(
+        f"Journal summary {start}..{end} for user {user_id}: "
+        f"{leaves} new daily summaries, {summarizer.reduced} spans reduced"
+    )
+
+    record = await repository.upsert_journal_summary(
+        user_id, start.isoformat(), end.isoformat(), text or "No journal entries in this period."
     )
-    return insert_resp.data[0]
+    invalidate_user_context(user_id)
+    return record
 
 async def get_journal_summary(user_id: str, start_date: date, end_date: date) -> Optional[dict]:
     """Retrieve a single journal summary for a given user and date range."""
-    resp = (
-        supabase.table("JournalSummaries")
-                 .select("*")
-                 .eq("user_id", user_id)
-                 .eq("start_date", start_date.isoformat())
-                 .eq("end_date", end_date.isoformat())
-                 .single()
-                 .execute()
-    )
-    return resp.data
+    return await repository.get_journal_summary(user_id, start_date.isoformat(), end_date.isoformat())
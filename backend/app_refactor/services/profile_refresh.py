@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_REFRESH_DEBOUNCE_SECONDS = float(os.getenv("PROFILE_REFRESH_DEBOUNCE_SECONDS", "60"))
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class _UserRefreshState:
+    __slots__ = (
+        "task", "rerun", "status", "requests", "coalesced", "runs",
+        "requested_at", "last_started_at", "last_finished_at", "last_duration_ms", "last_error",
+    )
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.rerun = False
+        self.status = "idle"
+        self.requests = 0
+        self.coalesced = 0
+        self.runs = 0
+        self.requested_at: Optional[str] = None
+        self.last_started_at: Optional[str] = None
+        self.last_finished_at: Optional[str] = None
+        self.last_duration_ms: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+
+class ProfileRefreshScheduler:
+    """Runs profile regeneration in the background, debounced per user.
+
+    The first request for a user starts a timer; every request that arrives
+    before it fires is folded into the same run. Requests made while a run is
+    in progress queue exactly one follow-up run, one window later. A burst of
+    session creations or journal saves therefore costs at most one
+    regeneration per debounce window.
+    """
+
+    def __init__(
+        self,
+        regenerate: Callable[[str], Awaitable[object]],
+        debounce_seconds: float = PROFILE_REFRESH_DEBOUNCE_SECONDS,
+    ):
+        self.regenerate = regenerate
+        self.debounce_seconds = debounce_seconds
+        self._users: Dict[str, _UserRefreshState] = {}
+
+    def schedule(self, user_id: str) -> None:
+        state = self._users.setdefault(user_id, _UserRefreshState())
+        state.requests += 1
+        state.requested_at = _now_iso()
+
+        if state.task is not None and not state.task.done():
+            state.coalesced += 1
+            if state.status == "running":
+                state.rerun = True
+            return
+
+        state.status = "pending"
+        state.task = asyncio.create_task(self._run(user_id, state))
+
+    async def _run(self, user_id: str, state: _UserRefreshState) -> None:
+        while True:
+            await asyncio.sleep(self.debounce_seconds)
+            state.status = "running"
+            state.rerun = False
+            state.last_started_at = _now_iso()
+            started = time.perf_counter()
+            try:
+                await self.regenerate(user_id)
+                state.last_error = None
+            except Exception as e:
+                logger.exception("Background profile refresh failed for user %s: %s", user_id, e)
+                state.last_error = str(e)
+            finally:
+                state.runs += 1
+                state.last_duration_ms = round((time.perf_counter() - started) * 1000, 1)
+                state.last_finished_at = _now_iso()
+
+            if not state.rerun:
+                state.status = "idle"
+                return
+            state.status = "pending"
+
+    def status(self, user_id: str) -> dict:
+        state = self._users.get(user_id) or _UserRefreshState()
+        return {
+            "status": state.status,
+            "debounce_seconds": self.debounce_seconds,
+            "requests": state.requests,
+            "coalesced": state.coalesced,
+            "runs": state.runs,
+            "requested_at": state.requested_at,
+            "last_started_at": state.last_started_at,
+            "last_finished_at": state.last_finished_at,
+            "last_duration_ms": state.last_duration_ms,
+            "last_error": state.last_error,
+        }
+
+    async def shutdown(self) -> None:
+        """Cancel pending (not yet started) refreshes; let running ones finish."""
+        tasks = []
+        for state in self._users.values():
+            if state.task is not None and not state.task.done():
+                if state.status == "pending":
+                    state.task.cancel()
+                tasks.append(state.task)
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -1,34 +1,23 @@
-import os
 import logging
 import json
-from openai import OpenAI
-from ..db import supabase
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from ..llm import complete_text
+from ..llm_router import model_router
+from ..llm_scheduler import Priority
+from ..repository import repository
+from .context_service import invalidate_user_context
 
 logger = logging.getLogger(__name__)
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 async def _generate_profile_for_user(user_id: str) -> str:
     """Helper: generate a JSON-formatted profile string from chat and journal summaries."""
     # 1) fetch up to 5 most recent chat summaries
-    chat_rows = (
-        supabase.table("ChatSummaries")
-                .select("summary_text")
-                .eq("user_id", user_id)
-                .order("inserted_at", ascending=False)
-                .limit(5)
-                .execute()
-    ).data or []
+    chat_rows = await repository.latest_chat_summaries(user_id, limit=5)
     chat_texts = [r["summary_text"] for r in chat_rows]
 
     # 2) fetch up to 5 most recent journal summaries
-    journal_rows = (
-        supabase.table("JournalSummaries")
-                .select("summary_text")
-                .eq("user_id", user_id)
-                .order("inserted_at", ascending=False)
-                .limit(5)
-                .execute()
-    ).data or []
+    journal_rows = await repository.recent_journal_summaries(user_id, limit=5)
     journal_texts = [r["summary_text"] for r in journal_rows]
 
     # 3) build prompt
@@ -42,47 +31,132 @@ async def _generate_profile_for_user(user_id: str) -> str:
         "\n\nJournalSummaries:\n" + "\n".join(f"- {t}" for t in journal_texts)
     )
 
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
+    return await complete_text(
+        cache="profile_generate",
+        validate=lambda text: parse_profile(text) is not None,
+        route="profile",
+        priority=Priority.BACKGROUND,
+        user=user_id,
         messages=[
             {"role": "system", "content": "You are an empathetic summarizer."},
             {"role": "user", "content": prompt}
         ],
         max_tokens=800
     )
-    return resp.choices[0].message.content
 
 async def get_or_generate_profile(user_id: str) -> dict:
     """Fetch existing profile; if none exists, generate on-the-fly and upsert."""
     # Try to fetch existing profile
-    res = (
-        supabase.table("UserProfiles")
-                .select("*")
-                .eq("user_id", user_id)
-                .single()
-                .execute()
-    )
-    if res.data:
-        return res.data
+    profile = await repository.get_user_profile(user_id)
+    if profile:
+        return profile
+
+    # Generate on-the-fly, upsert and return
+    return await regenerate_profile(user_id)
 
-    # Generate on-the-fly
+async def regenerate_profile(user_id: str) -> dict:
+    """Rebuild the profile from the latest summaries and upsert it."""
     raw = await _generate_profile_for_user(user_id)
     try:
         profile_data = json.loads(raw)
     except Exception as e:
-        logger.error(f"Error parsing profile JSON for user {user_id}: {e}")
+        logger.error("Error parsing profile JSON for user %s: %s", user_id, e)
         raise
-
-    # Upsert and return
     return await upsert_profile(user_id, profile_data)
 
 async def upsert_profile(user_id: str, profile_data: dict) -> dict:
     """Upsert the user profile data and return the record."""
-    res = (
-        supabase.table("UserProfiles")
-                .upsert([{"user_id": user_id, "profile_data": profile_data}], on_conflict=["user_id"])
-                .select("*")
-                .single()
-                .execute()
+    record = await repository.upsert_user_profile(user_id, profile_data)
+    invalidate_user_context(user_id)
+    return record
+
+
+def enforce_profile_schema(data: dict) -> dict:
+    if not isinstance(data, dict):
+        data = {}
+
+    def ensure_dict(d):
+        return d if isinstance(d, dict) else {}
+
+    def ensure_list_of_dicts(l):
+        return l if isinstance(l, list) and all(isinstance(i, dict) for i in l) else []
+
+    return {
+        "name": data.get("name", "Unnamed"),
+        "ratings": ensure_list_of_dicts(data.get("ratings", [])),
+        "metadata": ensure_dict(data.get("metadata", {})),
+        "strengths": ensure_dict(data.get("strengths", {})),
+        "weaknesses": ensure_dict(data.get("weaknesses", {})),
+        "goals": ensure_dict(data.get("goals", {})),
+        "personality": ensure_dict(data.get("personality", {})),
+        "preferences": ensure_dict(data.get("preferences", {})),
+        "notes": data.get("notes", "This is a default placeholder profile.")
+    }
+
+
+async def profile_update_request(user_id: str) -> dict:
+    """chat.completions kwargs that update a profile from the last week of activity."""
+    # 1. Get existing profile (if any)
+    old_profile_row = await repository.get_user_profile(user_id)
+    old_profile = old_profile_row["profile_data"] if old_profile_row else {}
+
+    # 2. Get past 7 days of journals
+    today = datetime.now(timezone.utc).date()
+    past_journals = await repository.list_journals(user_id, (today - timedelta(days=7)).isoformat())
+
+    # 3. Get summaries of last 2 chat sessions
+    chat_summaries = await repository.latest_chat_summaries(user_id, limit=2)
+    summary_texts = "\n".join([c["summary_text"] for c in chat_summaries])
+
+    # 4. Prepare prompt for OpenAI
+    journal_texts = "\n".join([f"- {j['content']}" for j in past_journals])
+    prompt = (
+        "You are an AI profile summarizer for a therapist assistant application.\n"
+        "Based on the user's prior profile, recent journal entries, and last two chat summaries, "
+        "update the user's self-assessment, strengths, weaknesses, and metadata. KEEP it the same format as the prior profile!!\n\n"
+        f"Prior profile:\n{json.dumps(old_profile)}\n\n"
+        f"Recent journals:\n{journal_texts}\n\n"
+        f"Chat summaries:\n{summary_texts}"
+    )
+
+    return dict(
+        model=model_router.default_model("profile"),
+        messages=[
+            {
+                "role": "system",
+                "content": (
+                    "You are an AI profile summarizer for a therapist assistant application.\n"
+                    "You are given a user's profile, recent journal entries, and last two chat summaries.\n"
+                    "You are to update the user's profile based on the new information.\n"
+                    "Output must be valid JSON with this exact top-level structure: {\n"
+                    "    'name': str,\n    'ratings': List[{'category': str, 'description': str}],\n"
+                    "    'metadata': {'format': str, 'source': str, 'version': str, 'created_at': str},\n    'strengths': Dict[str, str],\n    'weaknesses': Dict[str, str]\n}. Do NOT omit or rename any keys. Fill with empty lists/dicts if needed. This structure must not change.\n"
+                    "If a section hasn't changed, still include it.\n"
+                    "Focus on the user's goals, personality, preferences, and notes.\n"
+                    "Output only valid JSON."
+                )
+            },
+            {"role": "user", "content": prompt}
+        ],
+        max_tokens=1000
+    )
+
+def parse_profile(ai_resp: str) -> Optional[dict]:
+    """Schema-enforced profile from the model's reply, or None if it isn't JSON."""
+    try:
+        return enforce_profile_schema(json.loads(ai_resp))
+    except json.JSONDecodeError:
+        return None
+
+async def update_profile(user_id: str) -> Optional[dict]:
+    """Regenerate the profile from recent activity; skipped if the model returns invalid JSON."""
+    ai_resp = await complete_text(
+        cache="profile_update", validate=lambda text: parse_profile(text) is not None,
+        route="profile", priority=Priority.BACKGROUND, user=user_id,
+        **await profile_update_request(user_id),
     )
-    return res.data
+    new_profile = parse_profile(ai_resp)
+    if new_profile is None:
+        logger.warning("AI response was not valid JSON. Skipping profile update.")
+        return None
+    return await upsert_profile(user_id, new_profile)
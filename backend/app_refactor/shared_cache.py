@@ -0,0 +1,224 @@
+"""Host-wide cache tier shared by the worker processes of one server.
+
+With several workers each process would otherwise verify the same tokens
+and assemble the same context bundles on its own. This tier is a SQLite
+database on ``/dev/shm`` (a RAM-backed file, so no disk I/O; WAL mode lets
+every worker read while one writes) that ``TTLCache`` consults behind its
+in-process LRU. ``serve.py`` creates a fresh file per server start and hands
+its path to the workers in ``SHARED_CACHE_PATH``; when that is unset (a
+plain single-process ``uvicorn app:app``) the tier is off and nothing
+changes.
+
+Lookups are a primary-key read on a memory-backed file (tens of
+microseconds), so they run inline rather than through a thread. Any SQLite
+error is logged and treated as a miss: the cache must never fail a request.
+
+    SHARED_CACHE_PATH           database file; unset disables the tier
+    SHARED_CACHE_MAX_ENTRIES    rows kept before the soonest-to-expire are evicted
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH")
+SHARED_CACHE_MAX_ENTRIES = int(os.getenv("SHARED_CACHE_MAX_ENTRIES", "200000"))
+# Turns a cached value into JSON-able data and back
+Codec = Callable[[Any], Any]
+
+# Expired rows are swept, and the size cap enforced, once per this many writes
+_SWEEP_EVERY = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    ns TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL NOT NULL,
+    PRIMARY KEY (ns, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_expires_at ON entries (expires_at);
+CREATE TABLE IF NOT EXISTS counters (
+    ns TEXT NOT NULL, key TEXT NOT NULL, value INTEGER NOT NULL,
+    PRIMARY KEY (ns, key)
+) WITHOUT ROWID;
+"""
+
+
+def default_path() -> str:
+    """A new file in shared memory (or the temp dir where there is none) for one server run."""
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else os.getenv("TMPDIR", "/tmp")
+    return os.path.join(base, f"aitherapist-cache-{os.getpid()}.sqlite3")
+
+
+class SharedCache:
+    """Namespaced key/value entries with expiry, plus atomic counters, in one SQLite file."""
+
+    def __init__(self, path: str, max_entries: int = SHARED_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._writes = 0
+        self.counts = {"hits": 0, "misses": 0, "sets": 0, "errors": 0}
+
+    def _db(self) -> sqlite3.Connection:
+        # One connection per process; never reuse one inherited across a fork
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # A cache in RAM: losing the last writes in a power cut costs nothing
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.executescript(SCHEMA)
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def _guard(self, op: str, fn: Callable[[sqlite3.Connection], Any], default: Any = None) -> Any:
+        try:
+            with self._lock:
+                return fn(self._db())
+        except sqlite3.Error as e:
+            self.counts["errors"] += 1
+            logger.warning("Shared cache %s failed: %s", op, e)
+            return default
+
+    def get(self, ns: str, key: str) -> Optional[tuple]:
+        """(value, expires_at) for a live entry, else None."""
+        row = self._guard("read", lambda db: db.execute(
+            "SELECT value, expires_at FROM entries WHERE ns = ? AND key = ? AND expires_at > ?",
+            (ns, key, time.time()),
+        ).fetchone())
+        self.counts["hits" if row else "misses"] += 1
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def set(self, ns: str, key: str, value: Any, ttl: float) -> None:
+        payload = json.dumps(value, separators=(",", ":"), default=str)
+        self._guard("write", lambda db: db.execute(
+            "INSERT OR REPLACE INTO entries (ns, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (ns, key, payload, time.time() + ttl),
+        ))
+        self.counts["sets"] += 1
+        self._after_write()
+
+    def add(self, ns: str, key: str, value: Any, ttl: float) -> bool:
+        """Insert only if there is no live entry; returns whether this call created it."""
+        payload = json.dumps(value, separators=(",", ":"), default=str)
+        now = time.time()
+
+        def _add(db: sqlite3.Connection) -> bool:
+            db.execute("DELETE FROM entries WHERE ns = ? AND key = ? AND expires_at <= ?", (ns, key, now))
+            return db.execute(
+                "INSERT OR IGNORE INTO entries (ns, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (ns, key, payload, now + ttl),
+            ).rowcount == 1
+
+        added = self._guard("write", _add, default=False)
+        self._after_write()
+        return added
+
+    def delete(self, ns: str, key: str) -> None:
+        self._guard("delete", lambda db: db.execute("DELETE FROM entries WHERE ns = ? AND key = ?", (ns, key)))
+
+    def incr(self, ns: str, key: str) -> int:
+        return self._guard("write", lambda db: db.execute(
+            "INSERT INTO counters (ns, key, value) VALUES (?, ?, 1)"
+            " ON CONFLICT (ns, key) DO UPDATE SET value = value + 1 RETURNING value",
+            (ns, key),
+        ).fetchone()[0], default=0)
+
+    def counter(self, ns: str, key: str) -> int:
+        row = self._guard("read", lambda db: db.execute(
+            "SELECT value FROM counters WHERE ns = ? AND key = ?", (ns, key)
+        ).fetchone())
+        return row[0] if row else 0
+
+    def _after_write(self) -> None:
+        self._writes += 1
+        if self._writes % _SWEEP_EVERY:
+            return
+
+        def _sweep(db: sqlite3.Connection) -> None:
+            db.execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),))
+            excess = db.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_entries
+            if excess > 0:
+                db.execute(
+                    "DELETE FROM entries WHERE (ns, key) IN"
+                    " (SELECT ns, key FROM entries ORDER BY expires_at LIMIT ?)",
+                    (excess,),
+                )
+
+        self._guard("sweep", _sweep)
+
+    def namespace_stats(self, ns: str) -> dict:
+        """Live entries of one namespace and the bytes their JSON values take."""
+        row = self._guard("stats", lambda db: db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM entries WHERE ns = ? AND expires_at > ?",
+            (ns, time.time()),
+        ).fetchone())
+        entries, size = row or (0, 0)
+        return {"entries": entries, "bytes": size}
+
+    def namespace(self, ns: str, encode: Optional[Codec] = None, decode: Optional[Codec] = None) -> "SharedNamespace":
+        return SharedNamespace(self, ns, encode, decode)
+
+    def stats(self) -> dict:
+        size = self._guard("stats", lambda db: db.execute("SELECT COUNT(*) FROM entries").fetchone()[0])
+        # counts are this worker's own; entries are the host's
+        return {"path": self.path, "pid": os.getpid(), "entries": size, **self.counts}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class SharedNamespace:
+    """One cache's view of the shared tier, with an optional codec for non-JSON values."""
+
+    def __init__(self, cache: SharedCache, ns: str, encode: Optional[Codec] = None, decode: Optional[Codec] = None):
+        self.cache = cache
+        self.ns = ns
+        self.encode = encode or (lambda v: v)
+        self.decode = decode or (lambda v: v)
+
+    def get(self, key: str) -> Optional[tuple]:
+        """(value, seconds left) for a live entry, else None."""
+        found = self.cache.get(self.ns, str(key))
+        if found is None:
+            return None
+        value, expires_at = found
+        return self.decode(value), expires_at - time.time()
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        self.cache.set(self.ns, str(key), self.encode(value), ttl)
+
+    def add(self, key: str, value: Any, ttl: float) -> bool:
+        return self.cache.add(self.ns, str(key), self.encode(value), ttl)
+
+    def delete(self, key: str) -> None:
+        self.cache.delete(self.ns, str(key))
+
+    def incr(self, key: str) -> int:
+        return self.cache.incr(self.ns, str(key))
+
+    def counter(self, key: str) -> int:
+        return self.cache.counter(self.ns, str(key))
+
+    def stats(self) -> dict:
+        return self.cache.namespace_stats(self.ns)
+
+
+shared_cache: Optional[SharedCache] = SharedCache(SHARED_CACHE_PATH) if SHARED_CACHE_PATH else None
+
+
+def shared_namespace(ns: str, encode: Optional[Codec] = None, decode: Optional[Codec] = None) -> Optional[SharedNamespace]:
+    """The shared tier for ``ns``, or None when this process runs without one."""
+    return shared_cache.namespace(ns, encode, decode) if shared_cache is not None else None
+
+
+def shared_cache_stats() -> Dict[str, Any]:
+    return shared_cache.stats() if shared_cache is not None else {"enabled": False}
@@ -0,0 +1,506 @@
+"""Embedded SQLite storage for single-node and self-hosted deployments.
+
+Select it with ``STORAGE_BACKEND=sqlite``; the database lives at
+``SQLITE_DB_PATH``. It implements the same calls as ``SupabaseRepository``
+over the same eight tables and row shapes, so routes and services run
+unchanged. Authentication still goes through Supabase Auth (or any GoTrue
+server issuing tokens signed with ``SUPABASE_JWT_SECRET``).
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, List, Optional, Sequence, Tuple
+
+from .pagination import Cursor, PageParams, finish_page
+from .repository import Repository
+
+SQLITE_DB_PATH = os.getenv("SQLITE_DB_PATH", ".aitherapist.sqlite3")
+
+# Indexes follow the routes' access paths: everything is per user (or per
+# session) and read newest/oldest first by a timestamp with the id as tie-breaker.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS Users (
+    user_id TEXT PRIMARY KEY,
+    email TEXT,
+    created_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS ChatHistory (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chat_history_user_created ON ChatHistory (user_id, created_at, id);
+
+CREATE TABLE IF NOT EXISTS Journals (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    journal_date TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    UNIQUE (user_id, journal_date)
+);
+
+CREATE TABLE IF NOT EXISTS JournalSummaries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    summary_text TEXT NOT NULL,
+    inserted_at TEXT NOT NULL,
+    stale INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (user_id, start_date, end_date)
+);
+CREATE INDEX IF NOT EXISTS journal_summaries_user_inserted ON JournalSummaries (user_id, inserted_at);
+CREATE INDEX IF NOT EXISTS journal_summaries_user_end ON JournalSummaries (user_id, end_date);
+
+CREATE TABLE IF NOT EXISTS ChatSessions (
+    session_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    notes TEXT
+);
+CREATE INDEX IF NOT EXISTS chat_sessions_user_created ON ChatSessions (user_id, created_at, session_id);
+
+CREATE TABLE IF NOT EXISTS ChatMessages (
+    chat_id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chat_messages_session_created ON ChatMessages (session_id, created_at, chat_id);
+
+CREATE TABLE IF NOT EXISTS ChatSummaries (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    summary_text TEXT NOT NULL,
+    inserted_at TEXT NOT NULL,
+    last_message_at TEXT,
+    last_message_id TEXT
+);
+CREATE INDEX IF NOT EXISTS chat_summaries_user_inserted ON ChatSummaries (user_id, inserted_at, id);
+CREATE INDEX IF NOT EXISTS chat_summaries_session_inserted ON ChatSummaries (session_id, inserted_at);
+CREATE UNIQUE INDEX IF NOT EXISTS chat_summaries_session_watermark ON ChatSummaries (session_id, last_message_id);
+-- Newest summary of each session; the incremental folds it superseded stay in the table
+CREATE VIEW IF NOT EXISTS LatestChatSummaries AS
+    SELECT * FROM ChatSummaries c WHERE NOT EXISTS (
+        SELECT 1 FROM ChatSummaries n WHERE n.session_id = c.session_id
+        AND (n.inserted_at > c.inserted_at OR (n.inserted_at = c.inserted_at AND n.id > c.id))
+    );
+
+CREATE TABLE IF NOT EXISTS UserProfiles (
+    user_id TEXT PRIMARY KEY,
+    profile_data TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+"""
+
+
+def _utcnow() -> str:
+    # Fixed-width timestamps so text comparison and ORDER BY match time order
+    return datetime.now(timezone.utc).isoformat(timespec="microseconds")
+
+
+def _placeholders(n: int) -> str:
+    return ", ".join("?" * n)
+
+
+def _upgrade(conn: sqlite3.Connection) -> None:
+    """Columns added after a database file may have been created."""
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(JournalSummaries)")}
+    if "stale" not in columns:
+        conn.execute("ALTER TABLE JournalSummaries ADD COLUMN stale INTEGER NOT NULL DEFAULT 0")
+
+
+class SQLiteRepository(Repository):
+    """``SupabaseRepository`` over an embedded SQLite file in WAL mode.
+
+    One connection serves the process; statements run on a worker thread
+    under a lock so the event loop never waits on disk.
+    """
+    name = "sqlite"
+
+    def __init__(self, path: str = SQLITE_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.path != ":memory:":
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.executescript(SCHEMA)
+            _upgrade(conn)
+            self._conn = conn
+        return self._conn
+
+    def _run(self, sql: str, args: Sequence[Any] = (), many: bool = False) -> List[dict]:
+        with self._lock:
+            db = self._db()
+            if many:
+                rows = []
+                db.execute("BEGIN")
+                try:
+                    for row_args in args:
+                        rows.extend(dict(r) for r in db.execute(sql, row_args).fetchall())
+                    db.execute("COMMIT")
+                except BaseException:
+                    db.execute("ROLLBACK")
+                    raise
+                return rows
+            return [dict(r) for r in db.execute(sql, args).fetchall()]
+
+    async def _query(self, sql: str, *args: Any) -> List[dict]:
+        return await asyncio.to_thread(self._run, sql, args)
+
+    async def _query_many(self, sql: str, rows: Sequence[Sequence[Any]]) -> List[dict]:
+        """Run ``sql`` once per argument tuple in a single transaction."""
+        return await asyncio.to_thread(self._run, sql, rows, True)
+
+    async def _one(self, sql: str, *args: Any) -> Optional[dict]:
+        rows = await self._query(sql, *args)
+        return rows[0] if rows else None
+
+    async def _keyset_page(
+        self,
+        table: str,
+        columns: str,
+        where: str,
+        args: Tuple[Any, ...],
+        params: PageParams,
+        ts_col: str,
+        id_col: str,
+        newest_first: bool,
+    ) -> Tuple[List[dict], Optional[str]]:
+        """One keyset page ordered by (ts_col, id_col); see ``SupabaseRepository._keyset_page``."""
+        cursor: Optional[Cursor] = params.after or params.before
+        desc = params.after is None
+        if cursor is not None:
+            op = "<" if desc else ">"
+            where += f" AND ({ts_col} {op} ? OR ({ts_col} = ? AND {id_col} {op} ?))"
+            args += (cursor.ts, cursor.ts, cursor.id)
+        direction = "DESC" if desc else "ASC"
+        rows = await self._query(
+            f"SELECT {columns} FROM {table} WHERE {where}"
+            f" ORDER BY {ts_col} {direction}, {id_col} {direction} LIMIT ?",
+            *args, params.limit + 1,
+        )
+        return finish_page(rows, params, ts_col, id_col, newest_first)
+
+    async def warm(self) -> None:
+        # Opens the file and applies the schema, off the event loop
+        def _open():
+            with self._lock:
+                self._db()
+        await asyncio.to_thread(_open)
+
+    async def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # ─── Users ───────────────────────────────────────────────────────────
+    async def create_user(self, user_id: str, email: str) -> Optional[dict]:
+        return await self._one(
+            "INSERT INTO Users (user_id, email, created_at) VALUES (?, ?, ?) RETURNING *",
+            user_id, email, _utcnow(),
+        )
+
+    async def list_user_ids(self, batch_size: int = 1000) -> List[str]:
+        rows = await self._query("SELECT user_id FROM Users ORDER BY user_id")
+        return [row["user_id"] for row in rows]
+
+    # ─── ChatHistory ─────────────────────────────────────────────────────
+    async def list_chat_history(self, user_id: str, page: PageParams) -> Tuple[List[dict], Optional[str]]:
+        return await self._keyset_page(
+            "ChatHistory", "*", "user_id = ?", (user_id,), page, "created_at", "id", newest_first=False
+        )
+
+    async def recent_chat_history(self, user_id: str, limit: int = 10) -> List[dict]:
+        rows = await self._query(
+            "SELECT * FROM ChatHistory WHERE user_id = ? ORDER BY created_at DESC LIMIT ?", user_id, limit
+        )
+        return list(reversed(rows))
+
+    async def insert_chat_history(self, rows: List[dict]) -> List[dict]:
+        return await self._query_many(
+            "INSERT INTO ChatHistory (user_id, role, content, created_at) VALUES (?, ?, ?, ?) RETURNING *",
+            [(r["user_id"], r["role"], r["content"], r.get("created_at") or _utcnow()) for r in rows],
+        )
+
+    # ─── Journals ────────────────────────────────────────────────────────
+    async def upsert_journal(self, user_id: str, journal_date: str, content: str) -> Optional[dict]:
+        return await self._one(
+            "INSERT INTO Journals (user_id, journal_date, content, created_at) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT (user_id, journal_date) DO UPDATE SET content = excluded.content RETURNING *",
+            user_id, journal_date, content, _utcnow(),
+        )
+
+    async def list_journal_dates(self, user_id: str) -> List[str]:
+        rows = await self._query("SELECT created_at FROM Journals WHERE user_id = ?", user_id)
+        return [row["created_at"] for row in rows]
+
+    async def list_journals(
+        self,
+        user_id: str,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+    ) -> List[dict]:
+        sql, args = "SELECT content, journal_date FROM Journals WHERE user_id = ?", [user_id]
+        if start_date:
+            sql += " AND journal_date >= ?"
+            args.append(start_date)
+        if end_date:
+            sql += " AND journal_date <= ?"
+            args.append(end_date)
+        return await self._query(sql + " ORDER BY journal_date", *args)
+
+    async def journal_days_between(self, user_id: str, start_date: str, end_date: str) -> List[str]:
+        rows = await self._query(
+            "SELECT journal_date FROM Journals WHERE user_id = ? AND journal_date BETWEEN ? AND ?"
+            " ORDER BY journal_date",
+            user_id, start_date, end_date,
+        )
+        return [row["journal_date"] for row in rows]
+
+    async def journals_on(self, user_id: str, days: List[str]) -> List[dict]:
+        if not days:
+            return []
+        return await self._query(
+            f"SELECT content, journal_date FROM Journals WHERE user_id = ?"
+            f" AND journal_date IN ({_placeholders(len(days))})",
+            user_id, *days,
+        )
+
+    # ─── JournalSummaries ────────────────────────────────────────────────
+    _UPSERT_JOURNAL_SUMMARY = (
+        "INSERT INTO JournalSummaries (user_id, start_date, end_date, summary_text, inserted_at)"
+        " VALUES (?, ?, ?, ?, ?)"
+        " ON CONFLICT (user_id, start_date, end_date) DO UPDATE SET summary_text = excluded.summary_text, stale = 0"
+        " RETURNING *"
+    )
+
+    async def upsert_journal_summary(
+        self, user_id: str, start_date: str, end_date: str, summary_text: str
+    ) -> Optional[dict]:
+        return await self._one(self._UPSERT_JOURNAL_SUMMARY, user_id, start_date, end_date, summary_text, _utcnow())
+
+    async def insert_journal_summary(
+        self, user_id: str, start_date: str, end_date: str, summary_text: str
+    ) -> Optional[dict]:
+        return await self._one(
+            "INSERT INTO JournalSummaries (user_id, start_date, end_date, summary_text, inserted_at)"
+            " VALUES (?, ?, ?, ?, ?) RETURNING *",
+            user_id, start_date, end_date, summary_text, _utcnow(),
+        )
+
+    async def get_journal_summary(self, user_id: str, start_date: str, end_date: str) -> Optional[dict]:
+        return await self._one(
+            "SELECT * FROM JournalSummaries WHERE user_id = ? AND start_date = ? AND end_date = ? LIMIT 1",
+            user_id, start_date, end_date,
+        )
+
+    async def journal_summaries_between(
+        self, user_id: str, start_date: str, end_date: str, daily_only: bool = False
+    ) -> List[dict]:
+        return await self._query(
+            "SELECT start_date, end_date, summary_text, stale FROM JournalSummaries"
+            " WHERE user_id = ? AND start_date >= ? AND end_date <= ?"
+            + (" AND start_date = end_date" if daily_only else "")
+            + " ORDER BY start_date DESC",
+            user_id, start_date, end_date,
+        )
+
+    async def upsert_journal_summaries(self, rows: List[dict]) -> int:
+        if not rows:
+            return 0
+        now = _utcnow()
+        return len(await self._query_many(self._UPSERT_JOURNAL_SUMMARY, [
+            (r["user_id"], r["start_date"], r["end_date"], r["summary_text"], now) for r in rows
+        ]))
+
+    async def mark_journal_summaries_stale(self, user_id: str, day: str) -> None:
+        await self._query(
+            "UPDATE JournalSummaries SET stale = 1 WHERE user_id = ? AND start_date <= ? AND end_date >= ?"
+            " AND (start_date < ? OR end_date > ?)",
+            user_id, day, day, day, day,
+        )
+
+    async def recent_journal_summaries(self, user_id: str, limit: int = 5) -> List[dict]:
+        return await self._query(
+            "SELECT summary_text FROM JournalSummaries WHERE user_id = ? ORDER BY inserted_at DESC LIMIT ?",
+            user_id, limit,
+        )
+
+    # ─── ChatSessions ────────────────────────────────────────────────────
+    async def list_chat_sessions(self, user_id: str, page: PageParams) -> Tuple[List[dict], Optional[str]]:
+        return await self._keyset_page(
+            "ChatSessions", "session_id, created_at, notes", "user_id = ?", (user_id,),
+            page, "created_at", "session_id", newest_first=True,
+        )
+
+    async def list_session_ids(self, user_id: str) -> List[str]:
+        rows = await self._query(
+            "SELECT session_id FROM ChatSessions WHERE user_id = ? ORDER BY created_at", user_id
+        )
+        return [row["session_id"] for row in rows]
+
+    async def create_chat_session(self, user_id: str) -> Optional[dict]:
+        return await self._one(
+            "INSERT INTO ChatSessions (session_id, user_id, created_at) VALUES (?, ?, ?) RETURNING *",
+            str(uuid.uuid4()), user_id, _utcnow(),
+        )
+
+    async def get_chat_session(self, session_id: str) -> Optional[dict]:
+        return await self._one(
+            "SELECT session_id, user_id FROM ChatSessions WHERE session_id = ? LIMIT 1", session_id
+        )
+
+    async def session_belongs_to(self, session_id: str, user_id: str) -> bool:
+        row = await self._one(
+            "SELECT 1 FROM ChatSessions WHERE session_id = ? AND user_id = ? LIMIT 1", session_id, user_id
+        )
+        return row is not None
+
+    # ─── ChatMessages ────────────────────────────────────────────────────
+    async def list_session_messages(self, session_id: str, page: PageParams) -> Tuple[List[dict], Optional[str]]:
+        return await self._keyset_page(
+            "ChatMessages", "*", "session_id = ?", (session_id,), page, "created_at", "chat_id", newest_first=False
+        )
+
+    async def session_transcript(self, session_id: str) -> List[dict]:
+        return await self._query(
+            "SELECT role, content FROM ChatMessages WHERE session_id = ? ORDER BY created_at", session_id
+        )
+
+    async def session_messages_after(self, session_id: str, after: Optional[Cursor] = None) -> List[dict]:
+        sql, args = "SELECT chat_id, role, content, created_at FROM ChatMessages WHERE session_id = ?", [session_id]
+        if after is not None:
+            sql += " AND (created_at > ? OR (created_at = ? AND chat_id > ?))"
+            args += [after.ts, after.ts, after.id]
+        return await self._query(sql + " ORDER BY created_at, chat_id", *args)
+
+    async def recent_session_messages(self, session_id: str, limit: int = 10) -> List[dict]:
+        rows = await self._query(
+            "SELECT role, content FROM ChatMessages WHERE session_id = ? ORDER BY created_at DESC LIMIT ?",
+            session_id, limit,
+        )
+        return list(reversed(rows))
+
+    async def insert_chat_message(self, session_id: str, user_id: str, role: str, content: str) -> Optional[dict]:
+        return await self._one(
+            "INSERT INTO ChatMessages (chat_id, session_id, user_id, role, content, created_at)"
+            " VALUES (?, ?, ?, ?, ?, ?) RETURNING *",
+            str(uuid.uuid4()), session_id, user_id, role, content, _utcnow(),
+        )
+
+    async def insert_chat_messages(self, rows: List[dict]) -> int:
+        if not rows:
+            return 0
+        await self._query_many(
+            "INSERT OR IGNORE INTO ChatMessages (chat_id, session_id, user_id, role, content, created_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            [(r["chat_id"], r["session_id"], r["user_id"], r["role"], r["content"], r["created_at"]) for r in rows],
+        )
+        return len(rows)
+
+    # ─── ChatSummaries ───────────────────────────────────────────────────
+    async def insert_chat_summary(
+        self,
+        user_id: str,
+        session_id: str,
+        summary_text: str,
+        last_message_at: Optional[str] = None,
+        last_message_id: Optional[str] = None,
+    ) -> Optional[dict]:
+        if last_message_id is None:
+            last_message_at = None
+        return await self._one(
+            "INSERT INTO ChatSummaries"
+            " (id, user_id, session_id, summary_text, inserted_at, last_message_at, last_message_id)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?) RETURNING *",
+            str(uuid.uuid4()), user_id, session_id, summary_text, _utcnow(), last_message_at, last_message_id,
+        )
+
+    async def upsert_chat_summaries(self, rows: List[dict]) -> int:
+        if not rows:
+            return 0
+        now = _utcnow()
+        return len(await self._query_many(
+            "INSERT INTO ChatSummaries"
+            " (id, user_id, session_id, summary_text, inserted_at, last_message_at, last_message_id)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (session_id, last_message_id) DO UPDATE SET"
+            " summary_text = excluded.summary_text, last_message_at = excluded.last_message_at"
+            " RETURNING id",
+            [(str(uuid.uuid4()), r["user_id"], r["session_id"], r["summary_text"], now,
+              r.get("last_message_at"), r.get("last_message_id")) for r in rows],
+        ))
+
+    async def latest_session_summary(self, session_id: str, user_id: str) -> Optional[dict]:
+        return await self._one(
+            "SELECT * FROM ChatSummaries WHERE session_id = ? AND user_id = ? ORDER BY inserted_at DESC LIMIT 1",
+            session_id, user_id,
+        )
+
+    async def list_chat_summaries(self, user_id: str, page: PageParams) -> Tuple[List[dict], Optional[str]]:
+        return await self._keyset_page(
+            "LatestChatSummaries", "*", "user_id = ?", (user_id,), page, "inserted_at", "id", newest_first=True
+        )
+
+    async def latest_chat_summaries(self, user_id: str, limit: int = 1, since: Optional[str] = None) -> List[dict]:
+        sql, args = "SELECT summary_text, inserted_at FROM ChatSummaries WHERE user_id = ?", [user_id]
+        if since:
+            sql += " AND inserted_at >= ?"
+            args.append(since)
+        return await self._query(sql + " ORDER BY inserted_at DESC LIMIT ?", *args, limit)
+
+    # ─── UserProfiles ────────────────────────────────────────────────────
+    @staticmethod
+    def _profile(row: Optional[dict]) -> Optional[dict]:
+        if row is not None:
+            row["profile_data"] = json.loads(row["profile_data"])
+        return row
+
+    _UPSERT_PROFILE = (
+        "INSERT INTO UserProfiles (user_id, profile_data, updated_at) VALUES (?, ?, ?)"
+        " ON CONFLICT (user_id) DO UPDATE SET profile_data = excluded.profile_data, updated_at = excluded.updated_at"
+        " RETURNING *"
+    )
+
+    async def get_user_profile(self, user_id: str) -> Optional[dict]:
+        return self._profile(await self._one("SELECT * FROM UserProfiles WHERE user_id = ? LIMIT 1", user_id))
+
+    async def insert_user_profile(self, user_id: str, profile_data: dict) -> Optional[dict]:
+        return self._profile(await self._one(
+            "INSERT INTO UserProfiles (user_id, profile_data, updated_at) VALUES (?, ?, ?) RETURNING *",
+            user_id, json.dumps(profile_data), _utcnow(),
+        ))
+
+    async def upsert_user_profiles(self, rows: List[dict]) -> int:
+        if not rows:
+            return 0
+        now = _utcnow()
+        return len(await self._query_many(
+            self._UPSERT_PROFILE, [(r["user_id"], json.dumps(r["profile_data"]), now) for r in rows]
+        ))
+
+    async def upsert_user_profile(self, user_id: str, profile_data: dict) -> Optional[dict]:
+        return self._profile(await self._one(self._UPSERT_PROFILE, user_id, json.dumps(profile_data), _utcnow()))
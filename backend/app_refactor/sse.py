@@ -0,0 +1,21 @@
+import json
+from typing import Any
+
+from fastapi.responses import StreamingResponse
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    # Stop reverse proxies (nginx, Railway's edge) from buffering the stream.
+    "X-Accel-Buffering": "no",
+}
+
+
+def sse_event(event: str, data: Any) -> str:
+    """Format one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def sse_response(events) -> StreamingResponse:
+    """Wrap an async iterator of formatted events in a streaming response."""
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
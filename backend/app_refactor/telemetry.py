@@ -0,0 +1,273 @@
+"""Per-request spans, latency histograms and a Prometheus ``/metrics`` page.
+
+Code marks the slow parts of a request with ``span(kind, name)``: ``auth``,
+``db`` (one per repository call), ``llm`` (per model, with token counts) and
+``serialize``. ``TelemetryMiddleware`` collects the spans of each request,
+feeds every span and the request itself into histograms labelled by route,
+and, with ``SERVER_TIMING=true``, adds a ``Server-Timing`` header so the
+browser's network panel shows where the time went.
+"""
+import bisect
+import contextvars
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from fastapi import Response
+from fastapi.responses import JSONResponse
+
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() in ("1", "true", "yes")
+
+# Seconds; covers sub-millisecond cache hits up to slow streamed LLM replies
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Label for spans that run outside any request, e.g. debounced background work
+BACKGROUND = "background"
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, in Prometheus' shape."""
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self._series: Dict[LabelSet, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # one count per bucket, then +Inf count and the running sum
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {k: list(v) for k, v in self._series.items()}
+        for key, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_labels(key + (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(key)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels(key)} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: Dict[LabelSet, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] += amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = dict(self._values)
+        lines.extend(f"{self.name}{_labels(k)} {v}" for k, v in sorted(snapshot.items()))
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: Dict[LabelSet, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            snapshot = dict(self._values)
+        lines.extend(f"{self.name}{_labels(k)} {v}" for k, v in sorted(snapshot.items()))
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(key: LabelSet) -> str:
+    if not key:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in key) + "}"
+
+
+request_latency = Histogram(
+    "http_request_duration_seconds", "Request latency by route, method and status.")
+span_latency = Histogram(
+    "request_span_duration_seconds", "Time spent in auth, db, llm and serialize spans, by route.")
+llm_tokens = Counter(
+    "llm_tokens_total", "Prompt, completion and cached (prompt tokens served from the prefix cache) tokens by model.")
+llm_first_token = Histogram(
+    "llm_first_token_seconds", "Time to first token (whole reply when not streamed), by model and prompt cache hit or miss.")
+llm_queue_wait = Histogram(
+    "llm_queue_wait_seconds", "Time model calls waited for a scheduler slot, by priority.")
+llm_queue_depth = Gauge("llm_queue_depth", "Model calls waiting for a slot, by priority.")
+llm_concurrency = Gauge("llm_concurrency", "Adaptive limit and calls in flight in the LLM scheduler.")
+llm_scheduler_events = Counter(
+    "llm_scheduler_events_total", "Limit decreases (rate_limited, latency_backoffs) and queue timeouts.")
+llm_router_events = Counter(
+    "llm_router_events_total", "Model router outcomes by model: errors, hedges, wins, losses, hedge_wins, fallbacks.")
+_METRICS = (
+    request_latency, span_latency, llm_tokens, llm_first_token,
+    llm_queue_wait, llm_queue_depth, llm_concurrency, llm_scheduler_events, llm_router_events,
+)
+
+
+# ─── Spans ───────────────────────────────────────────────────────────────
+class Span:
+    __slots__ = ("kind", "name", "start", "duration", "attrs")
+
+    def __init__(self, kind: str, name: str, attrs: dict):
+        self.kind = kind
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.duration = 0.0
+
+
+class RequestTrace:
+    def __init__(self, scope: dict):
+        # The router writes the matched route into this same scope dict
+        self.scope = scope
+        self.start = time.perf_counter()
+        self.spans: List[Span] = []
+        self.finished = False
+
+    @property
+    def route(self) -> str:
+        """Route template (``/api/chat-sessions/{session_id}/messages``) so labels stay bounded."""
+        return getattr(self.scope.get("route"), "path", "unmatched")
+
+
+_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar("request_trace", default=None)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    trace = _trace.get()
+    # Tasks spawned by a request inherit its context but may outlive it
+    return trace if trace is not None and not trace.finished else None
+
+
+@contextmanager
+def span(kind: str, name: str, **attrs) -> Iterator[Span]:
+    """Time a block; attach attributes (e.g. token counts) via the yielded span's ``attrs``."""
+    s = Span(kind, name, attrs)
+    try:
+        yield s
+    finally:
+        s.duration = time.perf_counter() - s.start
+        trace = current_trace()
+        if trace is not None:
+            trace.spans.append(s)
+        span_latency.observe(s.duration, route=trace.route if trace else BACKGROUND, kind=kind, name=name)
+
+
+def record_llm_usage(
+    model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0, first_token: Optional[float] = None
+) -> None:
+    llm_tokens.inc(prompt_tokens, model=model, type="prompt")
+    llm_tokens.inc(completion_tokens, model=model, type="completion")
+    llm_tokens.inc(cached_tokens, model=model, type="cached")
+    if first_token is not None:
+        llm_first_token.observe(first_token, model=model, prompt_cache="hit" if cached_tokens else "miss")
+
+
+# ─── Server-Timing ───────────────────────────────────────────────────────
+def server_timing(trace: RequestTrace) -> str:
+    """Spans merged by kind and name, e.g. ``db.get_user_profile;dur=3.1;desc="2 calls"``."""
+    merged: Dict[str, List[Span]] = {}
+    for s in trace.spans:
+        merged.setdefault(f"{s.kind}.{s.name}", []).append(s)
+    parts = []
+    for key, spans in merged.items():
+        metric = "".join(c if c.isalnum() or c in "-_." else "_" for c in key)
+        part = f"{metric};dur={sum(s.duration for s in spans) * 1000:.1f}"
+        desc = [f"{len(spans)} calls"] if len(spans) > 1 else []
+        desc += [f"{k}={v}" for k, v in spans[-1].attrs.items()]
+        if desc:
+            part += f';desc="{_escape(" ".join(desc))}"'
+        parts.append(part)
+    parts.append(f"app;dur={(time.perf_counter() - trace.start) * 1000:.1f}")
+    return ", ".join(parts)
+
+
+class TelemetryMiddleware:
+    """ASGI middleware that opens a trace per HTTP request and records it on completion.
+
+    Plain ASGI rather than ``BaseHTTPMiddleware`` so streamed responses pass
+    through untouched and the request's context reaches the route. Spans that
+    end after the headers went out (a streamed reply) reach the histograms
+    but not ``Server-Timing``.
+    """
+
+    def __init__(self, app, server_timing: bool = SERVER_TIMING):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        trace = RequestTrace(scope)
+        token = _trace.set(trace)
+        status = "500"
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+                if self.server_timing:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", server_timing(trace).encode("latin-1"))
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            trace.finished = True
+            _trace.reset(token)
+            request_latency.observe(
+                time.perf_counter() - trace.start, route=trace.route, method=scope["method"], status=status
+            )
+
+
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse whose encoding step is recorded as a ``serialize`` span."""
+
+    def render(self, content) -> bytes:
+        with span("serialize", "json"):
+            return super().render(content)
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in _METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def metrics_response() -> Response:
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
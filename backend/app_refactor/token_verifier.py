@@ -0,0 +1,220 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Optional, Union
+
+import httpx
+from dotenv import load_dotenv
+from jose import JWTError, jwt
+from pydantic import BaseModel, Field
+
+from .cache import TTLCache
+from .shared_cache import shared_namespace
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+SUPABASE_JWT_AUDIENCE = os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated")
+# Set to "false" once local verification is configured to keep auth fully offline.
+AUTH_REMOTE_FALLBACK = os.getenv("AUTH_REMOTE_FALLBACK", "true").lower() in ("1", "true", "yes")
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "300"))
+JWKS_CACHE_TTL = float(os.getenv("JWKS_CACHE_TTL", "600"))
+# An unknown kid refetches the JWKS at most this often (seconds)
+JWKS_MIN_REFETCH_INTERVAL = float(os.getenv("JWKS_MIN_REFETCH_INTERVAL", "30"))
+JWT_LEEWAY_SECONDS = int(os.getenv("JWT_LEEWAY_SECONDS", "10"))
+# Algorithms accepted per key source; the token header only picks the source
+SECRET_ALGORITHMS = ("HS256",)
+JWKS_ALGORITHMS = ("RS256", "ES256")
+
+
+class AuthenticatedUser(BaseModel):
+    """The subset of the Supabase user the routes rely on, built from JWT claims."""
+    id: str
+    email: Optional[str] = None
+    role: Optional[str] = None
+    aud: Optional[str] = None
+    session_id: Optional[str] = None
+    app_metadata: dict = Field(default_factory=dict)
+    user_metadata: dict = Field(default_factory=dict)
+
+    @classmethod
+    def from_claims(cls, claims: dict) -> "AuthenticatedUser":
+        return cls(
+            id=claims["sub"],
+            email=claims.get("email"),
+            role=claims.get("role"),
+            aud=claims.get("aud") if isinstance(claims.get("aud"), str) else None,
+            session_id=claims.get("session_id"),
+            app_metadata=claims.get("app_metadata") or {},
+            user_metadata=claims.get("user_metadata") or {},
+        )
+
+
+class TokenVerificationError(Exception):
+    """Raised when a token is invalid, expired, or cannot be verified."""
+
+
+RemoteLookup = Callable[[str], Union[Any, Awaitable[Any]]]
+
+
+class TokenVerifier:
+    """Verifies Supabase access tokens locally and caches the verified users.
+
+    HS256 tokens are checked against the project JWT secret; asymmetric tokens
+    (RS256/ES256) against the project's JWKS, which is fetched once and cached.
+    When neither is possible the caller-supplied remote lookup
+    (``supabase.auth.get_user``) is used, if the fallback is enabled.
+    """
+
+    def __init__(
+        self,
+        jwt_secret: Optional[str] = SUPABASE_JWT_SECRET,
+        supabase_url: Optional[str] = SUPABASE_URL,
+        audience: Optional[str] = SUPABASE_JWT_AUDIENCE,
+        remote_fallback: bool = AUTH_REMOTE_FALLBACK,
+        cache: Optional[TTLCache] = None,
+    ):
+        self.jwt_secret = jwt_secret
+        self.jwks_url = f"{supabase_url.rstrip('/')}/auth/v1/.well-known/jwks.json" if supabase_url else None
+        self.audience = audience
+        self.remote_fallback = remote_fallback
+        # Workers of one server share verified users, so a token is checked once per host
+        self.cache = cache or TTLCache(
+            maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL,
+            shared=shared_namespace(
+                "tokens", encode=lambda u: u.model_dump(), decode=AuthenticatedUser.model_validate
+            ),
+        )
+        self._jwks: dict = {}
+        self._jwks_fetched_at = 0.0
+        self._jwks_attempted_at: Optional[float] = None
+        self._jwks_lock = asyncio.Lock()
+        self.local_verifications = 0
+        self.remote_verifications = 0
+        self.rejections = 0
+
+    @staticmethod
+    def _cache_key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    async def _get_jwk(self, kid: Optional[str]) -> Optional[dict]:
+        if not self.jwks_url:
+            return None
+        key = self._jwks.get(kid)
+        if key is not None and time.monotonic() - self._jwks_fetched_at < JWKS_CACHE_TTL:
+            return key
+        async with self._jwks_lock:
+            # A rotated signing key shows up as an unknown kid. Refetch for one
+            # at most every JWKS_MIN_REFETCH_INTERVAL so a flood of tokens with
+            # made-up kids can't turn into a flood of JWKS requests.
+            now = time.monotonic()
+            stale = now - self._jwks_fetched_at >= JWKS_CACHE_TTL
+            may_refetch = self._jwks_attempted_at is None or now - self._jwks_attempted_at >= JWKS_MIN_REFETCH_INTERVAL
+            if may_refetch and (stale or kid not in self._jwks):
+                self._jwks_attempted_at = now
+                try:
+                    async with httpx.AsyncClient(timeout=5.0) as http:
+                        resp = await http.get(self.jwks_url)
+                        resp.raise_for_status()
+                        keys = resp.json().get("keys", [])
+                    self._jwks = {k.get("kid"): k for k in keys}
+                    self._jwks_fetched_at = time.monotonic()
+                except (httpx.HTTPError, ValueError) as e:
+                    logger.warning("Failed to fetch JWKS from %s: %s", self.jwks_url, e)
+            return self._jwks.get(kid)
+
+    async def _verify_locally(self, token: str) -> Optional[dict]:
+        """Return verified claims, or None when no local key is available."""
+        try:
+            header = jwt.get_unverified_header(token)
+        except JWTError as e:
+            raise TokenVerificationError(f"Malformed token: {e}")
+
+        alg = header.get("alg", "")
+        if alg in SECRET_ALGORITHMS:
+            key, algorithms = self.jwt_secret, SECRET_ALGORITHMS
+        elif alg in JWKS_ALGORITHMS:
+            key = await self._get_jwk(header.get("kid"))
+            # A key that names its algorithm accepts only that one
+            algorithms = (key["alg"],) if key and key.get("alg") in JWKS_ALGORITHMS else JWKS_ALGORITHMS
+        else:
+            raise TokenVerificationError(f"Unsupported token algorithm: {alg!r}")
+        if not key:
+            return None
+
+        try:
+            return jwt.decode(
+                token,
+                key,
+                algorithms=list(algorithms),
+                audience=self.audience,
+                options={"verify_aud": bool(self.audience), "leeway": JWT_LEEWAY_SECONDS},
+            )
+        except JWTError as e:
+            raise TokenVerificationError(str(e))
+
+    async def _verify_remotely(self, token: str, remote_lookup: RemoteLookup) -> AuthenticatedUser:
+        result = remote_lookup(token)
+        if asyncio.iscoroutine(result):
+            result = await result
+        remote_user = getattr(result, "user", None)
+        if remote_user is None:
+            raise TokenVerificationError("Invalid or expired token.")
+        data = remote_user.model_dump() if hasattr(remote_user, "model_dump") else dict(remote_user)
+        return AuthenticatedUser(
+            id=str(data["id"]),
+            email=data.get("email"),
+            role=data.get("role"),
+            aud=data.get("aud"),
+            app_metadata=data.get("app_metadata") or {},
+            user_metadata=data.get("user_metadata") or {},
+        )
+
+    async def warm(self) -> None:
+        """Fetch the JWKS ahead of the first asymmetric token, when there is no shared secret."""
+        if not self.jwt_secret and self.jwks_url:
+            await self._get_jwk(None)
+
+    async def verify(self, token: str, remote_lookup: Optional[RemoteLookup] = None) -> AuthenticatedUser:
+        cache_key = self._cache_key(token)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        try:
+            claims = await self._verify_locally(token)
+            if claims is not None:
+                self.local_verifications += 1
+                user = AuthenticatedUser.from_claims(claims)
+                expires_at = claims.get("exp")
+            elif self.remote_fallback and remote_lookup is not None:
+                self.remote_verifications += 1
+                user = await self._verify_remotely(token, remote_lookup)
+                expires_at = jwt.get_unverified_claims(token).get("exp")
+            else:
+                raise TokenVerificationError("No key available to verify token locally.")
+        except TokenVerificationError:
+            self.rejections += 1
+            raise
+
+        # Never serve a cached user past the token's own expiry.
+        ttl = self.cache.ttl if expires_at is None else expires_at - time.time()
+        self.cache.set(cache_key, user, ttl=ttl)
+        return user
+
+    def stats(self) -> dict:
+        return {
+            "cache": self.cache.stats(),
+            "local_verifications": self.local_verifications,
+            "remote_verifications": self.remote_verifications,
+            "rejections": self.rejections,
+        }
+
+
+token_verifier = TokenVerifier()
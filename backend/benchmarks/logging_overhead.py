@@ -0,0 +1,131 @@
+"""Per-request cost of logging on the request path, before and after the queue pipeline.
+
+Replays the log calls of one chat turn (auth, context, prompt build, the
+payload dump, OpenAI round trip, saves) N times under:
+
+    baseline   basicConfig(DEBUG) + synchronous StreamHandler, f-strings,
+               json.dumps(messages, indent=2) on every turn
+    pipeline   configure_logging() with APP_ENV as given, lazy %-args and
+               UserText/MessagesPayload wrappers
+
+and reports the mean and p99 time each turn spends in logging calls. The
+pipeline's formatting and writes happen on the listener thread, so they
+are timed separately as "drain".
+
+    cd backend
+    python -m benchmarks.logging_overhead --turns 2000 --env production
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, List
+
+HISTORY = [
+    {"role": "user" if i % 2 else "assistant", "content": "I keep thinking about the week ahead. " * 6}
+    for i in range(20)
+]
+MESSAGES = [{"role": "system", "content": "You are a grounded, warm listener. " * 60}] + HISTORY
+USER_ID = "7a0c1f5e-2b41-4c53-9a3d-0e7f1b2c3d4e"
+SESSION_ID = "c9d8e7f6-a5b4-4c3d-8e2f-1a0b9c8d7e6f"
+
+
+def baseline_turn(logger: logging.Logger) -> None:
+    logger.debug(f"✅ User authenticated: {USER_ID}")
+    logger.info(f"Received message for session {SESSION_ID} from user {USER_ID}: {HISTORY[0]['content'][:30]}...")
+    logger.debug(f"Context for user {USER_ID} assembled (cache_hit=True) in {{'profile': 0.4, 'journal': 1.2}}")
+    logger.info(f"Saved user message {'chat-1'} to session {SESSION_ID}")
+    logger.info(f"Prompt built: {1800}/{4000} tokens, history {20} kept/{0} dropped, truncated=[] dropped=[]")
+    logger.info(f"Sending {len(MESSAGES)} messages to OpenAI for session {SESSION_ID}")
+    logger.info("🔎 OpenAI payload messages:\n%s", json.dumps(MESSAGES, indent=2))
+    logger.info(f"Received AI response for session {SESSION_ID}: {HISTORY[1]['content'][:30]}...")
+    logger.info(f"Saved AI message {'chat-2'} to session {SESSION_ID}")
+
+
+def pipeline_turn(logger: logging.Logger) -> None:
+    from app_refactor.logging_config import MessagesPayload, UserText
+
+    logger.debug("✅ User authenticated: %s", USER_ID)
+    logger.info("Received message for session %s from user %s: %s", SESSION_ID, USER_ID, UserText(HISTORY[0]["content"]))
+    logger.debug("Context for user %s assembled (cache_hit=%s) in %s", USER_ID, True, {"profile": 0.4, "journal": 1.2})
+    logger.info("Saved user message %s to session %s", "chat-1", SESSION_ID)
+    logger.info("Prompt built: %d/%d tokens, history %d kept/%d dropped, truncated=%s dropped=%s",
+                1800, 4000, 20, 0, [], [])
+    logger.info("Sending %s messages to OpenAI for session %s", len(MESSAGES), SESSION_ID)
+    logger.debug("🔎 OpenAI payload messages:\n%s", MessagesPayload(MESSAGES))
+    logger.info("Received AI response for session %s: %s", SESSION_ID, UserText(HISTORY[1]["content"]))
+    logger.info("Saved AI message %s to session %s", "chat-2", SESSION_ID)
+
+
+def measure(turn: Callable[[logging.Logger], None], turns: int, gap: float) -> List[float]:
+    logger = logging.getLogger("bench.app")
+    samples = []
+    for _ in range(turns):
+        start = time.perf_counter()
+        turn(logger)
+        samples.append(time.perf_counter() - start)
+        # A real turn spends most of its time awaiting I/O, which is when the listener catches up
+        time.sleep(gap)
+    return samples
+
+
+def summarize(samples: List[float]) -> dict:
+    ordered = sorted(samples)
+    return {
+        "mean_us": round(sum(ordered) / len(ordered) * 1e6, 1),
+        "p50_us": round(ordered[len(ordered) // 2] * 1e6, 1),
+        "p99_us": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1e6, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=2000)
+    parser.add_argument("--env", default="production", help="APP_ENV for the pipeline run")
+    parser.add_argument("--gap-ms", type=float, default=1.0, help="idle time between turns")
+    parser.add_argument("--output", help="write the results as JSON here")
+    args = parser.parse_args()
+
+    # Real file writes, as on a container's stdout pipe; a StringIO would flatter the baseline
+    with tempfile.TemporaryFile("w") as sink:
+        root = logging.getLogger()
+        handler = logging.StreamHandler(sink)
+        handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+        root.handlers[:] = [handler]
+        root.setLevel(logging.DEBUG)
+        baseline = summarize(measure(baseline_turn, args.turns, args.gap_ms / 1000))
+
+        os.environ["APP_ENV"] = args.env
+        # Room for every record, so the run measures enqueueing rather than dropping
+        os.environ.setdefault("LOG_QUEUE_SIZE", str(args.turns * 10))
+        from app_refactor import logging_config
+        root.handlers[:] = []
+        logging_config.configure_logging(stream=sink)
+        pipeline = summarize(measure(pipeline_turn, args.turns, args.gap_ms / 1000))
+        drain_start = time.perf_counter()
+        dropped = logging_config.logging_stats()["dropped"]
+        logging_config.shutdown_logging()
+        drain = time.perf_counter() - drain_start
+
+    result = {
+        "turns": args.turns,
+        "env": args.env,
+        "gap_ms": args.gap_ms,
+        "baseline": baseline,
+        "pipeline": pipeline,
+        "pipeline_drain_ms": round(drain * 1000, 1),
+        "pipeline_dropped": dropped,
+        "speedup": round(baseline["mean_us"] / pipeline["mean_us"], 1) if pipeline["mean_us"] else None,
+    }
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
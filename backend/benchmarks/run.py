@@ -0,0 +1,410 @@
+"""End-to-end load benchmark for the API.
+
+Boots the stand-in services (``benchmarks.stub_services``) and the app
+(``serve.py`` with ``--workers`` processes) pointed at them, then drives a
+mixed workload from simulated users: signup/login, listing and creating
+sessions, sending messages (plain and streamed), saving journals, and
+fetching summaries and the profile. Reports throughput and p50/p95/p99 latency per route and writes
+the run to ``benchmarks/results/<timestamp>.json`` so runs can be compared.
+
+    cd backend
+    python -m benchmarks.run --users 50 --duration 60
+    python -m benchmarks.run --users 50 --duration 60 --compare benchmarks/results/<earlier>.json
+    python -m benchmarks.run --base-url http://127.0.0.1:8000 --no-boot   # an already running stack
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+JWT_SECRET = "bench-secret"
+# A syntactically valid service key; the stand-in does not check it
+SERVICE_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.bench"
+
+# (action, weight) — roughly how often a user does each thing per think cycle
+WORKLOAD = (
+    ("list_sessions", 15),
+    ("create_session", 4),
+    ("send_message", 25),
+    ("stream_message", 10),
+    ("list_messages", 12),
+    ("save_journal", 8),
+    ("journal_dates", 5),
+    ("chat_summary", 4),
+    ("list_chat_summaries", 7),
+    ("get_profile", 8),
+    ("login", 2),
+)
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Recorder:
+    """Latency samples and outcome counts per route template."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.ttfb: Dict[str, List[float]] = defaultdict(list)
+        self.status: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.recording = False
+
+    def add(self, route: str, seconds: float, status: str, ttfb: Optional[float] = None) -> None:
+        if not self.recording:
+            return
+        self.samples[route].append(seconds)
+        self.status[route][status] += 1
+        if ttfb is not None:
+            self.ttfb[route].append(ttfb)
+
+    @staticmethod
+    def _summary(values: List[float]) -> dict:
+        values = sorted(values)
+        ms = lambda s: round(s * 1000, 2)
+        return {
+            "p50_ms": ms(percentile(values, 50)),
+            "p95_ms": ms(percentile(values, 95)),
+            "p99_ms": ms(percentile(values, 99)),
+            "mean_ms": ms(sum(values) / len(values)) if values else 0.0,
+            "max_ms": ms(values[-1]) if values else 0.0,
+        }
+
+    def report(self, elapsed: float) -> dict:
+        routes = {}
+        for route in sorted(self.samples):
+            values = self.samples[route]
+            statuses = dict(self.status[route])
+            errors = sum(n for s, n in statuses.items() if not s.startswith(("2", "3")))
+            routes[route] = {
+                "requests": len(values),
+                "errors": errors,
+                "rps": round(len(values) / elapsed, 2),
+                **self._summary(values),
+                "status": statuses,
+            }
+            if self.ttfb[route]:
+                routes[route]["ttfb"] = self._summary(self.ttfb[route])
+        everything = [v for values in self.samples.values() for v in values]
+        total_errors = sum(r["errors"] for r in routes.values())
+        return {
+            "overall": {
+                "requests": len(everything),
+                "errors": total_errors,
+                "error_rate": round(total_errors / len(everything), 4) if everything else 0.0,
+                "rps": round(len(everything) / elapsed, 2),
+                **self._summary(everything),
+            },
+            "routes": routes,
+        }
+
+
+class SimulatedUser:
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, rng: random.Random, think_time: float):
+        self.client = client
+        self.recorder = recorder
+        self.rng = rng
+        self.think_time = think_time
+        self.email = f"bench-{uuid.uuid4().hex[:12]}@example.com"
+        self.password = "bench-password"
+        self.token: Optional[str] = None
+        self.sessions: List[str] = []
+        # Sessions with messages; summarizing an empty one is a 404
+        self.chatted: List[str] = []
+        self.journal_day = date.today()
+
+    @property
+    def headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.token}"}
+
+    async def _call(self, route: str, method: str, path: str, **kwargs) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            resp = await self.client.request(method, path, **kwargs)
+        except httpx.HTTPError as e:
+            self.recorder.add(route, time.perf_counter() - start, type(e).__name__)
+            return None
+        self.recorder.add(route, time.perf_counter() - start, str(resp.status_code))
+        return resp
+
+    async def _stream(self, route: str, path: str, **kwargs) -> None:
+        start = time.perf_counter()
+        ttfb = None
+        try:
+            async with self.client.stream("POST", path, **kwargs) as resp:
+                async for _ in resp.aiter_bytes():
+                    if ttfb is None:
+                        ttfb = time.perf_counter() - start
+                status = str(resp.status_code)
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        self.recorder.add(route, time.perf_counter() - start, status, ttfb)
+
+    # ─── Actions ─────────────────────────────────────────────────────────
+    async def signup(self) -> bool:
+        resp = await self._call("POST /api/signup", "POST", "/api/signup",
+                                json={"email": self.email, "password": self.password})
+        if resp is None or resp.status_code != 200 or "access_token" not in resp.json():
+            return False
+        self.token = resp.json()["access_token"]
+        return True
+
+    async def login(self) -> None:
+        resp = await self._call("POST /api/login", "POST", "/api/login",
+                                json={"email": self.email, "password": self.password})
+        if resp is not None and resp.status_code == 200:
+            self.token = resp.json()["access_token"]
+
+    async def list_sessions(self) -> None:
+        await self._call("GET /api/chat-sessions", "GET", "/api/chat-sessions", headers=self.headers)
+
+    async def create_session(self) -> None:
+        resp = await self._call("POST /api/chat-sessions", "POST", "/api/chat-sessions", headers=self.headers)
+        if resp is not None and resp.status_code == 200:
+            self.sessions.append(resp.json()["session"]["session_id"])
+
+    async def _session(self) -> str:
+        if not self.sessions:
+            await self.create_session()
+        return self.rng.choice(self.sessions) if self.sessions else str(uuid.uuid4())
+
+    async def send_message(self) -> None:
+        session_id = await self._session()
+        await self._call("POST /api/chat-sessions/{id}/messages", "POST",
+                         f"/api/chat-sessions/{session_id}/messages", headers=self.headers,
+                         json={"message": f"Today felt {self.rng.choice(('long', 'calm', 'busy', 'heavy'))}."})
+        self._chatted(session_id)
+
+    async def stream_message(self) -> None:
+        session_id = await self._session()
+        await self._stream("POST /api/chat-sessions/{id}/messages/stream",
+                           f"/api/chat-sessions/{session_id}/messages/stream", headers=self.headers,
+                           json={"message": "Can we talk about my week?"})
+        self._chatted(session_id)
+
+    def _chatted(self, session_id: str) -> None:
+        if session_id in self.sessions and session_id not in self.chatted:
+            self.chatted.append(session_id)
+
+    async def list_messages(self) -> None:
+        session_id = await self._session()
+        await self._call("GET /api/chat-sessions/{id}/messages", "GET",
+                         f"/api/chat-sessions/{session_id}/messages", headers=self.headers)
+
+    async def save_journal(self) -> None:
+        # Walk backwards a day at a time so journals accumulate like real usage
+        self.journal_day -= timedelta(days=1)
+        await self._call("POST /api/journals", "POST", "/api/journals", headers=self.headers,
+                         json={"content": f"Journal for {self.journal_day}: slept ok, worked, walked.",
+                               "journal_date": self.journal_day.isoformat()})
+
+    async def journal_dates(self) -> None:
+        await self._call("GET /api/journal-dates", "GET", "/api/journal-dates", headers=self.headers)
+
+    async def chat_summary(self) -> None:
+        if not self.chatted:
+            return await self.send_message()
+        await self._call("POST /api/chat-summaries", "POST", "/api/chat-summaries", headers=self.headers,
+                         json={"session_id": self.rng.choice(self.chatted)})
+
+    async def list_chat_summaries(self) -> None:
+        await self._call("GET /api/chat-summaries", "GET", "/api/chat-summaries", headers=self.headers)
+
+    async def get_profile(self) -> None:
+        await self._call("GET /api/user-profile", "GET", "/api/user-profile", headers=self.headers)
+
+    async def run(self, stop_at: float) -> None:
+        # Spread arrivals so the first second isn't a thundering herd of signups
+        await asyncio.sleep(self.rng.uniform(0, self.think_time * 2))
+        if not await self.signup():
+            return
+        actions, weights = zip(*WORKLOAD)
+        while time.monotonic() < stop_at:
+            await getattr(self, self.rng.choices(actions, weights)[0])()
+            if self.think_time:
+                await asyncio.sleep(self.rng.expovariate(1 / self.think_time))
+
+
+# ─── Process management ─────────────────────────────────────────────────
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _wait_ready(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready within {timeout:.0f}s")
+
+
+def _start(cmd: List[str], env: dict, log_path: Path) -> subprocess.Popen:
+    log = open(log_path, "w")
+    return subprocess.Popen(cmd, cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def _stop(proc: subprocess.Popen) -> None:
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def _stack_env(args, stub_url: str, cache_path: Path, outbox_path: Path) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": str(BACKEND_DIR),
+        "SUPABASE_URL": stub_url,
+        "SUPABASE_SERVICE_KEY": SERVICE_KEY,
+        "SUPABASE_JWT_SECRET": JWT_SECRET,
+        "AUTH_REMOTE_FALLBACK": "false",
+        "OPENAI_API_KEY": "sk-bench",
+        "OPENAI_BASE_URL": f"{stub_url}/v1",
+        "LLM_PROVIDER": "openai",
+        "LLM_CACHE_PATH": str(cache_path),
+        # Never the server's own outbox: leftover rows would be flushed into the real database
+        "WRITE_BEHIND_PATH": str(outbox_path),
+        "FAKE_LLM_LATENCY": args.llm_latency,
+        "FAKE_LLM_TOKENS_PER_SECOND": str(args.llm_tokens_per_second),
+        "FAKE_LLM_OUTPUT_TOKENS": str(args.llm_output_tokens),
+        "FAKE_LLM_ERROR_RATE": str(args.llm_error_rate),
+        "FAKE_LLM_SEED": str(args.seed),
+        "STUB_DB_LATENCY_MS": str(args.db_latency_ms),
+    })
+    return env
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def drive(args, base_url: str) -> dict:
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.users * 2, max_keepalive_connections=args.users * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        users = [SimulatedUser(client, recorder, random.Random(rng.random()), args.think_time)
+                 for _ in range(args.users)]
+        stop_at = time.monotonic() + args.warmup + args.duration
+        tasks = [asyncio.create_task(u.run(stop_at)) for u in users]
+        await asyncio.sleep(args.warmup)
+        recorder.recording = True
+        started = time.monotonic()
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - started
+    return recorder.report(elapsed)
+
+
+def print_report(report: dict, baseline: Optional[dict] = None) -> None:
+    header = f"{'route':48} {'req':>6} {'err':>5} {'rps':>7} {'p50':>8} {'p95':>8} {'p99':>8}"
+    if baseline:
+        header += f" {'Δp50':>8} {'Δp95':>8}"
+    print(header)
+    rows = list(report["routes"].items()) + [("ALL", report["overall"])]
+    for route, r in rows:
+        line = (f"{route:48} {r['requests']:>6} {r['errors']:>5} {r['rps']:>7.1f}"
+                f" {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f}")
+        if baseline:
+            old = baseline["overall"] if route == "ALL" else baseline["routes"].get(route)
+            if old:
+                line += f" {_delta(r['p50_ms'], old['p50_ms']):>8} {_delta(r['p95_ms'], old['p95_ms']):>8}"
+        print(line)
+
+
+def _delta(new: float, old: float) -> str:
+    return f"{(new - old) / old * 100:+.0f}%" if old else "n/a"
+
+
+async def main_async(args) -> dict:
+    run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    procs: List[subprocess.Popen] = []
+    try:
+        if args.no_boot:
+            base_url = args.base_url
+        else:
+            stub_port, app_port = _free_port(), _free_port()
+            stub_url = f"http://127.0.0.1:{stub_port}"
+            base_url = f"http://127.0.0.1:{app_port}"
+            env = _stack_env(args, stub_url, RESULTS_DIR / f".llm_cache-{run_id}.sqlite3",
+                             RESULTS_DIR / f".outbox-{run_id}.sqlite3")
+            procs.append(_start([sys.executable, "-m", "benchmarks.stub_services", "--port", str(stub_port),
+                                 "--db-latency-ms", str(args.db_latency_ms)],
+                                env, RESULTS_DIR / f"{run_id}-stub.log"))
+            await _wait_ready(f"{stub_url}/health")
+            procs.append(_start([sys.executable, "serve.py", "--port", str(app_port),
+                                 "--workers", str(args.workers)],
+                                env, RESULTS_DIR / f"{run_id}-app.log"))
+            await _wait_ready(f"{base_url}/")
+
+        report = await drive(args, base_url)
+    finally:
+        for proc in reversed(procs):
+            _stop(proc)
+        for pattern in (f".llm_cache-{run_id}.sqlite3*", f".outbox-{run_id}.sqlite3*"):
+            for leftover in RESULTS_DIR.glob(pattern):
+                leftover.unlink()
+
+    config = {k: v for k, v in vars(args).items() if k not in ("compare", "output")}
+    result = {"run_id": run_id, "git_commit": _git_commit(), "config": config, **report}
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{run_id}.json"
+    output.write_text(json.dumps(result, indent=2))
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+    print_report(report, baseline)
+    print(f"\nSaved {output}")
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50, help="simulated concurrent users")
+    parser.add_argument("--duration", type=float, default=60, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="unmeasured seconds before recording")
+    parser.add_argument("--think-time", type=float, default=1.0, help="mean seconds between a user's actions")
+    parser.add_argument("--timeout", type=float, default=60, help="per-request timeout")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=1, help="worker processes for the app")
+    parser.add_argument("--db-latency-ms", type=float, default=5, help="added latency per stand-in DB call")
+    parser.add_argument("--llm-latency", default="lognormal:0.4:0.5", help="fake LLM time to first token")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=80)
+    parser.add_argument("--llm-output-tokens", type=int, default=120)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--no-boot", action="store_true", help="target --base-url instead of starting the stack")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--output", help="result file (default benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="earlier result file to diff p50/p95 against")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Cold-start cost of the API: import time and time to the first successful requests.
+
+Each run starts a fresh ``uvicorn app:app`` against the stand-in services
+(``benchmarks.stub_services``) and measures, from the moment the process is
+spawned:
+
+    ready          first 200 from ``GET /``
+    first_api      first authenticated, database-backed request (``GET /api/chat-sessions``)
+    first_chat     first chat turn (``POST /api/chat-sessions/{id}/messages``), the LLM path
+
+``first_api`` and ``first_chat`` are also reported as the latency of that
+single request, which is where lazily created clients and cold connections
+show up. Separately, ``python -X importtime -c "import app"`` is run to
+report the import time of the app module and its heaviest dependencies.
+
+    cd backend
+    python -m benchmarks.startup --runs 5
+    python -m benchmarks.startup --runs 5 --delay 1   # give background warm-up a second first
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+
+from .run import (
+    BACKEND_DIR, JWT_SECRET, RESULTS_DIR, SERVICE_KEY, _free_port, _git_commit, _start, _stop, _wait_ready,
+)
+
+
+def import_times(module: str, env: dict, top: int) -> dict:
+    """Cumulative import time of ``module`` and the packages that account for most of it."""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                         cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True).stderr
+    packages: Dict[str, int] = {}
+    total_us = 0
+    for line in out.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue  # the header line
+        name = name.strip()
+        if name == module:
+            total_us = int(cumulative)
+        # Self time summed per top-level package, so nested imports are not counted twice
+        root = name.split(".")[0]
+        packages[root] = packages.get(root, 0) + int(self_us)
+    heaviest = sorted(packages.items(), key=lambda p: -p[1])[:top]
+    return {"total_ms": round(total_us / 1000, 1), "heaviest_ms": {n: round(us / 1000, 1) for n, us in heaviest}}
+
+
+async def one_run(env: dict, stub_url: str, app_module: str, delay: float, log_path: Path) -> dict:
+    async with httpx.AsyncClient(timeout=60) as client:
+        # A fresh user per run, signed up with the stand-in directly so the app sees no extra request
+        resp = await client.post(f"{stub_url}/auth/v1/signup", json={
+            "email": f"startup-{time.time_ns()}@example.com", "password": "startup-password"})
+        headers = {"Authorization": f"Bearer {resp.json()['access_token']}"}
+
+        port = _free_port()
+        base = f"http://127.0.0.1:{port}"
+        spawned = time.perf_counter()
+        proc = _start([sys.executable, "-m", "uvicorn", app_module, "--port", str(port), "--log-level", "warning"],
+                      env, log_path)
+        try:
+            while True:
+                try:
+                    if (await client.get(f"{base}/")).status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                if proc.poll() is not None:
+                    raise RuntimeError(f"app exited during startup, see {log_path}")
+                await asyncio.sleep(0.01)
+            ready = time.perf_counter() - spawned
+            if delay:
+                await asyncio.sleep(delay)
+
+            start = time.perf_counter()
+            resp = await client.get(f"{base}/api/chat-sessions", headers=headers)
+            resp.raise_for_status()
+            first_api_latency = time.perf_counter() - start
+            first_api = time.perf_counter() - spawned
+
+            session = (await client.post(f"{base}/api/chat-sessions", headers=headers)).json()
+            session_id = session.get("session_id") or session.get("session", {}).get("session_id")
+            start = time.perf_counter()
+            resp = await client.post(f"{base}/api/chat-sessions/{session_id}/messages",
+                                     headers=headers, json={"message": "Hello, first message of the day."})
+            resp.raise_for_status()
+            first_chat_latency = time.perf_counter() - start
+            first_chat = time.perf_counter() - spawned
+        finally:
+            _stop(proc)
+    return {
+        "ready_ms": ready * 1000,
+        "first_api_ms": first_api * 1000,
+        "first_api_latency_ms": first_api_latency * 1000,
+        "first_chat_ms": first_chat * 1000,
+        "first_chat_latency_ms": first_chat_latency * 1000,
+    }
+
+
+def summarize(runs: List[dict]) -> dict:
+    return {
+        metric: {
+            "median": round(statistics.median(r[metric] for r in runs), 1),
+            "min": round(min(r[metric] for r in runs), 1),
+            "max": round(max(r[metric] for r in runs), 1),
+        }
+        for metric in runs[0]
+    }
+
+
+async def main_async(args) -> dict:
+    run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    stub_port = _free_port()
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": str(BACKEND_DIR),
+        "SUPABASE_URL": stub_url,
+        "SUPABASE_SERVICE_KEY": SERVICE_KEY,
+        "SUPABASE_JWT_SECRET": JWT_SECRET,
+        "AUTH_REMOTE_FALLBACK": "false",
+        "OPENAI_API_KEY": "sk-bench",
+        "OPENAI_BASE_URL": f"{stub_url}/v1",
+        "LLM_PROVIDER": "openai",
+        "LLM_CACHE_ENABLED": "false",
+        "WRITE_BEHIND_PATH": str(RESULTS_DIR / f".outbox-{run_id}.sqlite3"),
+        # Near-instant fake model, so first_chat shows cold-start cost rather than generation time
+        "FAKE_LLM_LATENCY": "fixed:0.01",
+        "FAKE_LLM_TOKENS_PER_SECOND": "100000",
+        "STUB_DB_LATENCY_MS": str(args.db_latency_ms),
+    })
+
+    imports = import_times(args.app.split(":")[0], env, args.top)
+    stub = _start([sys.executable, "-m", "benchmarks.stub_services", "--port", str(stub_port),
+                   "--db-latency-ms", str(args.db_latency_ms)], env, RESULTS_DIR / f"{run_id}-stub.log")
+    runs = []
+    try:
+        await _wait_ready(f"{stub_url}/health")
+        for i in range(args.runs):
+            runs.append(await one_run(env, stub_url, args.app, args.delay, RESULTS_DIR / f"{run_id}-app.log"))
+    finally:
+        _stop(stub)
+        for leftover in RESULTS_DIR.glob(f".outbox-{run_id}.sqlite3*"):
+            leftover.unlink()
+
+    result = {
+        "run_id": run_id,
+        "git_commit": _git_commit(),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "import": imports,
+        "startup": summarize(runs),
+        "runs": [{k: round(v, 1) for k, v in r.items()} for r in runs],
+    }
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{run_id}-startup.json"
+    output.write_text(json.dumps(result, indent=2))
+
+    print(f"import {args.app.split(':')[0]}: {imports['total_ms']:.0f} ms")
+    for name, ms in imports["heaviest_ms"].items():
+        print(f"  {name:<30} {ms:8.1f} ms")
+    print(f"\n{'metric':<24}{'median':>10}{'min':>10}{'max':>10}   ({args.runs} runs)")
+    for metric, stats in result["startup"].items():
+        print(f"{metric:<24}{stats['median']:>10.1f}{stats['min']:>10.1f}{stats['max']:>10.1f}")
+    print(f"\nSaved {output}")
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="cold starts to measure")
+    parser.add_argument("--app", default="app:app", help="ASGI app to start, as given to uvicorn")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to wait after ready before the first API call")
+    parser.add_argument("--db-latency-ms", type=float, default=5, help="added latency per stand-in DB call")
+    parser.add_argument("--top", type=int, default=8, help="heaviest imported packages to list")
+    parser.add_argument("--output", help="result file (default benchmarks/results/<timestamp>-startup.json)")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
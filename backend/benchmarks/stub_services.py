@@ -0,0 +1,410 @@
+"""Local stand-ins for Supabase (PostgREST + GoTrue) and the chat-completions API.
+
+Just enough of each protocol for the backend's own queries: PostgREST
+select/insert/upsert/update/delete with eq/neq/gt/gte/lt/lte/in/is filters, ``or=``
+groups, ``order`` and ``limit`` over in-memory tables; GoTrue signup,
+password login, refresh and ``/user`` with HS256 tokens signed by
+``SUPABASE_JWT_SECRET``; ``/v1/chat/completions`` (plain and streamed) backed
+by the fake LLM provider.
+
+    python -m benchmarks.stub_services --port 54321 --db-latency-ms 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+import uvicorn
+from jose import jwt
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from app_refactor.llm import Usage
+from app_refactor.llm_fake import FakeProvider
+
+JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET", "bench-secret")
+ACCESS_TOKEN_TTL = 3600
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+# Generated columns per table, mirroring the Supabase schema defaults.
+_DEFAULTS: Dict[str, Dict[str, Callable[[], object]]] = {
+    "Users": {"created_at": _now},
+    "ChatHistory": {"created_at": _now},
+    "Journals": {"created_at": _now},
+    "JournalSummaries": {"inserted_at": _now, "stale": lambda: False},
+    "ChatSessions": {"session_id": lambda: str(uuid.uuid4()), "created_at": _now, "notes": lambda: None},
+    "ChatMessages": {"chat_id": lambda: str(uuid.uuid4()), "created_at": _now},
+    "ChatSummaries": {"id": lambda: str(uuid.uuid4()), "inserted_at": _now,
+                      "last_message_at": lambda: None, "last_message_id": lambda: None},
+    "UserProfiles": {"updated_at": _now},
+}
+_SERIAL_ID_TABLES = ("ChatHistory", "Journals", "JournalSummaries")
+# Generated (computed) columns per table
+_GENERATED: Dict[str, Dict[str, Callable[[dict], object]]] = {
+    "JournalSummaries": {"daily": lambda r: r.get("start_date") == r.get("end_date")},
+}
+
+
+def _latest_per_session(rows: List[dict]) -> List[dict]:
+    latest: Dict[str, dict] = {}
+    for r in rows:
+        key = str(r.get("session_id") or r.get("id"))
+        if key not in latest or (r["inserted_at"], str(r["id"])) > (latest[key]["inserted_at"], str(latest[key]["id"])):
+            latest[key] = r
+    return list(latest.values())
+
+
+# Read-only views: name -> (base table, rows of the base table -> rows of the view)
+_VIEWS: Dict[str, Tuple[str, Callable[[List[dict]], List[dict]]]] = {
+    "LatestChatSummaries": ("ChatSummaries", _latest_per_session),
+}
+
+
+# ─── PostgREST filter grammar ────────────────────────────────────────────
+def _unquote(value: str) -> str:
+    return value[1:-1] if len(value) >= 2 and value[0] == value[-1] == '"' else value
+
+
+def _split_top(expr: str) -> List[str]:
+    """Split on commas that are outside parentheses and quotes."""
+    parts, depth, quoted, start = [], 0, False, 0
+    for i, ch in enumerate(expr):
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and ch == ",":
+            parts.append(expr[start:i])
+            start = i + 1
+    parts.append(expr[start:])
+    return [p for p in parts if p]
+
+
+def _compare(op: str, actual, expected: str) -> bool:
+    if op == "is":
+        return actual is None if expected == "null" else str(actual).lower() == expected
+    if op == "in":
+        return actual is not None and str(actual) in [_unquote(v) for v in _split_top(expected.strip("()"))]
+    if actual is None:
+        return False
+    actual, expected = str(actual), _unquote(expected)
+    return {
+        "eq": actual == expected,
+        "neq": actual != expected,
+        "gt": actual > expected,
+        "gte": actual >= expected,
+        "lt": actual < expected,
+        "lte": actual <= expected,
+    }[op]
+
+
+def _condition(expr: str) -> Callable[[dict], bool]:
+    """One ``col.op.value``, ``and(...)`` or ``or(...)`` term of an ``or=`` group."""
+    for group, combine in (("and(", all), ("or(", any)):
+        if expr.startswith(group):
+            terms = [_condition(t) for t in _split_top(expr[len(group):-1])]
+            return lambda row, terms=terms, combine=combine: combine(t(row) for t in terms)
+    column, op, value = expr.split(".", 2)
+    return lambda row: _compare(op, row.get(column), value)
+
+
+class Tables:
+    """In-memory tables behind the PostgREST stand-in."""
+
+    def __init__(self):
+        self.rows: Dict[str, List[dict]] = defaultdict(list)
+        self.serial: Dict[str, int] = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def _with_defaults(self, table: str, row: dict) -> dict:
+        row = dict(row)
+        for column, default in _DEFAULTS.get(table, {}).items():
+            if row.get(column) is None:
+                row[column] = default()
+        if table in _SERIAL_ID_TABLES and row.get("id") is None:
+            self.serial[table] += 1
+            row["id"] = self.serial[table]
+        return self._generate(table, row)
+
+    @staticmethod
+    def _generate(table: str, row: dict) -> dict:
+        for column, compute in _GENERATED.get(table, {}).items():
+            row[column] = compute(row)
+        return row
+
+    def select(self, table: str, filters: List[Callable[[dict], bool]], order: List[Tuple[str, bool]],
+               limit: Optional[int], offset: int = 0) -> List[dict]:
+        with self.lock:
+            if table in _VIEWS:
+                base, view = _VIEWS[table]
+                source = view(list(self.rows[base]))
+            else:
+                source = self.rows[table]
+            rows = [r for r in source if all(f(r) for f in filters)]
+        for column, desc in reversed(order):
+            rows.sort(key=lambda r: (r.get(column) is None, str(r.get(column) or "")), reverse=desc)
+        rows = rows[offset:]
+        return rows[:limit] if limit is not None else rows
+
+    def insert(self, table: str, rows: List[dict], on_conflict: Optional[List[str]],
+               ignore_duplicates: bool = False) -> List[dict]:
+        out = []
+        with self.lock:
+            for row in rows:
+                if on_conflict:
+                    key = tuple(str(row.get(c)) for c in on_conflict)
+                    existing = next((r for r in self.rows[table]
+                                     if tuple(str(r.get(c)) for c in on_conflict) == key
+                                     and all(row.get(c) is not None for c in on_conflict)), None)
+                    if existing is not None:
+                        if not ignore_duplicates:
+                            existing.update(row)
+                            self._generate(table, existing)
+                            out.append(dict(existing))
+                        continue
+                new = self._with_defaults(table, row)
+                self.rows[table].append(new)
+                out.append(dict(new))
+        return out
+
+    def update(self, table: str, filters: List[Callable[[dict], bool]], values: dict) -> List[dict]:
+        out = []
+        with self.lock:
+            for r in self.rows[table]:
+                if all(f(r) for f in filters):
+                    r.update(values)
+                    out.append(dict(self._generate(table, r)))
+        return out
+
+    def delete(self, table: str, filters: List[Callable[[dict], bool]]) -> List[dict]:
+        with self.lock:
+            keep, gone = [], []
+            for r in self.rows[table]:
+                (gone if all(f(r) for f in filters) else keep).append(r)
+            self.rows[table] = keep
+        return gone
+
+
+def _project(row: dict, select: str) -> dict:
+    columns = [c.strip() for c in select.split(",") if c.strip()]
+    if not columns or "*" in columns:
+        return row
+    return {c: row.get(c) for c in columns}
+
+
+def _parse_query(request: Request):
+    filters, order, limit, offset, select = [], [], None, 0, "*"
+    for key, value in request.query_params.multi_items():
+        if key == "select":
+            select = value
+        elif key == "order":
+            for part in value.split(","):
+                column, *mods = part.split(".")
+                order.append((column, "desc" in mods))
+        elif key == "limit":
+            limit = int(value)
+        elif key == "offset":
+            offset = int(value)
+        elif key in ("on_conflict", "columns"):
+            continue
+        elif key in ("or", "and"):
+            filters.append(_condition(f"{key}{value}"))
+        else:
+            op, _, operand = value.partition(".")
+            filters.append(lambda row, c=key, op=op, v=operand: _compare(op, row.get(c), v))
+    return filters, order, limit, offset, select
+
+
+# ─── GoTrue ──────────────────────────────────────────────────────────────
+class Auth:
+    def __init__(self):
+        self.users_by_email: Dict[str, dict] = {}
+        self.refresh_tokens: Dict[str, str] = {}
+
+    def _user(self, user_id: str, email: str) -> dict:
+        now = _now()
+        return {
+            "id": user_id, "aud": "authenticated", "role": "authenticated", "email": email,
+            "app_metadata": {"provider": "email"}, "user_metadata": {},
+            "created_at": now, "updated_at": now, "confirmed_at": now, "email_confirmed_at": now,
+        }
+
+    def session(self, user: dict) -> dict:
+        now = int(time.time())
+        access = jwt.encode({
+            "sub": user["id"], "email": user["email"], "aud": "authenticated", "role": "authenticated",
+            "iat": now, "exp": now + ACCESS_TOKEN_TTL, "session_id": str(uuid.uuid4()),
+        }, JWT_SECRET, algorithm="HS256")
+        refresh = uuid.uuid4().hex
+        self.refresh_tokens[refresh] = user["email"]
+        return {
+            "access_token": access, "token_type": "bearer", "expires_in": ACCESS_TOKEN_TTL,
+            "expires_at": now + ACCESS_TOKEN_TTL, "refresh_token": refresh, "user": user,
+        }
+
+    def signup(self, email: str, password: str) -> dict:
+        record = self.users_by_email.get(email)
+        if record is None:
+            record = {"password": password, "user": self._user(str(uuid.uuid4()), email)}
+            self.users_by_email[email] = record
+        return self.session(record["user"])
+
+    def login(self, email: str, password: str) -> Optional[dict]:
+        record = self.users_by_email.get(email)
+        if record is None or record["password"] != password:
+            return None
+        return self.session(record["user"])
+
+
+def usage_json(usage: Usage) -> dict:
+    """``Usage`` in the shape of OpenAI's ``usage`` object."""
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "total_tokens": usage.total_tokens,
+        "prompt_tokens_details": {"cached_tokens": usage.cached_tokens},
+    }
+
+
+def create_app(db_latency_ms: float = 0.0, llm: Optional[FakeProvider] = None) -> Starlette:
+    tables = Tables()
+    auth = Auth()
+    llm = llm or FakeProvider.from_env()
+
+    async def db_delay() -> None:
+        if db_latency_ms:
+            await asyncio.sleep(db_latency_ms / 1000)
+
+    async def rest(request: Request) -> Response:
+        await db_delay()
+        table = request.path_params["table"]
+        filters, order, limit, offset, select = _parse_query(request)
+        if request.method == "GET":
+            rows = tables.select(table, filters, order, limit, offset)
+            return JSONResponse([_project(r, select) for r in rows])
+        if request.method == "DELETE":
+            return JSONResponse(tables.delete(table, filters))
+        body = await request.json()
+        prefer = request.headers.get("prefer", "")
+        if request.method == "PATCH":
+            updated = tables.update(table, filters, body)
+            return Response(status_code=204) if "return=minimal" in prefer else JSONResponse(updated)
+        rows = body if isinstance(body, list) else [body]
+        on_conflict = None
+        if "resolution=" in prefer:
+            on_conflict = [c.strip() for c in request.query_params.get("on_conflict", "").split(",") if c.strip()]
+        inserted = tables.insert(table, rows, on_conflict, ignore_duplicates="ignore-duplicates" in prefer)
+        if "return=minimal" in prefer:
+            return Response(status_code=201)
+        return JSONResponse(inserted, status_code=201)
+
+    async def signup(request: Request) -> Response:
+        await db_delay()
+        body = await request.json()
+        return JSONResponse(auth.signup(body["email"], body["password"]))
+
+    async def token(request: Request) -> Response:
+        await db_delay()
+        body = await request.json()
+        grant = request.query_params.get("grant_type")
+        if grant == "password":
+            session = auth.login(body.get("email"), body.get("password"))
+        elif grant == "refresh_token":
+            email = auth.refresh_tokens.pop(body.get("refresh_token"), None)
+            session = auth.session(auth.users_by_email[email]["user"]) if email else None
+        else:
+            session = None
+        if session is None:
+            return JSONResponse({"error": "invalid_grant", "error_description": "Invalid login credentials"},
+                                status_code=400)
+        return JSONResponse(session)
+
+    async def user(request: Request) -> Response:
+        await db_delay()
+        token_value = request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+        try:
+            claims = jwt.decode(token_value, JWT_SECRET, algorithms=["HS256"], audience="authenticated")
+        except Exception:
+            return JSONResponse({"msg": "invalid JWT"}, status_code=401)
+        record = auth.users_by_email.get(claims.get("email"))
+        if record is None:
+            return JSONResponse({"msg": "user not found"}, status_code=404)
+        return JSONResponse(record["user"])
+
+    async def chat_completions(request: Request) -> Response:
+        body = await request.json()
+        body.pop("stream_options", None)
+        stream = body.pop("stream", False)
+        created = int(time.time())
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        model = body.get("model", "fake")
+
+        if not stream:
+            result = await llm.complete(**body)
+            return JSONResponse({
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": result.finish_reason,
+                             "message": {"role": "assistant", "content": result.text}}],
+                "usage": usage_json(result.usage),
+            })
+
+        async def events():
+            def chunk(delta: dict, finish: Optional[str] = None, usage: Optional[Usage] = None) -> str:
+                payload = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [] if usage else [{"index": 0, "delta": delta, "finish_reason": finish}],
+                }
+                if usage:
+                    payload["usage"] = usage_json(usage)
+                return f"data: {json.dumps(payload)}\n\n"
+
+            yield chunk({"role": "assistant", "content": ""})
+            async for item in llm.stream(**body):
+                if isinstance(item, Usage):
+                    yield chunk({}, finish="stop")
+                    yield chunk({}, usage=item)
+                else:
+                    yield chunk({"content": item})
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    async def health(request: Request) -> Response:
+        return JSONResponse({"ok": True, "rows": {t: len(r) for t, r in tables.rows.items()}})
+
+    return Starlette(routes=[
+        Route("/health", health),
+        Route("/rest/v1/{table}", rest, methods=["GET", "POST", "PATCH", "DELETE"]),
+        Route("/auth/v1/signup", signup, methods=["POST"]),
+        Route("/auth/v1/token", token, methods=["POST"]),
+        Route("/auth/v1/user", user, methods=["GET"]),
+        Route("/v1/chat/completions", chat_completions, methods=["POST"]),
+    ])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument("--db-latency-ms", type=float, default=float(os.getenv("STUB_DB_LATENCY_MS", "0")))
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.db_latency_ms), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
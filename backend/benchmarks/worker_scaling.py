@@ -0,0 +1,75 @@
+"""How throughput and latency change with the number of worker processes.
+
+Runs the load benchmark (``benchmarks.run``) once per worker count, with
+the same workload and seed, and reports overall throughput and latency side
+by side, plus the speed-up over the first count. Each run is also saved on
+its own as usual. Scaling is bounded by the cores available: on a single
+core more workers only add context switches.
+
+    cd backend
+    python -m benchmarks.worker_scaling --workers 1,2,4 --users 50 --duration 30
+"""
+import argparse
+import asyncio
+import json
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+from .run import RESULTS_DIR, _git_commit, main_async
+
+
+def print_table(rows: list) -> None:
+    print(f"{'workers':>7} {'req':>7} {'err':>5} {'rps':>7} {'speedup':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    base_rps = rows[0]["rps"] or 1
+    for r in rows:
+        print(f"{r['workers']:>7} {r['requests']:>7} {r['errors']:>5} {r['rps']:>7.1f} {r['rps'] / base_rps:>7.2f}x"
+              f" {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f}")
+
+
+async def sweep(args) -> dict:
+    run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    rows = []
+    for workers in args.workers:
+        print(f"\n== {workers} worker(s) ==")
+        run_args = argparse.Namespace(**{**vars(args), "workers": workers, "output": None, "compare": None,
+                                         "no_boot": False, "base_url": None})
+        result = await main_async(run_args)
+        rows.append({"workers": workers, "run_id": result["run_id"], **result["overall"]})
+
+    print()
+    print_table(rows)
+    summary = {
+        "run_id": run_id,
+        "git_commit": _git_commit(),
+        "cpu_count": os.cpu_count(),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "runs": rows,
+    }
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{run_id}-worker-scaling.json"
+    output.write_text(json.dumps(summary, indent=2))
+    print(f"\nSaved {output}")
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=lambda v: [int(n) for n in v.split(",")], default=[1, 2, 4],
+                        help="comma-separated worker counts")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument("--think-time", type=float, default=1.0)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--db-latency-ms", type=float, default=5)
+    parser.add_argument("--llm-latency", default="lognormal:0.4:0.5")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=80)
+    parser.add_argument("--llm-output-tokens", type=int, default=120)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="summary file (default benchmarks/results/<timestamp>-worker-scaling.json)")
+    asyncio.run(sweep(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+-- Watermark for incremental chat summarization: the newest ChatMessages row
+-- (created_at, chat_id) folded into each ChatSummaries row.
+alter table "ChatSummaries"
+    add column if not exists last_message_at timestamptz,
+    add column if not exists last_message_id text;
+
+create index if not exists chat_summaries_session_inserted_idx
+    on "ChatSummaries" (session_id, inserted_at desc);
+
+create index if not exists chat_messages_session_created_idx
+    on "ChatMessages" (session_id, created_at, chat_id);
@@ -0,0 +1,5 @@
+-- One ChatSummaries row per (session, watermark) so batch ingests can upsert
+-- idempotently. Rows from before watermarks have a null last_message_id and
+-- are not constrained.
+create unique index if not exists chat_summaries_session_watermark_key
+    on "ChatSummaries" (session_id, last_message_id);
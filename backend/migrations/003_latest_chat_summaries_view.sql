@@ -0,0 +1,7 @@
+-- Each incremental fold inserts a new ChatSummaries row for the session, so
+-- listing the table shows every superseded partial summary. The view keeps
+-- only the newest row per session (rows without a session stand alone).
+create or replace view "LatestChatSummaries" with (security_invoker = true) as
+select distinct on (coalesce(session_id::text, id::text)) *
+from "ChatSummaries"
+order by coalesce(session_id::text, id::text), inserted_at desc, id desc;
@@ -0,0 +1,10 @@
+-- Saving a journal used to delete the week/month summaries covering that
+-- day, so a summary the user had asked for disappeared. They are now kept and
+-- flagged stale until regenerated. ``daily`` tags the one-day rows so the
+-- chat context can read those without the roll-ups built from them.
+alter table "JournalSummaries"
+    add column if not exists stale boolean not null default false,
+    add column if not exists daily boolean generated always as (start_date = end_date) stored;
+
+create index if not exists journal_summaries_user_daily_idx
+    on "JournalSummaries" (user_id, daily, start_date);
@@ -0,0 +1,82 @@
+"""Production entry point: ``app:app`` under a supervisor of worker processes.
+
+    python serve.py --host 0.0.0.0 --port 8000 --workers 4
+
+Each worker is a separate interpreter with its own event loop, so the API
+uses more than one core. The workers share one host-wide cache tier
+(``app_refactor.shared_cache``): a token verified, or a context bundle
+assembled, by one worker is reused by the others. The tier is a fresh file
+per server run, removed on exit.
+
+The supervisor is uvicorn's, and it is used even for a single worker so
+that reloads never drop requests:
+
+    kill -HUP <pid>     rolling restart: each new worker must be ready before
+                        the one it replaces is stopped (picks up new code)
+    kill -TTIN <pid>    one more worker
+    kill -TTOU <pid>    one fewer worker
+    kill -TERM <pid>    stop; workers finish in-flight requests first
+
+A stopping worker gets ``GRACEFUL_TIMEOUT`` seconds to drain its requests
+and flush buffered chat messages. Options fall back to the environment:
+
+    HOST, PORT                  bind address
+    WEB_CONCURRENCY             worker count (default: CPU count, at most 4)
+    GRACEFUL_TIMEOUT            seconds a stopping worker may take
+    WORKER_HEALTHCHECK_TIMEOUT  seconds a worker has to answer the supervisor
+                                (and a new worker to start) before it is replaced
+"""
+import argparse
+import os
+from pathlib import Path
+
+DEFAULT_WORKERS = min(os.cpu_count() or 1, 4)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app", default="app:app", help="import string of the ASGI app")
+    parser.add_argument("--host", default=os.getenv("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", str(DEFAULT_WORKERS))))
+    parser.add_argument("--graceful-timeout", type=float, default=float(os.getenv("GRACEFUL_TIMEOUT", "30")))
+    parser.add_argument(
+        "--healthcheck-timeout", type=float, default=float(os.getenv("WORKER_HEALTHCHECK_TIMEOUT", "30"))
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    # Workers are spawned, not forked: they read the tier's path from the
+    # environment when they import the app.
+    owns_cache = not os.getenv("SHARED_CACHE_PATH")
+    if owns_cache:
+        from app_refactor.shared_cache import default_path
+
+        os.environ["SHARED_CACHE_PATH"] = default_path()
+
+    import uvicorn
+    from uvicorn.supervisors import Multiprocess
+
+    config = uvicorn.Config(
+        args.app,
+        host=args.host,
+        port=args.port,
+        workers=max(1, args.workers),
+        timeout_graceful_shutdown=args.graceful_timeout,
+        timeout_worker_healthcheck=args.healthcheck_timeout,
+    )
+    sock = config.bind_socket()
+    try:
+        Multiprocess(config, sockets=[sock]).run()
+    finally:
+        sock.close()
+        if owns_cache:
+            path = os.environ["SHARED_CACHE_PATH"]
+            for suffix in ("", "-wal", "-shm"):
+                Path(path + suffix).unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Fire concurrent POST /api/chat-sessions/{id}/messages requests and report
+whether they overlap. A single request is timed first as the baseline; with a
+blocking event loop N concurrent requests take ~N baselines of wall time, with
+the async data layer they take about one.
+
+    python testing_scripts/load_test_session_messages.py --session-id <uuid> -n 10
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+import httpx
+from dotenv import load_dotenv
+
+env_path = Path(__file__).resolve().parent.parent / ".env"
+load_dotenv(env_path)
+
+
+async def send_one(http: httpx.AsyncClient, url: str, i: int) -> float:
+    start = time.perf_counter()
+    resp = await http.post(url, json={"message": f"Load test message #{i}"})
+    elapsed = time.perf_counter() - start
+    status = "[OK]" if resp.is_success else "[ERROR]"
+    print(f"{status} request {i}: {resp.status_code} in {elapsed:.2f}s")
+    return elapsed
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default=os.getenv("BASE_URL", "http://localhost:8000"))
+    parser.add_argument("--session-id", default=os.getenv("SESSION_ID"))
+    parser.add_argument("-n", "--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    access_token = os.getenv("ACCESS_TOKEN")
+    if not access_token or not args.session_id:
+        print("❌ ACCESS_TOKEN and --session-id (or SESSION_ID) are required, aborting.")
+        sys.exit(1)
+
+    url = f"{args.base_url}/api/chat-sessions/{args.session_id}/messages"
+    headers = {"Authorization": f"Bearer {access_token}"}
+    async with httpx.AsyncClient(headers=headers, timeout=120) as http:
+        baseline = await send_one(http, url, 0)
+        wall_start = time.perf_counter()
+        latencies = await asyncio.gather(*(send_one(http, url, i) for i in range(1, args.concurrency + 1)))
+        wall = time.perf_counter() - wall_start
+
+    print(f"\n{args.concurrency} concurrent requests")
+    print(f"  single request:      {baseline:.2f}s")
+    print(f"  wall time:           {wall:.2f}s")
+    print(f"  slowest request:     {max(latencies):.2f}s")
+    # ~1.0 means the requests ran in parallel, ~N means they were processed one at a time.
+    print(f"  serialization ratio: {wall / baseline:.2f} (of {args.concurrency})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())